@@ -1,33 +1,171 @@
 import os
 import json
 import asyncio
-from typing import Dict, List, Tuple, Optional
+import time
+import threading
+from typing import Any, Dict, List, Tuple, Optional
 from collections import Counter, defaultdict
-import google.generativeai as genai
+
+import metrics
+import tracing
 
 # Gemini API設定
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+GEMINI_MODEL_NAME = "gemini-2.0-flash-exp"
+
+# モデルバックエンド（gemini / mock / none）
+AI_BACKEND = os.environ.get("AI_BACKEND", "gemini").strip().lower()
+
+# 429（レート制限）時のリトライ設定
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "1"))
+LLM_RETRY_BACKOFF_SECONDS = float(os.environ.get("LLM_RETRY_BACKOFF_SECONDS", "1.0"))
 
 # 5段階スコア
 STAR_MAP = {"A": 1, "B": 2, "C": 3, "D": 4, "E": 5}
 
+_UNSET = object()
+
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "llm_request_seconds", "Latency of one LLM generate_content call", ["method", "outcome"]
+)
+LLM_TOKENS_TOTAL = metrics.counter(
+    "llm_tokens_total", "Tokens reported by the LLM usage metadata", ["method", "kind"]
+)
+LLM_RETRIES_TOTAL = metrics.counter("llm_retries_total", "Retries after a 429 response", ["method"])
+LLM_FALLBACKS_TOTAL = metrics.counter(
+    "llm_fallbacks_total", "Responses served by the rule-based fallback instead of the LLM", ["method", "reason"]
+)
+
+
+# サーキットブレーカー／ヘッジで包むか（llm_resilience.py）
+LLM_CIRCUIT_BREAKER = os.environ.get("LLM_CIRCUIT_BREAKER", "1") == "1"
+
+
+def _create_backend_model() -> Optional[Any]:
+    if AI_BACKEND == "mock":
+        from mock_llm import MockGenerativeModel
+        return MockGenerativeModel.from_env()
+    if AI_BACKEND == "none" or not GEMINI_API_KEY:
+        return None
+    # SDK の import は重い（1秒前後）ため、実際にモデルを作るときまで遅らせる
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    # Gemini 2.0 Flash を使用（最新で高速）
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+
+def create_default_model() -> Optional[Any]:
+    """環境変数 AI_BACKEND に応じてモデルバックエンドを生成"""
+    model = _create_backend_model()
+    if model is not None and LLM_CIRCUIT_BREAKER:
+        from llm_resilience import ResilientModel
+        model = ResilientModel(model)
+    return model
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """429（ResourceExhausted）系のエラーか判定"""
+    if getattr(e, "code", None) == 429:
+        return True
+    return type(e).__name__ == "ResourceExhausted" or "429" in str(e)
+
+
+def _extract_json(result_text: str) -> Dict:
+    """応答テキストからJSONを取り出す（```json ``` で囲まれている場合に対応）"""
+    if "```json" in result_text:
+        result_text = result_text.split("```json")[1].split("```")[0].strip()
+    elif "```" in result_text:
+        result_text = result_text.split("```")[1].split("```")[0].strip()
+    return json.loads(result_text)
+
+
+def _record_usage(method: str, response: Any) -> None:
+    """usage_metadata（Gemini / 擬似モデル）があればトークン数を記録"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, attr in (("prompt", "prompt_token_count"), ("completion", "candidates_token_count")):
+        n = getattr(usage, attr, None)
+        if n:
+            LLM_TOKENS_TOTAL.inc(n, method=method, kind=kind)
+
 
 class AIMatchingEngine:
     """Google Gemini APIを使った高度なマッチングエンジン"""
     
-    def __init__(self):
-        if GEMINI_API_KEY:
-            genai.configure(api_key=GEMINI_API_KEY)
-            # Gemini 2.0 Flash を使用（最新で高速）
-            self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        else:
-            self.model = None
+    def __init__(self, model: Any = _UNSET):
+        """
+        Args:
+            model: generate_content(prompt, generation_config=...) を持つバックエンド。
+                   省略時は環境変数から初回利用時に生成、None ならAIを使わずフォールバックのみ
+        """
+        self._model = model
+        self._model_lock = threading.Lock()
+        self.max_retries = LLM_MAX_RETRIES
+        self.retry_backoff = LLM_RETRY_BACKOFF_SECONDS
+        # メソッド別のフォールバック回数
+        self.fallback_counts: Counter = Counter()
+
+    @property
+    def model(self) -> Optional[Any]:
+        """バックエンドモデル（未生成なら生成する。同期処理のため初回はスレッドから呼ぶ）"""
+        if self._model is _UNSET:
+            with self._model_lock:
+                if self._model is _UNSET:
+                    self._model = create_default_model()
+        return self._model
+
+    @model.setter
+    def model(self, model: Optional[Any]) -> None:
+        self._model = model
+
+    @property
+    def model_loaded(self) -> bool:
+        return self._model is not _UNSET
+
+    async def _ensure_model(self) -> Optional[Any]:
+        """イベントループを止めないよう、初回のモデル生成だけスレッドで行う"""
+        if self._model is _UNSET:
+            return await asyncio.to_thread(lambda: self.model)
+        return self._model
+
+    async def _generate(self, prompt: str, generation_config: Dict, method: str = "unknown") -> str:
+        """モデルを呼び出して応答テキストを返す（429時は指数バックオフでリトライ）"""
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            with tracing.span(f"llm.{method}", attempt=attempt) as span:
+                try:
+                    response = await asyncio.to_thread(
+                        self.model.generate_content,
+                        prompt,
+                        generation_config=generation_config
+                    )
+                    text = response.text.strip()
+                except Exception as e:
+                    LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, method=method, outcome="error")
+                    span.set(error=type(e).__name__)
+                    if attempt >= self.max_retries or not is_rate_limit_error(e):
+                        raise
+                    LLM_RETRIES_TOTAL.inc(method=method)
+                else:
+                    LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, method=method, outcome="ok")
+                    _record_usage(method, response)
+                    return text
+            await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+            attempt += 1
+
+    def _record_fallback(self, method: str, reason: str = "error") -> None:
+        """reason: no_model（モデル未設定）/ error（LLM の失敗）/ dead_letter（再実行しても失敗）"""
+        self.fallback_counts[method] += 1
+        LLM_FALLBACKS_TOTAL.inc(method=method, reason=reason)
     
     async def analyze_profile(
         self,
         category: str,
         answers: List[Tuple[int, str]],
-        question_data: Dict
+        question_data: Dict,
+        strict: bool = False
     ) -> Dict:
         """
         ユーザーの回答をAIで分析してプロフィールを生成
@@ -36,11 +174,14 @@ class AIMatchingEngine:
             category: カテゴリー (friendship/dating/gaming/business)
             answers: [(question_id, answer), ...]
             question_data: {question_id: question_text, ...}
+            strict: LLM の失敗（タイムアウト・429・サーキットオープン・JSON不正）を簡易分析で補わずに送出する
+                    （再実行するジョブから呼ぶ用。モデル未設定のときは常に簡易分析）
         
         Returns:
             分析結果 {personality_traits, communication_style, preferences, ...}
         """
-        if not self.model:
+        if not await self._ensure_model():
+            self._record_fallback("analyze_profile", "no_model")
             return self._basic_profile_analysis(answers, question_data)
         
         # 回答を整形
@@ -76,29 +217,23 @@ JSONのみを返し、他の説明は不要です。"""
 
         try:
             # 非同期でGemini APIを呼び出し
-            response = await asyncio.to_thread(
-                self.model.generate_content,
+            result_text = await self._generate(
                 prompt,
-                generation_config={
+                {
                     "temperature": 0.7,
                     "top_p": 0.95,
                     "top_k": 40,
                     "max_output_tokens": 1500,
-                }
+                },
+                method="analyze_profile"
             )
-            
-            result_text = response.text.strip()
-            
-            # JSONの抽出（```json ``` で囲まれている場合に対応）
-            if "```json" in result_text:
-                result_text = result_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in result_text:
-                result_text = result_text.split("```")[1].split("```")[0].strip()
-            
-            return json.loads(result_text)
+            return _extract_json(result_text)
             
         except Exception as e:
             print(f"Gemini API analysis error: {e}")
+            if strict:
+                raise
+            self._record_fallback("analyze_profile")
             return self._basic_profile_analysis(answers, question_data)
     
     def _format_answers_for_ai(
@@ -159,7 +294,8 @@ JSONのみを返し、他の説明は不要です。"""
                 "conversation_starters": [...]
             }
         """
-        if not self.model:
+        if not await self._ensure_model():
+            self._record_fallback("calculate_compatibility", "no_model")
             return self._basic_compatibility(user1_answers, user2_answers)
         
         # 基本スコアを計算
@@ -193,29 +329,23 @@ overall_scoreは0.0〜1.0の範囲で、基本相性スコアも参考にして
 JSONのみを返し、他の説明は不要です。"""
 
         try:
-            response = await asyncio.to_thread(
-                self.model.generate_content,
+            result_text = await self._generate(
                 prompt,
-                generation_config={
+                {
                     "temperature": 0.7,
                     "top_p": 0.95,
                     "top_k": 40,
                     "max_output_tokens": 1200,
-                }
+                },
+                method="calculate_compatibility"
             )
-            
-            result_text = response.text.strip()
-            if "```json" in result_text:
-                result_text = result_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in result_text:
-                result_text = result_text.split("```")[1].split("```")[0].strip()
-            
-            result = json.loads(result_text)
+            result = _extract_json(result_text)
             result["basic_score"] = basic_score
             return result
             
         except Exception as e:
             print(f"Gemini compatibility analysis error: {e}")
+            self._record_fallback("calculate_compatibility")
             return self._basic_compatibility(user1_answers, user2_answers)
     
     def _calculate_answer_similarity(
@@ -273,7 +403,8 @@ JSONのみを返し、他の説明は不要です。"""
         compatibility: Dict
     ) -> str:
         """マッチング成立時のアイスブレイクメッセージを生成"""
-        if not self.model:
+        if not await self._ensure_model():
+            self._record_fallback("generate_icebreaker", "no_model")
             return f"🎉 {user1_name}さんと{user2_name}さんがマッチしました！お互いに挨拶してみましょう！"
         
         prompt = f"""あなたは{category}マッチングサービスのAIアシスタントです。
@@ -293,21 +424,20 @@ JSONのみを返し、他の説明は不要です。"""
 絵文字も適度に使ってOKです。"""
 
         try:
-            response = await asyncio.to_thread(
-                self.model.generate_content,
+            return await self._generate(
                 prompt,
-                generation_config={
+                {
                     "temperature": 0.8,
                     "top_p": 0.95,
                     "top_k": 40,
                     "max_output_tokens": 400,
-                }
+                },
+                method="generate_icebreaker"
             )
             
-            return response.text.strip()
-            
         except Exception as e:
             print(f"Gemini icebreaker generation error: {e}")
+            self._record_fallback("generate_icebreaker")
             score = compatibility.get("overall_score", 0.5)
             return f"🎉 {user1_name}さんと{user2_name}さんがマッチしました！相性度: {score:.0%}\n\n{compatibility.get('conversation_starters', ['お互いの趣味について話してみましょう！'])[0]}"
 
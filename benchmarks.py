@@ -0,0 +1,648 @@
+"""
+db_multi とマッチング計算のマイクロベンチマーク（前回の結果との比較つき）
+
+- db_multi の公開関数を、回答件数 10k〜1M 件の DB（ローカル SQLite、Turso 同期なし）で計測
+- _calculate_answer_similarity / build_category_profile / category_compatibility_score /
+  Bot の compatibility_percent
+- 結果は --results（既定 benchmark_results.json）に保存し、次回はその結果（または --baseline）と比較する
+- 比較先より閾値以上遅くなったものは REGRESSION と表示し、終了コード 1 を返す
+
+    python benchmarks.py                                  # 10k / 100k 件
+    python benchmarks.py --sizes 10000,1000000 --filter db.load
+    python benchmarks.py --baseline baseline.json --no-save
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import statistics
+import itertools
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import db_multi
+import tracing
+from ai_matching_gemini import AIMatchingEngine, build_category_profile, category_compatibility_score
+from questions_multi_category import CATEGORY_QUESTIONS
+from seen_filter import SeenFilter
+from synth_population import PopulationConfig, generate, users_for_answers
+
+BENCH_RESULTS = os.environ.get("BENCH_RESULTS", "benchmark_results.json")
+# 比較先からこの割合以上遅くなったら REGRESSION
+BENCH_THRESHOLD = float(os.environ.get("BENCH_THRESHOLD", "0.25"))
+DEFAULT_SIZES = (10_000, 100_000)
+
+LETTERS = "ABCDE"
+
+
+# =========================================================
+# 計測対象の登録
+# =========================================================
+@dataclass
+class Context:
+    """計測用 DB の中身（ユーザーID など）と、書き込み系で使う連番"""
+    size: int = 0
+    users: List[int] = field(default_factory=list)
+    categories: Dict[int, str] = field(default_factory=dict)
+    discord_ids: List[str] = field(default_factory=list)
+    spare_users: List[int] = field(default_factory=list)
+    room_channels: List[int] = field(default_factory=list)
+    done_jobs: List[int] = field(default_factory=list)
+    match_ids: List[int] = field(default_factory=list)
+    rng: random.Random = field(default_factory=lambda: random.Random(0))
+    _seq: Any = field(default_factory=lambda: itertools.count(1))
+
+    def next_id(self) -> int:
+        return next(self._seq)
+
+    def user(self, i: int):
+        uid = self.users[i % len(self.users)]
+        return uid, self.categories[uid]
+
+
+@dataclass
+class Bench:
+    name: str
+    make: Callable[[Context], Callable[[int], Any]]
+    db: bool = True
+    # 1回の計測で呼べる回数の上限（行を消す系は対象の行数まで）
+    max_calls: Optional[Callable[[Context], int]] = None
+
+
+BENCHMARKS: List[Bench] = []
+
+
+def bench(name: str, db: bool = True, max_calls: Optional[Callable[[Context], int]] = None):
+    def decorator(make):
+        BENCHMARKS.append(Bench(name, make, db, max_calls))
+        return make
+    return decorator
+
+
+def _answers(rng: random.Random, category: str) -> List[tuple]:
+    return [(q["id"], rng.choice(LETTERS)) for q in CATEGORY_QUESTIONS[category]]
+
+
+def _profile(rng: random.Random) -> Dict:
+    keywords = rng.sample(["ゲーム", "アニメ", "音楽", "読書", "旅行", "カフェ", "映画", "スポーツ", "料理", "写真"], 5)
+    return {
+        "personality_summary": f"{keywords[0]}と{keywords[1]}が好きな穏やかなタイプです。",
+        "key_traits": [{"trait": k, "comment": f"{k}な一面があります。"} for k in keywords],
+        "communication_style": "バランス型",
+        "preferences": {"ideal_match": "聞き上手な相手", "priorities": ["価値観の一致", "信頼関係"]},
+        "compatibility_factors": ["価値観の一致", "共通の趣味"],
+        "match_keywords": keywords,
+    }
+
+
+# ---- ユーザー ----
+@bench("db.get_or_create_user.existing")
+def _(ctx):
+    return lambda i: db_multi.get_or_create_user(ctx.discord_ids[i % len(ctx.discord_ids)], "bench")
+
+
+@bench("db.get_or_create_user.new")
+def _(ctx):
+    return lambda i: db_multi.get_or_create_user(str(9 * 10 ** 17 + ctx.next_id()), "bench")
+
+
+@bench("db.get_user_by_discord_id")
+def _(ctx):
+    return lambda i: db_multi.get_user_by_discord_id(ctx.discord_ids[i % len(ctx.discord_ids)])
+
+
+@bench("db.get_discord_id_by_user_id")
+def _(ctx):
+    return lambda i: db_multi.get_discord_id_by_user_id(ctx.users[i % len(ctx.users)])
+
+
+@bench("db.get_users_by_ids")
+def _(ctx):
+    return lambda i: db_multi.get_users_by_ids(
+        [ctx.users[(i * 5 + j) % len(ctx.users)] for j in range(5)]
+    )
+
+
+@bench("db.get_meta")
+def _(ctx):
+    return lambda i: db_multi.get_meta("schema_version")
+
+
+@bench("db.set_meta")
+def _(ctx):
+    return lambda i: db_multi.set_meta("benchmark", str(i))
+
+
+# ---- プロフィール ----
+@bench("db.create_or_update_profile")
+def _(ctx):
+    profile = _profile(ctx.rng)
+
+    def op(i):
+        uid, cat = ctx.user(i)
+        db_multi.create_or_update_profile(
+            uid, cat, bio=profile["personality_summary"], interests=profile["match_keywords"],
+            personality_traits=profile,
+        )
+    return op
+
+
+@bench("db.get_profile")
+def _(ctx):
+    return lambda i: db_multi.get_profile(*ctx.user(i))
+
+
+@bench("db.get_user_categories")
+def _(ctx):
+    return lambda i: db_multi.get_user_categories(ctx.users[i % len(ctx.users)])
+
+
+@bench("db.load_profile_texts")
+def _(ctx):
+    return lambda i: db_multi.load_profile_texts("friendship")
+
+
+# ---- 進捗・回答・質問順・メッセージID ----
+@bench("db.get_state")
+def _(ctx):
+    return lambda i: db_multi.get_state(*ctx.user(i))
+
+
+@bench("db.set_state")
+def _(ctx):
+    return lambda i: db_multi.set_state(*ctx.user(i), len(CATEGORY_QUESTIONS[ctx.user(i)[1]]))
+
+
+@bench("db.save_answer")
+def _(ctx):
+    def op(i):
+        uid, cat = ctx.user(i)
+        questions = CATEGORY_QUESTIONS[cat]
+        db_multi.save_answer(uid, cat, questions[i % len(questions)]["id"], LETTERS[i % 5])
+    return op
+
+
+@bench("db.load_answers")
+def _(ctx):
+    return lambda i: db_multi.load_answers(*ctx.user(i))
+
+
+@bench("db.load_completed_answers_all_categories")
+def _(ctx):
+    return lambda i: db_multi.load_completed_answers_all_categories()
+
+
+@bench("db.load_category_answers")
+def _(ctx):
+    return lambda i: db_multi.load_category_answers("friendship")
+
+
+@bench("db.get_or_create_order")
+def _(ctx):
+    def op(i):
+        uid, cat = ctx.user(i)
+        db_multi.get_or_create_order(uid, cat, [q["id"] for q in CATEGORY_QUESTIONS[cat]])
+    return op
+
+
+@bench("db.get_message_id")
+def _(ctx):
+    return lambda i: db_multi.get_message_id(*ctx.user(i))
+
+
+@bench("db.set_message_id")
+def _(ctx):
+    return lambda i: db_multi.set_message_id(*ctx.user(i), 10 ** 18 + i)
+
+
+# ---- 専用ルーム ----
+@bench("db.load_user_rooms")
+def _(ctx):
+    return lambda i: db_multi.load_user_rooms()
+
+
+@bench("db.set_user_room")
+def _(ctx):
+    return lambda i: db_multi.set_user_room(1, 8 * 10 ** 17 + ctx.next_id(), 7 * 10 ** 17 + ctx.next_id())
+
+
+@bench("db.touch_user_rooms")
+def _(ctx):
+    now = time.time()
+
+    def op(i):
+        start = (i * 100) % len(ctx.room_channels)
+        db_multi.touch_user_rooms([(cid, now) for cid in ctx.room_channels[start:start + 100]])
+    return op
+
+
+# ---- ジョブ ----
+@bench("db.enqueue_job")
+def _(ctx):
+    return lambda i: db_multi.enqueue_job("benchmark", {"n": i}, f"bench:{ctx.next_id()}")
+
+
+@bench("db.claim_jobs")
+def _(ctx):
+    return lambda i: db_multi.claim_jobs(["benchmark"], 4, 60)
+
+
+@bench("db.complete_job")
+def _(ctx):
+    return lambda i: db_multi.complete_job(ctx.done_jobs[i % len(ctx.done_jobs)])
+
+
+@bench("db.fail_job")
+def _(ctx):
+    return lambda i: db_multi.fail_job(ctx.done_jobs[i % len(ctx.done_jobs)], "benchmark", 60)
+
+
+@bench("db.requeue_running_jobs")
+def _(ctx):
+    return lambda i: db_multi.requeue_running_jobs()
+
+
+@bench("db.count_jobs_by_status")
+def _(ctx):
+    return lambda i: db_multi.count_jobs_by_status()
+
+
+@bench("db.find_completed_without_profile")
+def _(ctx):
+    return lambda i: db_multi.find_completed_without_profile("friendship", len(CATEGORY_QUESTIONS["friendship"]))
+
+
+# ---- マッチ・統計 ----
+@bench("db.create_match")
+def _(ctx):
+    def op(i):
+        uid, cat = ctx.user(i)
+        db_multi.create_match(uid, ctx.users[(i * 7 + 1) % len(ctx.users)], cat, 0.5)
+    return op
+
+
+@bench("db.get_user_matches")
+def _(ctx):
+    return lambda i: db_multi.get_user_matches(*ctx.user(i))
+
+
+@bench("db.get_user_matches_page")
+def _(ctx):
+    return lambda i: db_multi.get_user_matches_page(*ctx.user(i))
+
+
+@bench("db.get_user_matches_page.slots")
+def _(ctx):
+    return lambda i: db_multi.get_user_matches_page(*ctx.user(i), row_mode="slots")
+
+
+@bench("db.count_user_matches")
+def _(ctx):
+    return lambda i: db_multi.count_user_matches(*ctx.user(i))
+
+
+@bench("db.has_match_between")
+def _(ctx):
+    def op(i):
+        uid, cat = ctx.user(i)
+        db_multi.has_match_between(uid, ctx.users[(i * 7 + 1) % len(ctx.users)], cat)
+    return op
+
+
+@bench("db.get_match_partner_ids")
+def _(ctx):
+    return lambda i: db_multi.get_match_partner_ids(*ctx.user(i))
+
+
+@bench("db.expire_pending_matches.empty")
+def _(ctx):
+    # 期限切れの対象がないとき（定期実行のほとんど）の索引の参照コスト
+    return lambda i: db_multi.expire_pending_matches(10 * 365 * 24 * 3600, 500)
+
+
+@bench("db.iter_match_pairs.batch")
+def _(ctx):
+    # 起動時の取り込み1バッチ分（id のキーセットで1000件）
+    return lambda i: next(db_multi.iter_match_pairs(ctx.match_ids[i % len(ctx.match_ids)] - 1, 1000), None)
+
+
+@bench("db.iter_export_rows.batch")
+def _(ctx):
+    # 書き出しの1バッチ分（rowid のキーセットで1000件）
+    return lambda i: next(db_multi.iter_export_rows("answers", batch_size=1000), None)
+
+
+@bench("db.save_seen_filters")
+def _(ctx):
+    data = SeenFilter()
+    for uid in ctx.users[:200]:
+        data.add(uid)
+    blob = data.to_bytes()
+    return lambda i: db_multi.save_seen_filters([(*ctx.user(i), blob)])
+
+
+@bench("db.update_match_status")
+def _(ctx):
+    return lambda i: db_multi.update_match_status(ctx.match_ids[i % len(ctx.match_ids)], "accepted")
+
+
+@bench("db.count_total_users")
+def _(ctx):
+    return lambda i: db_multi.count_total_users()
+
+
+@bench("db.count_completed_users")
+def _(ctx):
+    return lambda i: db_multi.count_completed_users("friendship", len(CATEGORY_QUESTIONS["friendship"]))
+
+
+@bench("db.count_matches_by_category")
+def _(ctx):
+    return lambda i: db_multi.count_matches_by_category("friendship")
+
+
+@bench("db.get_category_stats")
+def _(ctx):
+    return lambda i: db_multi.get_category_stats()
+
+
+# ---- 行を消す系（予備ユーザー・既存ルームを1回ずつ消費する） ----
+@bench("db.reset_order", max_calls=lambda ctx: len(ctx.spare_users) // 3)
+def _(ctx):
+    users = ctx.spare_users[: len(ctx.spare_users) // 3]
+    return lambda i: db_multi.reset_order(users[i], ctx.categories[users[i]])
+
+
+@bench("db.reset_message_id", max_calls=lambda ctx: len(ctx.spare_users) // 3)
+def _(ctx):
+    users = ctx.spare_users[len(ctx.spare_users) // 3: 2 * len(ctx.spare_users) // 3]
+    return lambda i: db_multi.reset_message_id(users[i], ctx.categories[users[i]])
+
+
+@bench("db.reset_user_category", max_calls=lambda ctx: len(ctx.spare_users) // 3)
+def _(ctx):
+    users = ctx.spare_users[2 * len(ctx.spare_users) // 3:]
+    return lambda i: db_multi.reset_user_category(users[i], ctx.categories[users[i]])
+
+
+@bench("db.delete_user_room_by_channel", max_calls=lambda ctx: len(ctx.room_channels))
+def _(ctx):
+    return lambda i: db_multi.delete_user_room_by_channel(ctx.room_channels[i])
+
+
+# ---- マッチング計算（DB なし） ----
+def _answer_pairs(ctx: Context, category: str = "friendship", n: int = 256):
+    return [(_answers(ctx.rng, category), _answers(ctx.rng, category)) for _ in range(n)]
+
+
+@bench("ai.calculate_answer_similarity", db=False)
+def _(ctx):
+    engine = AIMatchingEngine(model=None)
+    pairs = _answer_pairs(ctx)
+    return lambda i: engine._calculate_answer_similarity(*pairs[i % len(pairs)])
+
+
+@bench("ai.build_category_profile", db=False)
+def _(ctx):
+    questions = CATEGORY_QUESTIONS["friendship"]
+    pairs = _answer_pairs(ctx)
+    return lambda i: build_category_profile(pairs[i % len(pairs)][0], questions)
+
+
+@bench("ai.category_compatibility_score", db=False)
+def _(ctx):
+    questions = CATEGORY_QUESTIONS["friendship"]
+    picks = [(build_category_profile(a, questions)[0], build_category_profile(b, questions)[0])
+             for a, b in _answer_pairs(ctx)]
+    return lambda i: category_compatibility_score(*picks[i % len(picks)])
+
+
+def _seen_filter(ctx: Context, n: int) -> SeenFilter:
+    f = SeenFilter()
+    for _ in range(n):
+        f.add(ctx.rng.randrange(10 ** 9))
+    return f
+
+
+@bench("seen_filter.contains.miss", db=False)
+def _(ctx):
+    # 既読 500 人のフィルターに載っていない候補（ランキングで一番多い判定）
+    f = _seen_filter(ctx, 500)
+    return lambda i: (10 ** 9 + i) in f
+
+
+@bench("seen_filter.add", db=False)
+def _(ctx):
+    f = SeenFilter()
+    return lambda i: f.add(10 ** 9 + i)
+
+
+@bench("bot.compatibility_percent", db=False)
+def _(ctx):
+    from bot_multi_gemini import compatibility_percent
+
+    questions = CATEGORY_QUESTIONS["friendship"]
+    picks = [(build_category_profile(a, questions)[0], build_category_profile(b, questions)[0])
+             for a, b in _answer_pairs(ctx)]
+    subcategories = sorted({q["category"] for q in questions})
+    return lambda i: compatibility_percent(*picks[i % len(picks)], subcategories)
+
+
+# =========================================================
+# 計測用 DB の作成
+# =========================================================
+def populate(size: int, seed: int = 0) -> Context:
+    """
+    回答がおよそ size 件になる DB を現在の接続先に作る（synth_population で生成して一括投入）
+
+    1ユーザー1カテゴリー（1割は予備ユーザーとして行を消す系の計測に使う）。
+    メッセージID・ルーム・完了済みジョブも入れる。
+    """
+    config = PopulationConfig(seed=seed, categories_per_user=(1.0,))
+    config.users = max(40, users_for_answers(size, config))
+    rows = generate(config)
+    ctx = Context(size=size, rng=random.Random(seed + 1))
+    for uid, cat, _ in rows["user_state"]:
+        ctx.categories[uid] = cat
+    ctx.discord_ids = [discord_id for _, discord_id, _ in rows["users"]]
+    user_ids = [uid for uid, _, _ in rows["users"]]
+    n_spare = max(3, len(user_ids) // 10)
+    ctx.spare_users, ctx.users = user_ids[-n_spare:], user_ids[:-n_spare]
+
+    n_extra = max(10, len(user_ids) // 10)
+    rows["user_msg"] = [(uid, cat, str(10 ** 18 + uid)) for uid, cat, _ in rows["user_state"]]
+    rows["user_rooms"] = [("1", str(config.discord_id_base + uid), str(6 * 10 ** 17 + uid)) for uid in ctx.users[:n_extra]]
+    rows["jobs"] = [
+        ("profile_analysis", f"profile:{uid}:{ctx.categories[uid]}", json.dumps({"user_id": uid}), "done", 1)
+        for uid in ctx.users[:n_extra]
+    ]
+    db_multi.init_db()
+    db_multi.bulk_load(rows)
+    # 新しい DB なので AUTOINCREMENT の ID は 1 から連番
+    ctx.room_channels = [int(r[2]) for r in rows["user_rooms"]]
+    ctx.match_ids = list(range(1, min(len(rows["matches"]), 10000) + 1))
+    ctx.done_jobs = list(range(1, len(rows["jobs"]) + 1))
+    return ctx
+
+
+# =========================================================
+# 計測
+# =========================================================
+def measure(op: Callable[[int], Any], min_time: float, repeat: int, max_calls: Optional[int] = None) -> float:
+    """
+    1回あたりの秒数（repeat 回の中央値）
+
+    1回目の所要時間から min_time 秒程度かかる呼び出し回数を決め、その回数をまとめて計る。
+    """
+    calls = itertools.count()
+    t0 = time.perf_counter()
+    op(next(calls))
+    first = time.perf_counter() - t0
+    iterations = max(1, min(100_000, int(min_time / max(first, 1e-7))))
+    if max_calls is not None:
+        iterations = max(1, min(iterations, (max_calls - 1) // repeat))
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(iterations):
+            op(next(calls))
+        samples.append((time.perf_counter() - t0) / iterations)
+    return statistics.median(samples)
+
+
+def run_benchmarks(sizes: List[int], name_filter: Optional[str], min_time: float, repeat: int) -> Dict[str, Dict]:
+    results: Dict[str, Dict] = {}
+    selected = [b for b in BENCHMARKS if not name_filter or name_filter in b.name]
+
+    pure = [b for b in selected if not b.db]
+    if pure:
+        ctx = Context()
+        for b in pure:
+            seconds = measure(b.make(ctx), min_time, repeat)
+            results[b.name] = {"name": b.name, "size": None, "seconds": seconds}
+            print(f"  {b.name:<48} {_format_seconds(seconds):>10}", file=sys.stderr)
+
+    db_benches = [b for b in selected if b.db]
+    for size in sizes if db_benches else []:
+        with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+            db_multi.use_local_db(os.path.join(tmp, "bench.db"))
+            t0 = time.perf_counter()
+            ctx = populate(size)
+            print(f"size={size}: populated {len(ctx.users) + len(ctx.spare_users)} users "
+                  f"in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+            # 行を消す系は最後（他の計測に影響しないように）
+            for b in sorted(db_benches, key=lambda b: b.max_calls is not None):
+                limit = b.max_calls(ctx) if b.max_calls else None
+                seconds = measure(b.make(ctx), min_time, repeat, limit)
+                key = f"{b.name}@{size}"
+                results[key] = {"name": b.name, "size": size, "seconds": seconds}
+                print(f"  {key:<48} {_format_seconds(seconds):>10}", file=sys.stderr)
+            db_multi.use_local_db(os.path.join(tmp, "closed.db"))
+    return results
+
+
+# =========================================================
+# 比較・保存
+# =========================================================
+def _format_seconds(seconds: float) -> str:
+    if seconds < 1e-6:
+        return f"{seconds * 1e9:.0f}ns"
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds:.2f}s"
+
+
+def environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "sqlite": sqlite3.sqlite_version,
+    }
+
+
+def load_results(path: str) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(current: Dict[str, Dict], previous: Optional[Dict], threshold: float) -> tuple:
+    """比較表（テキスト）と REGRESSION の件数"""
+    prev = (previous or {}).get("results", {})
+    lines = [f"  {'benchmark':<48} {'current':>10} {'previous':>10} {'change':>8}  status"]
+    regressions = 0
+    for key, r in current.items():
+        p = prev.get(key)
+        if p is None:
+            lines.append(f"  {key:<48} {_format_seconds(r['seconds']):>10} {'-':>10} {'-':>8}  new")
+            continue
+        change = r["seconds"] / p["seconds"] - 1 if p["seconds"] > 0 else 0.0
+        if change > threshold:
+            status = "REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            status = "faster"
+        else:
+            status = ""
+        lines.append(
+            f"  {key:<48} {_format_seconds(r['seconds']):>10} {_format_seconds(p['seconds']):>10} "
+            f"{change * 100:>+7.1f}%  {status}".rstrip()
+        )
+    return "\n".join(lines), regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="db_multi とマッチング計算のマイクロベンチマーク")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="DB の回答件数（カンマ区切り、例: 10000,100000,1000000）")
+    parser.add_argument("--filter", help="名前に含む文字列で絞り込む（例: db.load / ai.）")
+    parser.add_argument("--min-time", type=float, default=0.2, help="1回の計測でかける時間の目安（秒）")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（中央値を使う）")
+    parser.add_argument("--results", default=BENCH_RESULTS, help="結果の保存先（次回の比較先）")
+    parser.add_argument("--baseline", help="比較先（省略時は --results の前回の結果）")
+    parser.add_argument("--threshold", type=float, default=BENCH_THRESHOLD, help="REGRESSION とする遅化の割合")
+    parser.add_argument("--no-save", action="store_true", help="結果を保存しない")
+    args = parser.parse_args(argv)
+
+    # 計測中の DB 呼び出しごとにトレースを作らない
+    tracing.TRACING_ENABLED = False
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    previous = load_results(args.baseline or args.results)
+    current = run_benchmarks(sizes, args.filter, args.min_time, args.repeat)
+
+    print()
+    if previous is not None:
+        print(f"compared with {args.baseline or args.results} ({previous.get('created_at', '?')})")
+        if previous.get("environment") != environment():
+            print("  note: recorded on a different environment:", previous.get("environment"))
+    table, regressions = compare(current, previous, args.threshold)
+    print(table)
+
+    if not args.no_save:
+        # 今回計測しなかったものは前回の値を残す
+        merged = dict((load_results(args.results) or {}).get("results", {}))
+        merged.update(current)
+        with open(args.results, "w", encoding="utf-8") as f:
+            json.dump({
+                "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "environment": environment(),
+                "results": merged,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\nsaved to {args.results}")
+    if regressions:
+        print(f"\n{regressions} regression(s) over {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
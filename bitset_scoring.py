@@ -0,0 +1,214 @@
+"""
+回答類似度のビットセット（popcount）計算カーネル
+
+AIMatchingEngine._calculate_answer_similarity と同じ値を、回答を整数ビット列に
+エンコードしておくことで AND / XOR + popcount だけで求める。
+
+1問あたり
+- one-hot 5bit : A〜E のどれを選んだか  → 完全一致数 = popcount(o1 & o2)
+- 温度計符号 4bit : ★の数 s を下位 (s-1) ビットの1で表す → |s1 - s2| = popcount(t1 ^ t2)
+- 回答済みマスク 4bit : 回答した問は 0b1111 → 共通問題数 = popcount(m1 & m2) / 4
+スコア差の最大値は 4 なので温度計符号は 4bit で足りる。
+
+A〜E 以外の回答（通常は保存されない）は未回答として扱う。
+"""
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from questions_multi_category import CATEGORY_QUESTION_POSITIONS, CHOICES_5
+
+# 文字 → ★の数（ai_matching_gemini.STAR_MAP と同じ A=1〜E=5）
+_STARS = {key: i + 1 for i, (key, _) in enumerate(CHOICES_5)}
+
+ONEHOT_BITS = 5
+THERMO_BITS = 4
+
+# 文字ごとの事前計算テーブル
+ONEHOT_CODE = {key: 1 << i for i, key in enumerate(_STARS)}
+THERMO_CODE = {key: (1 << (s - 1)) - 1 for key, s in _STARS.items()}
+
+# 完全一致率 0.6 / スコア類似度 0.4 の重み
+#   0.6 * exact / c + 0.4 * (1 - dist / (4c)) = 0.4 + (0.6 * exact - 0.1 * dist) / c
+_MAX_COMMON = 256
+_INV = [0.0] + [1.0 / c for c in range(1, _MAX_COMMON + 1)]
+
+
+@dataclass(frozen=True)
+class AnswerBits:
+    """1ユーザー・1カテゴリー分のエンコード済み回答"""
+    onehot: int
+    thermo: int
+    mask: int
+
+
+def question_positions(category: str) -> Mapping[int, int]:
+    """カテゴリー内の質問ID → ビット位置（質問の並び順）"""
+    return CATEGORY_QUESTION_POSITIONS[category]
+
+
+def encode_answers(answers: Iterable[Tuple[int, str]], positions: Mapping[int, int]) -> AnswerBits:
+    """[(question_id, answer), ...] をビットセットに変換"""
+    onehot = thermo = mask = 0
+    for qid, ans in answers:
+        pos = positions.get(qid)
+        if pos is None or ans not in ONEHOT_CODE:
+            continue
+        onehot |= ONEHOT_CODE[ans] << (pos * ONEHOT_BITS)
+        thermo |= THERMO_CODE[ans] << (pos * THERMO_BITS)
+        mask |= 0b1111 << (pos * THERMO_BITS)
+    return AnswerBits(onehot, thermo, mask)
+
+
+def similarity(a: AnswerBits, b: AnswerBits) -> float:
+    """回答類似度（0.0〜1.0、共通の回答がなければ 0.0）"""
+    common_mask = a.mask & b.mask
+    common = common_mask.bit_count() >> 2
+    if not common:
+        return 0.0
+    exact = (a.onehot & b.onehot).bit_count()
+    dist = ((a.thermo ^ b.thermo) & common_mask).bit_count()
+    return 0.4 + (0.6 * exact - 0.1 * dist) * _INV[common]
+
+
+class BitsetMatrix:
+    """
+    カテゴリー内の全ユーザーのビットセットを列ごとのリストで保持（一対多・総当たり用）
+
+    ユーザーの追加・更新は upsert() で1件ずつ行える。
+    """
+
+    def __init__(self):
+        self.user_ids: List[int] = []
+        self.onehots: List[int] = []
+        self.thermos: List[int] = []
+        self.masks: List[int] = []
+        self._row: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._row
+
+    def upsert(self, user_id: int, bits: AnswerBits) -> None:
+        row = self._row.get(user_id)
+        if row is None:
+            self._row[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.onehots.append(bits.onehot)
+            self.thermos.append(bits.thermo)
+            self.masks.append(bits.mask)
+        else:
+            self.onehots[row] = bits.onehot
+            self.thermos[row] = bits.thermo
+            self.masks[row] = bits.mask
+
+    def get(self, user_id: int) -> Optional[AnswerBits]:
+        row = self._row.get(user_id)
+        if row is None:
+            return None
+        return AnswerBits(self.onehots[row], self.thermos[row], self.masks[row])
+
+    def score_one_vs_many(self, query: AnswerBits) -> List[float]:
+        """query と全行の類似度（行順）"""
+        q_onehot, q_thermo, q_mask = query.onehot, query.thermo, query.mask
+        inv = _INV
+        scores = []
+        append = scores.append
+        for onehot, thermo, mask in zip(self.onehots, self.thermos, self.masks):
+            common_mask = q_mask & mask
+            common = common_mask.bit_count() >> 2
+            if not common:
+                append(0.0)
+                continue
+            exact = (q_onehot & onehot).bit_count()
+            dist = ((q_thermo ^ thermo) & common_mask).bit_count()
+            append(0.4 + (0.6 * exact - 0.1 * dist) * inv[common])
+        return scores
+
+    def iter_all_pairs(self, min_score: float = 0.0) -> Iterator[Tuple[int, int, float]]:
+        """全ペア (user_a, user_b, score) を列挙（a < b の行順、min_score 未満は省く）"""
+        onehots, thermos, masks, ids = self.onehots, self.thermos, self.masks, self.user_ids
+        inv = _INV
+        n = len(ids)
+        for i in range(n):
+            o1, t1, m1, u1 = onehots[i], thermos[i], masks[i], ids[i]
+            for j in range(i + 1, n):
+                common_mask = m1 & masks[j]
+                common = common_mask.bit_count() >> 2
+                if not common:
+                    continue
+                score = 0.4 + (
+                    0.6 * (o1 & onehots[j]).bit_count()
+                    - 0.1 * ((t1 ^ thermos[j]) & common_mask).bit_count()
+                ) * inv[common]
+                if score >= min_score:
+                    yield u1, ids[j], score
+
+
+def build_matrix(
+    rows: Iterable[Tuple[int, Sequence[Tuple[int, str]]]],
+    positions: Mapping[int, int],
+) -> BitsetMatrix:
+    """[(user_id, answers), ...] から BitsetMatrix を構築"""
+    matrix = BitsetMatrix()
+    for user_id, answers in rows:
+        matrix.upsert(user_id, encode_answers(answers, positions))
+    return matrix
+
+
+# =========================================================
+# ベンチマーク（python bitset_scoring.py）
+# =========================================================
+if __name__ == "__main__":
+    import math
+    import random
+    import time
+    from ai_matching_gemini import AIMatchingEngine
+
+    rng = random.Random(0)
+    category = "friendship"
+    positions = question_positions(category)
+    qids = list(positions)
+    n_users = 20000
+    users = [(uid, [(q, rng.choice("ABCDE")) for q in qids]) for uid in range(n_users)]
+
+    # 正しさの確認
+    engine = AIMatchingEngine(model=None)
+    for _ in range(2000):
+        (_, a1), (_, a2) = rng.sample(users, 2)
+        a2 = a2[: rng.randint(0, len(a2))]
+        expected = engine._calculate_answer_similarity(a1, a2)
+        got = similarity(encode_answers(a1, positions), encode_answers(a2, positions))
+        assert math.isclose(expected, got, abs_tol=1e-9), (expected, got)
+
+    # 既存実装（dict＋文字列比較）
+    n_baseline = 20000
+    query = users[0][1]
+    t0 = time.perf_counter()
+    for _, answers in users[:n_baseline]:
+        engine._calculate_answer_similarity(query, answers)
+    baseline_rate = n_baseline / (time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    matrix = build_matrix(users, positions)
+    encode_time = time.perf_counter() - t0
+
+    q_bits = matrix.get(0)
+    t0 = time.perf_counter()
+    rounds = 20
+    for _ in range(rounds):
+        matrix.score_one_vs_many(q_bits)
+    one_vs_many_rate = rounds * len(matrix) / (time.perf_counter() - t0)
+
+    sub = build_matrix(users[:2000], positions)
+    t0 = time.perf_counter()
+    n_pairs = sum(1 for _ in sub.iter_all_pairs())
+    all_pairs_rate = n_pairs / (time.perf_counter() - t0)
+
+    print(f"users={n_users} encode={encode_time:.2f}s")
+    print(f"baseline _calculate_answer_similarity: {baseline_rate:,.0f} pairs/s")
+    print(f"bitset one-vs-many (/match):          {one_vs_many_rate:,.0f} pairs/s "
+          f"(x{one_vs_many_rate / baseline_rate:.0f})")
+    print(f"bitset all-pairs ({n_pairs:,} pairs):  {all_pairs_rate:,.0f} pairs/s "
+          f"(x{all_pairs_rate / baseline_rate:.0f})")
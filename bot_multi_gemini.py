@@ -1,7 +1,14 @@
 import os
 import re
+import json
+import time
 import asyncio
-from typing import List, Optional
+import hashlib
+import weakref
+import functools
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
 
 from dotenv import load_dotenv
 
@@ -12,20 +19,28 @@ load_dotenv(os.path.join(os.path.dirname(_script_dir), ".env"), override=False)
 
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from questions_multi_category import (
     CATEGORY_META,
     CATEGORY_QUESTIONS,
-    CHOICES_5
+    QUESTION_BY_ID,
+    ANSWER_BUTTON_LABELS,
+    question_embed_payload,
 )
 from db_multi import (
     init_db,
+    get_meta,
+    set_meta,
     get_or_create_user,
     get_user_by_discord_id,
+    get_discord_id_by_user_id,
     get_profile,
     create_or_update_profile,
     get_user_categories,
+    load_profile_texts,
+    get_users_by_ids,
+    load_category_answers,
     get_state,
     set_state,
     save_answer,
@@ -34,9 +49,19 @@ from db_multi import (
     get_message_id,
     set_message_id,
     reset_user_category,
+    load_user_rooms,
+    set_user_room,
+    touch_user_rooms,
+    delete_user_room_by_channel,
+    count_jobs_by_status,
+    find_completed_without_profile,
     create_match,
-    get_user_matches,
-    update_match_status,
+    MATCH_HISTORY_PAGE_SIZE,
+    get_user_matches_page,
+    count_user_matches,
+    has_match_between,
+    get_match_partner_ids,
+    expire_pending_matches,
     count_total_users,
     count_completed_users,
     get_category_stats,
@@ -44,8 +69,23 @@ from db_multi import (
 from ai_matching_gemini import (
     AIMatchingEngine,
     build_category_profile,
-    STAR_MAP,
 )
+from text_index import ProfileTextIndex
+from match_search import (
+    EXCLUDED_MATCH_STATUSES,
+    MATCH_PAGE_SIZE,
+    Candidate,
+    MatchExclusions,
+    MatchResult,
+    MatchSearch,
+)
+from seen_filter import SEEN_FILTER_ENABLED, SeenFilters
+from data_export import EXPORT_FORMATS, export_to_file
+from room_registry import RoomRegistry
+from outbound_queue import OutboundQueue, PRIORITY_INTERACTION, PRIORITY_ROOM
+from job_queue import JobQueue
+import metrics
+import tracing
 
 # =========================================================
 # 環境変数
@@ -53,11 +93,97 @@ from ai_matching_gemini import (
 TOKEN = os.environ["DISCORD_TOKEN"]
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "")
 GUILD_ID = int(os.environ.get("GUILD_ID"))
-AUTO_CLOSE_SECONDS = int(os.environ.get("AUTO_CLOSE_SECONDS", "300"))
+AUTO_CLOSE_SECONDS = int(os.environ.get("AUTO_CLOSE_SECONDS", "3600"))
 ADMIN_ROLE_ID = int(os.environ.get("ADMIN_ROLE_ID", "0"))
 BOTADMIN_ROLE_ID = int(os.environ.get("BOTADMIN_ROLE_ID", "0"))
 ADMIN_CHANNEL_ID = int(os.environ.get("ADMIN_CHANNEL_ID", "0"))
 WELCOME_CHANNEL_ID = int(os.environ.get("WELCOME_CHANNEL_ID", "0"))
+# アイドルルームの自動クローズ（AUTO_CLOSE_SECONDS 操作がなければ対象、0以下で無効）
+ROOM_REAPER_INTERVAL_SECONDS = int(os.environ.get("ROOM_REAPER_INTERVAL_SECONDS", "60"))
+ROOM_REAPER_BATCH_SIZE = int(os.environ.get("ROOM_REAPER_BATCH_SIZE", "5"))
+# archive（非公開化してルームは残す）/ delete。削除は取り消せないので明示的に選んだときだけ
+ROOM_REAPER_ACTION = os.environ.get("ROOM_REAPER_ACTION", "archive")
+ROOM_REAPER_ACTION_DELAY_SECONDS = float(os.environ.get("ROOM_REAPER_ACTION_DELAY_SECONDS", "1.0"))
+# 1 にするとコマンド定義が変わっていなくても起動時に tree.sync する
+FORCE_COMMAND_SYNC = os.environ.get("FORCE_COMMAND_SYNC", "0") == "1"
+COMMAND_HASH_META_KEY = "command_tree_hash"
+# /match の結果メッセージのボタンが使える秒数（ランキング自体のキャッシュは match_search 側の TTL）
+MATCH_VIEW_TIMEOUT_SECONDS = float(os.environ.get("MATCH_VIEW_TIMEOUT_SECONDS", "900"))
+# 返事のない申請（pending）を期限切れにするまでの秒数（0以下で無効）と掃除の間隔・1回の上限
+MATCH_PENDING_TTL_SECONDS = float(os.environ.get("MATCH_PENDING_TTL_SECONDS", str(7 * 24 * 3600)))
+MATCH_EXPIRY_INTERVAL_SECONDS = int(os.environ.get("MATCH_EXPIRY_INTERVAL_SECONDS", "300"))
+MATCH_EXPIRY_BATCH_SIZE = int(os.environ.get("MATCH_EXPIRY_BATCH_SIZE", "500"))
+MATCH_EXPIRY_MAX_BATCHES = int(os.environ.get("MATCH_EXPIRY_MAX_BATCHES", "10"))
+# 既に見た候補のフィルター（seen_filter.py）を seen_filters テーブルへ書き出す間隔
+SEEN_FILTER_FLUSH_SECONDS = int(os.environ.get("SEEN_FILTER_FLUSH_SECONDS", "60"))
+# /export の結果を添付で返す上限（超えたら EXPORT_DIR に残して場所だけ返す）
+EXPORT_ATTACHMENT_MAX_BYTES = int(os.environ.get("EXPORT_ATTACHMENT_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# =========================================================
+# メトリクス（METRICS_PORT を設定すると /metrics で公開）
+# =========================================================
+COMMAND_SECONDS = metrics.histogram(
+    "discord_command_seconds", "Slash command handler latency", ["command", "outcome"]
+)
+HANDLER_SECONDS = metrics.histogram(
+    "discord_handler_seconds", "Answer / completion handler latency", ["handler", "outcome"]
+)
+ANSWER_PHASE_SECONDS = metrics.histogram(
+    "answer_phase_seconds", "Latency of each phase in handle_answer", ["phase", "outcome"]
+)
+COMPLETION_PHASE_SECONDS = metrics.histogram(
+    "completion_phase_seconds", "Latency of each phase of diagnosis completion and profile analysis",
+    ["phase", "outcome"]
+)
+STALE_CLICKS_TOTAL = metrics.counter("answer_stale_clicks_total", "Answer clicks dropped as duplicate or stale")
+LLM_CIRCUIT_STATE = metrics.gauge("llm_circuit_state", "1 for the current LLM circuit breaker state", ["state"])
+LLM_RESILIENCE_EVENTS = metrics.gauge(
+    "llm_resilience_events", "ResilientModel counters (requests, timeouts, hedges, ...)", ["event"]
+)
+OUTBOUND_QUEUE = metrics.gauge("outbound_queue", "Outbound Discord action queue snapshot", ["field"])
+JOB_QUEUE_EVENTS = metrics.gauge("job_queue_events", "Background job counters of this process", ["event"])
+ROOM_REAPER_EVENTS = metrics.gauge("room_reaper_events", "Idle room reaper counters", ["event"])
+ROOMS_REGISTERED = metrics.gauge("rooms_registered", "Diagnosis rooms in the registry")
+MATCH_SEARCH_EVENTS = metrics.gauge(
+    "match_search_events", "/match result cache counters and candidate pool size", ["event"]
+)
+MATCH_EXCLUSION_EVENTS = metrics.gauge(
+    "match_exclusion_events", "Per-user match exclusion cache counters and size", ["event"]
+)
+MATCHES_EXPIRED_TOTAL = metrics.counter("matches_expired_total", "Pending matches expired by the sweeper", ["category"])
+MATCH_EXPIRY_EVENTS = metrics.gauge("match_expiry_events", "Pending match expiry sweeper counters", ["event"])
+EXPORT_ROWS_TOTAL = metrics.counter("export_rows_total", "Rows written by /export", ["table", "format"])
+SEEN_FILTER_EVENTS = metrics.gauge(
+    "seen_filter_events", "Seen-candidate Bloom filter counters, size and memory", ["event"]
+)
+
+
+def observe_command(name: str):
+    """スラッシュコマンドの計測（レイテンシのヒストグラム＋トレースのルートスパン）"""
+    def decorator(func):
+        return metrics.timed(COMMAND_SECONDS, command=name)(tracing.traced(f"command.{name}")(func))
+    return decorator
+
+
+def observe_handler(name: str):
+    """ボタン処理・ジョブの計測（レイテンシのヒストグラム＋トレースのスパン）"""
+    def decorator(func):
+        return metrics.timed(HANDLER_SECONDS, handler=name)(tracing.traced(name)(func))
+    return decorator
+
+
+@contextmanager
+def answer_phase(phase: str):
+    """handle_answer の1段階（ヒストグラム＋子スパン）"""
+    with tracing.span(phase), metrics.timed(ANSWER_PHASE_SECONDS, phase=phase):
+        yield
+
+
+@contextmanager
+def completion_phase(phase: str):
+    """診断完了・プロフィール分析の1段階（ヒストグラム＋子スパン）"""
+    with tracing.span(phase), metrics.timed(COMPLETION_PHASE_SECONDS, phase=phase):
+        yield
 
 # =========================================================
 # Bot初期化
@@ -68,9 +194,36 @@ intents.message_content = False
 bot = commands.Bot(command_prefix="!", intents=intents)
 
 
-# AIマッチングエンジン
+# AIマッチングエンジン（Gemini SDK の読み込みとモデル生成は初回利用時）
 matching_engine = AIMatchingEngine()
 
+# プロフィールのキーワード類似度インデックス（カテゴリー別・初回利用時に構築）
+profile_text_index = ProfileTextIndex(load_profile_texts)
+
+# /match の候補プール（カテゴリー別の回答ビットセット）とユーザー別の結果キャッシュ
+match_search = MatchSearch(load_category_answers, profile_text_index)
+# マッチ（申請）がある相手の除外リスト（ユーザー別・初回利用時にDBから読む）
+match_exclusions = MatchExclusions(
+    functools.partial(get_match_partner_ids, statuses=EXCLUDED_MATCH_STATUSES)
+)
+# マッチした・表示した相手の確率的な既読フィルター（起動時に seen_filters テーブルと matches から読む）
+seen_filters = SeenFilters()
+
+# 専用ルームの登録簿（user_rooms テーブルのメモリ上のミラー）
+room_registry = RoomRegistry()
+# ルームを作成中の (guild_id, discord_id)（作成は送信キューで待つことがあるため登録より先に押さえる）
+rooms_being_created: Set[Tuple[int, int]] = set()
+
+# チャンネル作成・投稿の送信キュー（レート制限対策、on_ready で起動）
+outbound = OutboundQueue()
+
+# プロフィール分析などのバックグラウンドジョブ（jobs テーブルに永続化、on_ready で起動）
+PROFILE_ANALYSIS_JOB = "profile_analysis"
+job_queue = JobQueue()
+
+# on_ready は再接続のたびに呼ばれるため、初期化済みかを記録
+_startup_done = False
+
 # =========================================================
 # ユーティリティ
 # =========================================================
@@ -83,11 +236,39 @@ def safe_channel_name(name: str) -> str:
     return name or "user"
 
 
-def is_user_room(channel: discord.abc.GuildChannel, user_id: int) -> bool:
-    """topic でユーザールームか判定 (topic: "user:{id} ...")"""
+_ROOM_TOPIC_RE = re.compile(r"^user:(\d+)")
+
+
+def room_owner_id(channel: discord.abc.GuildChannel) -> Optional[int]:
+    """topic からユーザールームの持ち主のDiscord IDを取得 (topic: "user:{id} ...")"""
     if not isinstance(channel, discord.TextChannel):
-        return False
-    return (channel.topic or "").startswith(f"user:{user_id}")
+        return None
+    m = _ROOM_TOPIC_RE.match(channel.topic or "")
+    return int(m.group(1)) if m else None
+
+
+async def register_room(guild_id: int, discord_id: int, channel_id: int) -> None:
+    room_registry.add(guild_id, discord_id, channel_id)
+    await asyncio.to_thread(set_user_room, guild_id, discord_id, channel_id)
+
+
+async def unregister_room(channel_id: int) -> None:
+    if room_registry.remove_channel(channel_id):
+        await asyncio.to_thread(delete_user_room_by_channel, channel_id)
+
+
+async def load_room_registry() -> None:
+    """登録簿をDBから読み込み、登録漏れの既存ルーム（登録簿導入前のもの）を取り込む"""
+    room_registry.load(await asyncio.to_thread(load_user_rooms))
+    for guild in bot.guilds:
+        for ch in guild.text_channels:
+            owner = room_owner_id(ch)
+            if owner is not None and room_registry.get(guild.id, owner) is None:
+                await register_room(guild.id, owner, ch.id)
+        # 登録はあるがチャンネルが消えているもの（停止中に削除された）を外す
+        for channel_id in room_registry.channel_ids(guild.id):
+            if guild.get_channel(channel_id) is None:
+                await unregister_room(channel_id)
 
 
 def compatibility_percent(picks_a: dict, picks_b: dict, categories: List[str]) -> int:
@@ -105,19 +286,6 @@ def has_role_id(member: discord.Member, role_id: int) -> bool:
     return any(r.id == role_id for r in member.roles)
 
 
-def stars(letter: str) -> str:
-    n = STAR_MAP.get(letter, 3)
-    return "★" * n + "☆" * (5 - n)
-
-
-def progress_bar(current: int, total: int, width: int = 12) -> str:
-    if total <= 0:
-        return ""
-    filled = int(round((current / total) * width))
-    filled = max(0, min(width, filled))
-    return "■" * filled + "□" * (width - filled)
-
-
 def format_key_traits(traits) -> str:
     """key_traits を表示用テキストに変換（新旧フォーマット対応）"""
     if not traits:
@@ -137,13 +305,6 @@ def format_key_traits(traits) -> str:
     return "\n".join(lines)
 
 
-def q_by_id(questions: List[dict], qid: int) -> dict:
-    for q in questions:
-        if q["id"] == qid:
-            return q
-    raise KeyError(f"question id not found: {qid}")
-
-
 # =========================================================
 # カテゴリー選択View
 # =========================================================
@@ -178,6 +339,7 @@ class CategorySelectView(discord.ui.View):
         
         self.category = category
         self.stop()
+        room_registry.touch(interaction.channel_id)
         
         meta = CATEGORY_META[category]
         await interaction.response.send_message(
@@ -202,30 +364,60 @@ async def create_or_open_room(interaction: discord.Interaction):
     safe_name = safe_channel_name(member.display_name)
     channel_name = f"match-{safe_name}-{discord_id % 10000}"
 
-    # 既存ルーム再利用
-    for ch in guild.text_channels:
-        if is_user_room(ch, discord_id):
-            await interaction.response.send_message(f"既にあります：{ch.mention}", ephemeral=True)
+    # 作成待ちの間に二重クリックや /room が来ても2部屋作らない
+    key = (guild.id, discord_id)
+    if key in rooms_being_created:
+        await interaction.response.send_message("専用ルームを作成中です。少しお待ちください。", ephemeral=True)
+        return
+    rooms_being_created.add(key)
+    try:
+        # 既存ルーム再利用
+        existing_id = room_registry.get(guild.id, discord_id)
+        if existing_id is not None:
+            existing = guild.get_channel(existing_id)
+            if existing is not None:
+                await interaction.response.send_message(f"既にあります：{existing.mention}", ephemeral=True)
+                return
+            await unregister_room(existing_id)
+
+        if guild.me is None:
+            await interaction.response.send_message("Bot情報の取得に失敗しました。", ephemeral=True)
             return
 
-    if guild.me is None:
-        await interaction.response.send_message("Bot情報の取得に失敗しました。", ephemeral=True)
-        return
+        # チャンネル作成は送信キューで順番待ちになることがあるため先に応答しておく
+        await interaction.response.defer(ephemeral=True, thinking=True)
 
-    overwrites = {
-        guild.default_role: discord.PermissionOverwrite(view_channel=False),
-        member: discord.PermissionOverwrite(view_channel=True, send_messages=False),
-        guild.me: discord.PermissionOverwrite(view_channel=True, send_messages=True, manage_channels=True),
-    }
+        overwrites = {
+            guild.default_role: discord.PermissionOverwrite(view_channel=False),
+            member: discord.PermissionOverwrite(view_channel=True, send_messages=False),
+            guild.me: discord.PermissionOverwrite(view_channel=True, send_messages=True, manage_channels=True),
+        }
 
-    ch = await guild.create_text_channel(
-        channel_name,
-        topic=f"user:{discord_id} name:{member.display_name}",
-        overwrites=overwrites
-    )
+        try:
+            ch = await outbound.run(
+                f"guild:{guild.id}:create_channel",
+                lambda: guild.create_text_channel(
+                    channel_name,
+                    topic=f"user:{discord_id} name:{member.display_name}",
+                    overwrites=overwrites
+                ),
+                PRIORITY_INTERACTION
+            )
+        except (asyncio.QueueFull, discord.HTTPException) as e:
+            print(f"Failed to create room for {discord_id}: {e!r}")
+            await interaction.followup.send("ただいま混み合っています。少し待ってからもう一度お試しください。", ephemeral=True)
+            return
+
+        await register_room(guild.id, discord_id, ch.id)
+    finally:
+        rooms_being_created.discard(key)
 
-    await interaction.response.send_message(f"専用ルームを作成しました：{ch.mention}", ephemeral=True)
-    await ch.send("📝 このルームは診断専用です。カテゴリーを選んで開始してください。")
+    await interaction.followup.send(f"専用ルームを作成しました：{ch.mention}", ephemeral=True)
+    outbound.submit(
+        f"channel:{ch.id}",
+        lambda: ch.send("📝 このルームは診断専用です。カテゴリーを選んで開始してください。"),
+        PRIORITY_ROOM
+    )
 
     user_id = await asyncio.to_thread(
         get_or_create_user, str(discord_id), member.name
@@ -240,15 +432,11 @@ async def create_or_open_room(interaction: discord.Interaction):
         embed.add_field(name=f"{meta['emoji']} {meta['name']}", value=meta['description'], inline=False)
 
     view = CategorySelectView(discord_id)
-    await ch.send(embed=embed, view=view)
+    await outbound.run(f"channel:{ch.id}", lambda: ch.send(embed=embed, view=view), PRIORITY_ROOM)
     await view.wait()
 
     if view.category:
-        questions = CATEGORY_QUESTIONS[view.category]
-        order = await asyncio.to_thread(
-            get_or_create_order, user_id, view.category, [q["id"] for q in questions]
-        )
-        await update_question_message(ch, discord_id, user_id, view.category, 0, order, questions)
+        await start_category_diagnosis(ch, discord_id, user_id, view.category)
 
 
 class StartRoomView(discord.ui.View):
@@ -275,36 +463,131 @@ async def post_panel(channel: discord.TextChannel):
 
 
 # =========================================================
-# 質問回答View
+# 質問回答ボタン
 # =========================================================
-class AnswerButtonsView(discord.ui.View):
-    """回答ボタンUI（A〜E）"""
+# 回答ボタンは custom_id に必要な情報をすべて持たせ、押下は on_interaction の
+# 単一ハンドラで処理する。メッセージごとに View を登録しないのでメモリは一定で、
+# 再起動後も古いメッセージのボタンがそのまま使える。
+ANSWER_CUSTOM_ID_PREFIX = "ans"
+ANSWER_KEYS = {key for key, _ in ANSWER_BUTTON_LABELS}
 
-    def __init__(self, discord_id: int, user_id: int, category: str, idx: int):
-        super().__init__(timeout=None)
-        self.discord_id = discord_id  # 権限チェック用（DiscordユーザーID）
-        self.user_id = user_id       # DB用（内部ID）
-        self.category = category
-        self.idx = idx
-
-        # A〜Eボタンを追加
-        for key, label in CHOICES_5:
-            button = discord.ui.Button(
-                label=f"{key}: {stars(key)}",
-                style=discord.ButtonStyle.secondary,
-                custom_id=f"ans:{user_id}:{category}:{idx}:{key}"
-            )
-            button.callback = self.make_answer_callback(key)
-            self.add_item(button)
 
-    def make_answer_callback(self, key: str):
-        async def callback(interaction: discord.Interaction):
-            await handle_answer(
-                interaction, self.discord_id, self.user_id, self.category, self.idx, key
-            )
-        return callback
+def answer_custom_id(discord_id: int, user_id: int, category: str, idx: int, key: str) -> str:
+    return f"{ANSWER_CUSTOM_ID_PREFIX}:{discord_id}:{user_id}:{category}:{idx}:{key}"
+
+
+def parse_answer_custom_id(custom_id: str) -> Optional[Tuple[Optional[int], int, str, int, str]]:
+    """
+    回答ボタンの custom_id を (discord_id, user_id, category, idx, key) に分解
+
+    旧形式 `ans:{user_id}:{category}:{idx}:{key}` は discord_id=None で返す。
+    回答ボタンでなければ None。
+    """
+    parts = custom_id.split(":")
+    if not parts or parts[0] != ANSWER_CUSTOM_ID_PREFIX:
+        return None
+    try:
+        if len(parts) == 6:
+            _, discord_id, user_id, category, idx, key = parts
+            parsed_discord_id: Optional[int] = int(discord_id)
+        elif len(parts) == 5:
+            _, user_id, category, idx, key = parts
+            parsed_discord_id = None
+        else:
+            return None
+        if category not in CATEGORY_META or key not in ANSWER_KEYS:
+            return None
+        return parsed_discord_id, int(user_id), category, int(idx), key
+    except ValueError:
+        return None
+
+
+def build_answer_view(discord_id: int, user_id: int, category: str, idx: int) -> discord.ui.View:
+    """回答ボタン（A〜E）の表示専用View"""
+    view = discord.ui.View(timeout=None)
+    for key, label in ANSWER_BUTTON_LABELS:
+        view.add_item(discord.ui.Button(
+            label=label,
+            style=discord.ButtonStyle.secondary,
+            custom_id=answer_custom_id(discord_id, user_id, category, idx, key)
+        ))
+    # 押下は on_answer_interaction で処理するため、停止済みにして ViewStore に登録させない
+    view.stop()
+    return view
+
+
+@bot.listen("on_interaction")
+async def on_answer_interaction(interaction: discord.Interaction):
+    """回答ボタン押下の共通ハンドラ"""
+    if interaction.type != discord.InteractionType.component:
+        return
+    parsed = parse_answer_custom_id((interaction.data or {}).get("custom_id", ""))
+    if parsed is None:
+        return
+    discord_id, user_id, category, idx, key = parsed
+    room_registry.touch(interaction.channel_id)
+    if discord_id is None:
+        discord_id = await asyncio.to_thread(get_discord_id_by_user_id, user_id)
+        if discord_id is None:
+            await interaction.response.send_message("診断情報が見つかりません。", ephemeral=True)
+            return
+    await handle_answer(interaction, discord_id, user_id, category, idx, key)
+
+
+# (user_id, category) → 回答処理のロック。処理中のものだけが残るよう弱参照で持つ
+_answer_locks: "weakref.WeakValueDictionary[Tuple[int, str], asyncio.Lock]" = weakref.WeakValueDictionary()
+
+# (user_id, category) → このプロセスで確認済みの進捗（get_state のDB読み込みを省く）
+ANSWER_PROGRESS_CACHE_SIZE = int(os.environ.get("ANSWER_PROGRESS_CACHE_SIZE", "4096"))
+_answer_progress: "OrderedDict[Tuple[int, str], int]" = OrderedDict()
+
 
+def _answer_lock(user_id: int, category: str) -> asyncio.Lock:
+    key = (user_id, category)
+    lock = _answer_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _answer_locks[key] = lock
+    return lock
 
+
+def _remember_progress(user_id: int, category: str, idx: int) -> None:
+    key = (user_id, category)
+    _answer_progress[key] = idx
+    _answer_progress.move_to_end(key)
+    while len(_answer_progress) > ANSWER_PROGRESS_CACHE_SIZE:
+        _answer_progress.popitem(last=False)
+
+
+async def _current_progress(user_id: int, category: str) -> int:
+    idx = _answer_progress.get((user_id, category))
+    if idx is None:
+        idx = await asyncio.to_thread(get_state, user_id, category)
+        _remember_progress(user_id, category, idx)
+    return idx
+
+
+async def start_category_diagnosis(
+    channel: discord.abc.Messageable,
+    discord_id: int,
+    user_id: int,
+    category: str
+):
+    """カテゴリーの診断を表示（途中なら続きから、完了済みなら最初からやり直し）"""
+    questions = CATEGORY_QUESTIONS[category]
+    order = await asyncio.to_thread(
+        get_or_create_order, user_id, category, [q["id"] for q in questions]
+    )
+    async with _answer_lock(user_id, category):
+        idx = await asyncio.to_thread(get_state, user_id, category)
+        if not 0 <= idx < len(order):
+            idx = 0
+            await asyncio.to_thread(set_state, user_id, category, idx)
+        _remember_progress(user_id, category, idx)
+    await update_question_message(channel, discord_id, user_id, category, idx, order, questions)
+
+
+@observe_handler("handle_answer")
 async def handle_answer(
     interaction: discord.Interaction,
     discord_id: int,
@@ -316,80 +599,102 @@ async def handle_answer(
     """回答処理（discord_id=権限チェック用, user_id=DB用）"""
     # ★3秒制限回避：最初に必ずdefer
     if not interaction.response.is_done():
-        await interaction.response.defer(ephemeral=True)
+        with answer_phase("defer"):
+            await interaction.response.defer(ephemeral=True)
 
     # 権限チェック（Discord IDで比較）
     if interaction.user.id != discord_id:
         await interaction.followup.send("これはあなたの診断ではありません。", ephemeral=True)
         return
 
-    try:
-        # 質問取得
-        questions = CATEGORY_QUESTIONS[category]
-        order = await asyncio.to_thread(
-            get_or_create_order,
-            user_id,
-            category,
-            [q["id"] for q in questions]
-        )
-        
-        # 現在の進捗を確認
-        cur_idx = await asyncio.to_thread(get_state, user_id, category)
-        if isinstance(cur_idx, int) and 0 <= cur_idx < len(order):
-            idx = cur_idx
-        
-        # 回答を保存
-        q = q_by_id(questions, order[idx])
-        await asyncio.to_thread(save_answer, user_id, category, q["id"], key)
-        
-        next_idx = idx + 1
-        await asyncio.to_thread(set_state, user_id, category, next_idx)
+    # 同じユーザー・カテゴリーの回答は1件ずつ処理する（連打で進捗が飛ばないように）
+    lock_started = time.perf_counter()
+    async with _answer_lock(user_id, category):
+        lock_wait = time.perf_counter() - lock_started
+        ANSWER_PHASE_SECONDS.observe(lock_wait, phase="lock_wait", outcome="ok")
+        current = tracing.current_span()
+        if current is not None:
+            current.set(lock_wait_ms=round(lock_wait * 1000, 1))
+        try:
+            # 現在の進捗とボタンの質問番号が違えば、連打か古いメッセージのボタン → 何もしない
+            with answer_phase("progress"):
+                cur_idx = await _current_progress(user_id, category)
+            if cur_idx != idx:
+                STALE_CLICKS_TOTAL.inc()
+                return
+            
+            # 質問取得
+            questions = CATEGORY_QUESTIONS[category]
+            with answer_phase("order"):
+                order = await asyncio.to_thread(
+                    get_or_create_order,
+                    user_id,
+                    category,
+                    [q["id"] for q in questions]
+                )
+            if idx >= len(order):
+                return
+            
+            # 回答を保存
+            q = QUESTION_BY_ID[order[idx]]
+            with answer_phase("save_answer"):
+                await asyncio.to_thread(save_answer, user_id, category, q["id"], key)
+            
+            next_idx = idx + 1
+            with answer_phase("set_state"):
+                await asyncio.to_thread(set_state, user_id, category, next_idx)
+            _remember_progress(user_id, category, next_idx)
+            
+            # 完了チェック
+            if next_idx >= len(order):
+                with answer_phase("completion"):
+                    await handle_completion(interaction, user_id, category, questions)
+            else:
+                # 次の質問へ
+                with answer_phase("render"):
+                    await update_question_message(
+                        interaction.channel, discord_id, user_id, category, next_idx, order, questions,
+                        interaction=interaction
+                    )
         
-        # 完了チェック
-        if next_idx >= len(order):
-            await handle_completion(interaction, user_id, category, questions)
-        else:
-            # 次の質問へ
-            await update_question_message(
-                interaction.channel, discord_id, user_id, category, next_idx, order, questions
-            )
-    
-    except Exception as e:
-        await interaction.followup.send(f"⚠️ エラー：{type(e).__name__}", ephemeral=True)
-        raise
+        except Exception as e:
+            _answer_progress.pop((user_id, category), None)
+            await interaction.followup.send(f"⚠️ エラー：{type(e).__name__}", ephemeral=True)
+            raise
 
 
+@observe_handler("handle_completion")
 async def handle_completion(
     interaction: discord.Interaction,
     user_id: int,
     category: str,
     questions: List[dict]
 ):
-    """診断完了処理"""
+    """診断完了処理（AI分析はジョブに回し、まず分析中の表示を返す）"""
     meta = CATEGORY_META[category]
-    
-    # 回答をロード
-    answers = await asyncio.to_thread(load_answers, user_id, category)
-    
-    # AI分析
-    question_data = {q["id"]: q["text"] for q in questions}
-    profile_analysis = await matching_engine.analyze_profile(
-        category,
-        answers,
-        question_data
-    )
-    
-    # プロフィールを保存
-    await asyncio.to_thread(
-        create_or_update_profile,
-        user_id,
-        category,
-        bio=profile_analysis.get("personality_summary", ""),
-        interests=profile_analysis.get("match_keywords", []),
-        personality_traits=profile_analysis
+    embed = discord.Embed(
+        title=f"{meta['emoji']} 診断完了！",
+        description=f"**{meta['name']}**の診断が完了しました。\n🔄 AIが回答を分析しています。完了するとこのメッセージが更新されます。",
+        color=meta['color']
     )
-    
-    # 結果表示
+    with completion_phase("placeholder"):
+        edited = await edit_question_message(
+            interaction.channel, user_id, category, interaction=interaction, embed=embed, view=None
+        )
+        if not edited:
+            await interaction.followup.send(embed=embed, ephemeral=True)
+
+    with completion_phase("enqueue"):
+        await job_queue.enqueue(
+            PROFILE_ANALYSIS_JOB,
+            {"user_id": user_id, "category": category, "channel_id": interaction.channel_id},
+            dedupe_key=f"profile:{user_id}:{category}"
+        )
+
+
+def build_completion_embed(category: str, profile_analysis: Dict) -> discord.Embed:
+    """分析結果の表示"""
+    meta = CATEGORY_META[category]
     embed = discord.Embed(
         title=f"{meta['emoji']} 診断完了！",
         description=f"**{meta['name']}**の診断が完了しました。",
@@ -410,23 +715,173 @@ async def handle_completion(
             inline=False
         )
     
-    meta_cat = CATEGORY_META.get(category, {})
-    cat_name = meta_cat.get("name", category)
     embed.add_field(
         name="🎯 次のステップ",
-        value=f"`/match` → カテゴリー「{cat_name}」を選択してマッチング相手を探す\n`/profile` → プロフィールを確認",
+        value=f"`/match` → カテゴリー「{meta['name']}」を選択してマッチング相手を探す\n`/profile` → プロフィールを確認",
         inline=False
     )
+    return embed
+
+
+@observe_handler("profile_analysis_job")
+async def run_profile_analysis(payload: Dict):
+    """
+    プロフィール分析ジョブ: 回答をAI分析して保存し、分析中の表示を結果に差し替える
+
+    LLM の失敗は送出してジョブの再実行に任せる（簡易分析はデッドレター時の save_basic_profile だけ）。
+    """
+    user_id = int(payload["user_id"])
+    category = payload["category"]
+    questions = CATEGORY_QUESTIONS[category]
+
+    # 回答をロード（ジョブ待ちの間にやり直しが始まっていたら何もしない）
+    with completion_phase("load_answers"):
+        answers = await asyncio.to_thread(load_answers, user_id, category)
+    if len(answers) < len(questions):
+        return
     
+    # AI分析
+    question_data = {q["id"]: q["text"] for q in questions}
+    with completion_phase("analyze_profile"):
+        profile_analysis = await matching_engine.analyze_profile(
+            category,
+            answers,
+            question_data,
+            strict=True
+        )
+    await save_and_show_profile(payload, answers, profile_analysis)
+
+
+@observe_handler("profile_analysis_dead")
+async def save_basic_profile(payload: Dict, error: BaseException):
+    """分析ジョブがデッドレターになったら、回答からの簡易分析を保存して表示する"""
+    user_id = int(payload["user_id"])
+    category = payload["category"]
+    questions = CATEGORY_QUESTIONS[category]
+    answers = await asyncio.to_thread(load_answers, user_id, category)
+    if len(answers) < len(questions):
+        return
+    question_data = {q["id"]: q["text"] for q in questions}
+    profile_analysis = matching_engine._basic_profile_analysis(answers, question_data)
+    matching_engine._record_fallback("analyze_profile", "dead_letter")
+    print(f"Saving basic profile for user {user_id} ({category}) after analysis failed: {error!r}")
+    await save_and_show_profile(payload, answers, profile_analysis)
+
+
+async def save_and_show_profile(payload: Dict, answers: List[Tuple[int, str]], profile_analysis: Dict):
+    """分析結果を保存して検索用の索引を更新し、分析中の表示を結果に差し替える"""
+    user_id = int(payload["user_id"])
+    category = payload["category"]
+
+    # プロフィールを保存
+    with completion_phase("save_profile"):
+        await asyncio.to_thread(
+            create_or_update_profile,
+            user_id,
+            category,
+            bio=profile_analysis.get("personality_summary", ""),
+            interests=profile_analysis.get("match_keywords", []),
+            personality_traits=profile_analysis
+        )
+    profile_text_index.upsert(
+        category,
+        user_id,
+        profile_analysis.get("personality_summary", ""),
+        profile_analysis.get("match_keywords", []),
+    )
+    await asyncio.to_thread(match_search.upsert, category, user_id, answers)
+    
+    # 結果表示（ルームが閉じられていれば /profile で確認してもらう）
+    channel = bot.get_channel(int(payload.get("channel_id") or 0))
+    if channel is None:
+        return
+    try:
+        with completion_phase("render"):
+            await edit_question_message(
+                channel, user_id, category, embed=build_completion_embed(category, profile_analysis), view=None
+            )
+        # 結果を読む時間があるよう、表示した時点から自動クローズの時間を数え直す
+        room_registry.touch(channel.id)
+    except discord.HTTPException as e:
+        # 保存は済んでいるので再実行はしない
+        print(f"Failed to show analysis result for user {user_id} ({category}): {e!r}")
+
+
+async def enqueue_missing_profiles():
+    """診断完了済みなのにプロフィールがないユーザーの分析ジョブを登録（起動時）"""
+    total = 0
+    for category, questions in CATEGORY_QUESTIONS.items():
+        user_ids = await asyncio.to_thread(find_completed_without_profile, category, len(questions))
+        for user_id in user_ids:
+            await job_queue.enqueue(
+                PROFILE_ANALYSIS_JOB,
+                {"user_id": user_id, "category": category, "channel_id": None},
+                dedupe_key=f"profile:{user_id}:{category}"
+            )
+        total += len(user_ids)
+    if total:
+        print(f"Enqueued profile analysis for {total} completed diagnosis(es) without a profile")
+
+
+# (user_id, category) → 質問メッセージ。ボタン以外の経路（初回表示など）で
+# fetch_message を省くための上限付きキャッシュ
+QUESTION_MESSAGE_CACHE_SIZE = int(os.environ.get("QUESTION_MESSAGE_CACHE_SIZE", "1024"))
+_question_messages: "OrderedDict[Tuple[int, str], discord.Message]" = OrderedDict()
+
+
+def remember_question_message(user_id: int, category: str, message: discord.Message) -> None:
+    key = (user_id, category)
+    _question_messages[key] = message
+    _question_messages.move_to_end(key)
+    while len(_question_messages) > QUESTION_MESSAGE_CACHE_SIZE:
+        _question_messages.popitem(last=False)
+
+
+async def edit_question_message(
+    channel: discord.abc.Messageable,
+    user_id: int,
+    category: str,
+    interaction: Optional[discord.Interaction] = None,
+    **kwargs
+) -> bool:
+    """
+    質問メッセージを編集（編集できたら True）
+
+    1. ボタン押下の interaction 経由（deferred update 済みなので元メッセージを直接編集）
+    2. メモリ上のメッセージハンドル
+    3. DBのメッセージID → fetch_message
+    の順に試す。
+    """
+    if interaction is not None and interaction.message is not None:
+        try:
+            with tracing.span("edit.interaction"):
+                await interaction.edit_original_response(**kwargs)
+            remember_question_message(user_id, category, interaction.message)
+            return True
+        except discord.HTTPException:
+            pass
+
+    msg = _question_messages.get((user_id, category))
+    if msg is not None:
+        try:
+            with tracing.span("edit.cached"):
+                await msg.edit(**kwargs)
+            return True
+        except discord.HTTPException:
+            _question_messages.pop((user_id, category), None)
+
     mid = await asyncio.to_thread(get_message_id, user_id, category)
     if mid:
         try:
-            msg = await interaction.channel.fetch_message(mid)
-            await msg.edit(embed=embed, view=None)
-        except Exception:
-            await interaction.followup.send(embed=embed, ephemeral=True)
-    else:
-        await interaction.followup.send(embed=embed, ephemeral=True)
+            with tracing.span("fetch_message", message_id=mid):
+                msg = await channel.fetch_message(mid)
+            with tracing.span("edit.fetched"):
+                await msg.edit(**kwargs)
+            remember_question_message(user_id, category, msg)
+            return True
+        except discord.HTTPException:
+            pass
+    return False
 
 
 async def update_question_message(
@@ -436,45 +891,470 @@ async def update_question_message(
     category: str,
     idx: int,
     order: List[int],
-    questions: List[dict]
+    questions: List[dict],
+    interaction: Optional[discord.Interaction] = None
 ):
     """質問メッセージを更新（discord_id=権限チェック用, user_id=DB用）"""
-    q = q_by_id(questions, order[idx])
-    meta = CATEGORY_META[category]
+    embed = discord.Embed.from_dict(
+        question_embed_payload(category, idx, order[idx], len(order))
+    )
+    
+    view = build_answer_view(discord_id, user_id, category, idx)
+    
+    if await edit_question_message(
+        channel, user_id, category, interaction=interaction, embed=embed, view=view
+    ):
+        return
     
+    # 新規メッセージ
+    msg = await channel.send(embed=embed, view=view)
+    remember_question_message(user_id, category, msg)
+    await asyncio.to_thread(set_message_id, user_id, category, msg.id)
+
+
+def collect_runtime_metrics() -> None:
+    """/metrics の取得時に各コンポーネントのスナップショットをゲージへ反映"""
+    if matching_engine.model_loaded and hasattr(matching_engine.model, "snapshot"):
+        snap = matching_engine.model.snapshot()
+        for state in ("closed", "open", "half_open"):
+            LLM_CIRCUIT_STATE.set(1 if snap["state"] == state else 0, state=state)
+        for event, value in snap.items():
+            if isinstance(value, int) and not isinstance(value, bool):
+                LLM_RESILIENCE_EVENTS.set(value, event=event)
+    for field, value in outbound.snapshot().items():
+        OUTBOUND_QUEUE.set(value, field=field)
+    for event, value in job_queue.counters.items():
+        JOB_QUEUE_EVENTS.set(value, event=event)
+    for event, value in reaper_metrics.items():
+        ROOM_REAPER_EVENTS.set(value, event=event)
+    ROOMS_REGISTERED.set(len(room_registry))
+    for event, value in match_search.snapshot().items():
+        MATCH_SEARCH_EVENTS.set(value, event=event)
+    for event, value in match_exclusions.snapshot().items():
+        MATCH_EXCLUSION_EVENTS.set(value, event=event)
+    for event, value in expiry_metrics.items():
+        MATCH_EXPIRY_EVENTS.set(value, event=event)
+    for event, value in seen_filters.snapshot().items():
+        SEEN_FILTER_EVENTS.set(value, event=event)
+
+
+metrics.add_collector(collect_runtime_metrics)
+
+
+# =========================================================
+# /match の結果表示
+# =========================================================
+def _score_percent(score: float) -> int:
+    return int(round(score * 100))
+
+
+def build_match_page_embed(
+    result: MatchResult,
+    page: int,
+    users: Dict[int, Dict],
+    requested: Set[int],
+) -> discord.Embed:
+    """ランキングの1ページ分の Embed"""
+    meta = CATEGORY_META[result.category]
+    per_page = result.page(page)
+    lines = []
+    for i, cand in enumerate(per_page, start=page * MATCH_PAGE_SIZE + 1):
+        user = users.get(cand.user_id) or {}
+        who = f"<@{user['discord_id']}>" if user.get("discord_id") else f"ユーザー{cand.user_id}"
+        mark = " ✅ 申請済み" if cand.user_id in requested else ""
+        lines.append(
+            f"**{i}.** {who} ─ 相性 **{_score_percent(cand.score)}%**"
+            f"（回答 {_score_percent(cand.answer_score)}% / キーワード {_score_percent(cand.text_score)}%）{mark}"
+        )
     embed = discord.Embed(
-        title=f"{meta['emoji']} {meta['name']} 診断",
+        title=f"{meta['emoji']} {meta['name']}のマッチング候補",
+        description="\n".join(lines) or "候補がいません。",
         color=meta['color']
     )
-    
-    embed.add_field(
-        name="📊 進捗",
-        value=f"{progress_bar(idx + 1, len(order), 12)}  {idx + 1} / {len(order)}",
-        inline=False
+    embed.set_footer(
+        text=f"ページ {page + 1}/{result.page_count()} ・ 上位 {len(result.candidates)} 人 / 対象 {result.pool_size} 人"
     )
-    
-    embed.add_field(
-        name="❓ 質問",
-        value=f"Q{idx + 1}. {q['text']}",
-        inline=False
+    return embed
+
+
+def build_candidate_embed(
+    category: str,
+    rank: Optional[int],
+    cand: Candidate,
+    user: Dict,
+    profile_data: Optional[Dict],
+) -> discord.Embed:
+    """候補1人の詳細"""
+    meta = CATEGORY_META[category]
+    who = f"<@{user['discord_id']}>" if user.get("discord_id") else f"ユーザー{cand.user_id}"
+    embed = discord.Embed(
+        title=f"{meta['emoji']} {rank or '-'}位の候補",
+        description=f"{who}\n相性 **{_score_percent(cand.score)}%**"
+                    f"（回答 {_score_percent(cand.answer_score)}% / キーワード {_score_percent(cand.text_score)}%）",
+        color=meta['color']
     )
-    
-    embed.set_footer(text="★が多いほど強い傾向です")
-    
-    view = AnswerButtonsView(discord_id, user_id, category, idx)
-    
-    mid = await asyncio.to_thread(get_message_id, user_id, category)
-    if mid:
+    if profile_data:
+        if profile_data['bio']:
+            embed.add_field(name="📝 プロフィール", value=profile_data['bio'][:1024], inline=False)
+        if profile_data['interests']:
+            embed.add_field(name="🏷️ キーワード", value=", ".join(profile_data['interests'][:10]), inline=False)
+        traits = profile_data.get('personality_traits', {})
+        if isinstance(traits, dict) and 'key_traits' in traits:
+            traits_text = format_key_traits(traits['key_traits'])
+            if traits_text:
+                embed.add_field(name="✨ 特徴", value=traits_text[:1024], inline=False)
+    return embed
+
+
+class MatchResultsView(discord.ui.View):
+    """/match の結果（キャッシュ済みのランキングを切り出すだけで、ページ送りでスコアは再計算しない）"""
+
+    def __init__(self, discord_id: int, user_id: int, result: MatchResult):
+        super().__init__(timeout=MATCH_VIEW_TIMEOUT_SECONDS)
+        self.discord_id = discord_id
+        self.user_id = user_id
+        self.result = result
+        self.page = 0
+        self.selected: Optional[int] = None
+        self.requested: Set[int] = set()
+        # 表示済みの候補の user_id → {"discord_id", "username"}
+        self.users: Dict[int, Dict] = {}
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.discord_id:
+            await interaction.response.send_message("これはあなたの検索結果ではありません。", ephemeral=True)
+            return False
+        return True
+
+    def _selected_candidate(self) -> Optional[Candidate]:
+        for cand in self.result.page(self.page):
+            if cand.user_id == self.selected:
+                return cand
+        return None
+
+    async def render(self) -> discord.Embed:
+        """現在のページの Embed を作り、セレクトとボタンの状態を合わせる"""
+        per_page = self.result.page(self.page)
+        missing = [c.user_id for c in per_page if c.user_id not in self.users]
+        if missing:
+            self.users.update(await asyncio.to_thread(get_users_by_ids, missing))
+        # 次にランキングし直したときは、ここで見た候補を出さない
+        if SEEN_FILTER_ENABLED:
+            seen_filters.add_shown(self.user_id, self.result.category, [c.user_id for c in per_page])
+        if self._selected_candidate() is None:
+            self.selected = per_page[0].user_id if per_page else None
+
+        options = []
+        for i, cand in enumerate(per_page, start=self.page * MATCH_PAGE_SIZE + 1):
+            name = (self.users.get(cand.user_id) or {}).get("username") or f"ユーザー{cand.user_id}"
+            options.append(discord.SelectOption(
+                label=f"{i}. {name}"[:100],
+                value=str(cand.user_id),
+                description=f"相性 {_score_percent(cand.score)}%",
+                default=cand.user_id == self.selected,
+            ))
+        self.candidate_select.options = options
+        self.prev_button.disabled = self.page == 0
+        self.next_button.disabled = self.page >= self.result.page_count() - 1
+        self.request_button.disabled = self.selected is None or self.selected in self.requested
+        return build_match_page_embed(self.result, self.page, self.users, self.requested)
+
+    @discord.ui.select(placeholder="候補を選ぶ", options=[discord.SelectOption(label="-")], row=0)
+    async def candidate_select(self, interaction: discord.Interaction, select: discord.ui.Select):
+        self.selected = int(select.values[0])
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    @discord.ui.button(label="◀ 前へ", style=discord.ButtonStyle.secondary, row=1)
+    async def prev_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = max(0, self.page - 1)
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    @discord.ui.button(label="次へ ▶", style=discord.ButtonStyle.secondary, row=1)
+    async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = min(self.result.page_count() - 1, self.page + 1)
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    @discord.ui.button(label="🔎 詳細", style=discord.ButtonStyle.primary, row=1)
+    async def details_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        cand = self._selected_candidate()
+        if cand is None:
+            await interaction.response.send_message("候補を選んでください。", ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        profile_data = await asyncio.to_thread(get_profile, cand.user_id, self.result.category)
+        embed = build_candidate_embed(
+            self.result.category,
+            self.result.rank_of(cand.user_id),
+            cand,
+            self.users.get(cand.user_id) or {},
+            profile_data,
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+    @discord.ui.button(label="🤝 マッチ申請", style=discord.ButtonStyle.success, row=1)
+    @observe_handler("match_request")
+    async def request_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        cand = self._selected_candidate()
+        if cand is None or cand.user_id in self.requested:
+            await interaction.response.send_message("候補を選んでください。", ephemeral=True)
+            return
+        await interaction.response.defer()
+        category = self.result.category
+        # 別の検索結果から申請済みの相手には重ねて申請しない
+        if await asyncio.to_thread(
+            has_match_between, self.user_id, cand.user_id, category, EXCLUDED_MATCH_STATUSES
+        ):
+            message = "この相手とは既にマッチ（申請）があります。"
+        else:
+            await asyncio.to_thread(create_match, self.user_id, cand.user_id, category, round(cand.score, 4))
+            match_exclusions.add(self.user_id, cand.user_id, category)
+            seen_filters.add_pair(self.user_id, cand.user_id, category)
+            # 次の /match で申請した相手が残らないよう、2人の検索結果のキャッシュを捨てる
+            match_search.invalidate(self.user_id, category)
+            match_search.invalidate(cand.user_id, category)
+            message = "🤝 マッチを申請しました。"
+        self.requested.add(cand.user_id)
+        await interaction.edit_original_response(embed=await self.render(), view=self)
+        await interaction.followup.send(message, ephemeral=True)
+
+
+# =========================================================
+# マッチ履歴の表示
+# =========================================================
+MATCH_STATUS_LABELS = {
+    "pending": "⏳ 申請中",
+    "accepted": "✅ 成立",
+    "rejected": "❌ 不成立",
+    "closed": "📁 終了",
+    "expired": "⌛ 期限切れ",
+}
+
+
+class MatchHistoryView(discord.ui.View):
+    """マッチ履歴（(created_at, id) のカーソルで1ページずつ読むので、履歴の長さに関係なく一定時間）"""
+
+    def __init__(self, discord_id: int, user_id: int, category: str, counts: Dict[str, int]):
+        super().__init__(timeout=MATCH_VIEW_TIMEOUT_SECONDS)
+        self.discord_id = discord_id
+        self.user_id = user_id
+        self.category = category
+        self.counts = counts
+        # 表示したページの開始カーソル（先頭は None）。戻るときはここから読み直す
+        self.cursors: List[Optional[Tuple[str, int]]] = [None]
+        self.next_cursor: Optional[Tuple[str, int]] = None
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.discord_id:
+            await interaction.response.send_message("これはあなたの履歴ではありません。", ephemeral=True)
+            return False
+        return True
+
+    async def render(self) -> discord.Embed:
+        rows, self.next_cursor = await asyncio.to_thread(
+            functools.partial(
+                get_user_matches_page,
+                self.user_id,
+                self.category,
+                limit=MATCH_HISTORY_PAGE_SIZE,
+                before=self.cursors[-1],
+                row_mode="slots",
+            )
+        )
+        partners = [r.user2_id if r.user1_id == self.user_id else r.user1_id for r in rows]
+        users = await asyncio.to_thread(get_users_by_ids, sorted(set(partners)))
+        lines = []
+        for row, partner in zip(rows, partners):
+            user = users.get(partner) or {}
+            who = f"<@{user['discord_id']}>" if user.get("discord_id") else f"ユーザー{partner}"
+            direction = "→" if row.user1_id == self.user_id else "←"
+            score = f"{_score_percent(row.match_score)}%" if row.match_score is not None else "-"
+            lines.append(
+                f"`{str(row.created_at)[:10]}` {direction} {who} ─ {MATCH_STATUS_LABELS.get(row.status, row.status)}（相性 {score}）"
+            )
+
+        meta = CATEGORY_META[self.category]
+        embed = discord.Embed(
+            title=f"{meta['emoji']} {meta['name']}のマッチ履歴",
+            description="\n".join(lines) or "履歴はありません。",
+            color=meta['color']
+        )
+        summary = " / ".join(
+            f"{MATCH_STATUS_LABELS.get(status, status)} {n}" for status, n in sorted(self.counts.items())
+        )
+        embed.set_footer(text=f"{summary} ・ 合計 {sum(self.counts.values())} 件 ・ ページ {len(self.cursors)}")
+        self.newer_button.disabled = len(self.cursors) == 1
+        self.older_button.disabled = self.next_cursor is None
+        return embed
+
+    @discord.ui.button(label="◀ 新しい履歴", style=discord.ButtonStyle.secondary)
+    async def newer_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    @discord.ui.button(label="古い履歴 ▶", style=discord.ButtonStyle.secondary)
+    async def older_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.next_cursor is not None:
+            self.cursors.append(self.next_cursor)
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+
+# =========================================================
+# アイドルルームの自動クローズ
+# =========================================================
+# runs / rooms_deleted / rooms_archived / rooms_missing / errors / rate_limited
+reaper_metrics: Counter = Counter()
+
+
+async def archive_room(channel: discord.TextChannel) -> None:
+    """ルームを残したままユーザーから見えなくする（topic も変えて登録簿の取り込み対象から外す）"""
+    guild = channel.guild
+    owner = room_registry.owner_of(channel.id)
+    overwrites = {guild.default_role: discord.PermissionOverwrite(view_channel=False)}
+    if guild.me is not None:
+        overwrites[guild.me] = discord.PermissionOverwrite(view_channel=True, manage_channels=True)
+    await channel.edit(
+        name=f"closed-{channel.name}"[:100],
+        topic=f"archived:{owner[1] if owner else ''}",
+        overwrites=overwrites,
+        reason="idle room auto close"
+    )
+
+
+async def reaper_unregister(channel_id: int) -> None:
+    """登録を外す（DB の失敗でクローズのループを止めない）"""
+    try:
+        await unregister_room(channel_id)
+    except Exception as e:
+        reaper_metrics["errors"] += 1
+        print(f"room reaper failed to unregister {channel_id}: {e!r}")
+
+
+@tasks.loop(seconds=ROOM_REAPER_INTERVAL_SECONDS)
+async def room_reaper():
+    """最終アクティビティを書き出し、一定時間操作のないルームを少しずつクローズ"""
+    reaper_metrics["runs"] += 1
+    activity = room_registry.pop_dirty_activity()
+    try:
+        await asyncio.to_thread(touch_user_rooms, activity)
+    except Exception as e:
+        # 書けなかった分は次回にまた書く
+        room_registry.mark_dirty(channel_id for channel_id, _ in activity)
+        reaper_metrics["errors"] += 1
+        print(f"room activity flush failed: {e!r}")
+    if AUTO_CLOSE_SECONDS <= 0:
+        return
+
+    for channel_id in room_registry.idle_channels(AUTO_CLOSE_SECONDS, ROOM_REAPER_BATCH_SIZE):
+        channel = bot.get_channel(channel_id)
+        if channel is None:
+            reaper_metrics["rooms_missing"] += 1
+            await reaper_unregister(channel_id)
+            continue
         try:
-            msg = await channel.fetch_message(mid)
-            await msg.edit(embed=embed, view=view)
+            if ROOM_REAPER_ACTION == "archive":
+                await archive_room(channel)
+                reaper_metrics["rooms_archived"] += 1
+            else:
+                await channel.delete(reason="idle room auto close")
+                reaper_metrics["rooms_deleted"] += 1
+        except discord.HTTPException as e:
+            reaper_metrics["errors"] += 1
+            if e.status == 429:
+                # レート制限中は残りを次回に回す
+                reaper_metrics["rate_limited"] += 1
+                break
+            if isinstance(e, discord.Forbidden):
+                # 権限がなければ何度試しても同じなので管理対象から外す
+                await reaper_unregister(channel_id)
+            else:
+                room_registry.touch(channel_id)
+            continue
+        await reaper_unregister(channel_id)
+        print(f"Closed idle room {channel_id} ({ROOM_REAPER_ACTION})")
+        await asyncio.sleep(ROOM_REAPER_ACTION_DELAY_SECONDS)
+
+
+@room_reaper.before_loop
+async def before_room_reaper():
+    await bot.wait_until_ready()
+
+
+# =========================================================
+# 返事のないマッチ申請の期限切れ
+# =========================================================
+# runs / batches / expired / backlog（上限まで処理して残りを次回に回した回数）/ errors
+expiry_metrics: Counter = Counter()
+
+
+@tasks.loop(seconds=MATCH_EXPIRY_INTERVAL_SECONDS)
+@observe_handler("match_expiry_sweep")
+async def match_expiry_sweeper():
+    """MATCH_PENDING_TTL_SECONDS より古い pending のマッチを1回あたり上限付きで期限切れにする"""
+    if MATCH_PENDING_TTL_SECONDS <= 0:
+        return
+    expiry_metrics["runs"] += 1
+    for _ in range(MATCH_EXPIRY_MAX_BATCHES):
+        try:
+            expired = await asyncio.to_thread(
+                expire_pending_matches, MATCH_PENDING_TTL_SECONDS, MATCH_EXPIRY_BATCH_SIZE
+            )
+        except Exception as e:
+            expiry_metrics["errors"] += 1
+            print(f"match expiry sweep failed: {e!r}")
             return
-        except Exception:
-            pass
-    
-    # 新規メッセージ
-    msg = await channel.send(embed=embed, view=view)
-    await asyncio.to_thread(set_message_id, user_id, category, msg.id)
+        expiry_metrics["batches"] += 1
+        for _, user1_id, user2_id, category in expired:
+            match_exclusions.discard(user1_id, user2_id, category)
+            MATCHES_EXPIRED_TOTAL.inc(category=category)
+        if expired and SEEN_FILTER_ENABLED:
+            # 既読フィルターからは消せないので、2人のフィルターを残っているマッチ相手から作り直す
+            stale = {(u, category) for _, user1_id, user2_id, category in expired for u in (user1_id, user2_id)}
+            try:
+                await asyncio.to_thread(seen_filters.rebuild, stale)
+            except Exception as e:
+                expiry_metrics["errors"] += 1
+                print(f"seen filter rebuild after expiry failed: {e!r}")
+        expiry_metrics["expired"] += len(expired)
+        if len(expired) < MATCH_EXPIRY_BATCH_SIZE:
+            return
+        # バッチの間はイベントループと DB ロックを他の処理に譲る
+        await asyncio.sleep(0)
+    expiry_metrics["backlog"] += 1
+
+
+@match_expiry_sweeper.before_loop
+async def before_match_expiry_sweeper():
+    await bot.wait_until_ready()
+
+
+# =========================================================
+# 既に見た候補のフィルター
+# =========================================================
+async def load_seen_filters_on_startup():
+    """保存済みのフィルターを読み、前回以降の matches を取り込んでから定期保存を始める"""
+    try:
+        stats = await asyncio.to_thread(seen_filters.load)
+    except Exception as e:
+        print(f"seen filter load failed, /match runs without it: {e!r}")
+        return
+    print(
+        f"Seen filters: {stats['filters_loaded']} loaded, {stats['matches_added']} match(es) caught up "
+        f"in {stats['seconds'] * 1000:.0f}ms"
+    )
+    if not seen_filter_flusher.is_running():
+        seen_filter_flusher.start()
+
+
+@tasks.loop(seconds=SEEN_FILTER_FLUSH_SECONDS)
+@observe_handler("seen_filter_flush")
+async def seen_filter_flusher():
+    """前回以降に変わったフィルターを seen_filters テーブルへ書き出す"""
+    try:
+        await asyncio.to_thread(seen_filters.flush)
+    except Exception as e:
+        seen_filters.counters["flush_errors"] += 1
+        print(f"seen filter flush failed: {e!r}")
 
 
 # =========================================================
@@ -482,12 +1362,73 @@ async def update_question_message(
 # =========================================================
 @bot.event
 async def on_ready():
+    """起動時の初期化（再接続で再度呼ばれても初回だけ実行）"""
+    global _startup_done
+    if _startup_done:
+        print(f"{bot.user} reconnected to Discord")
+        return
+    _startup_done = True
     print(f'{bot.user} has connected to Discord!')
-    init_db()
+    asyncio.create_task(metrics.monitor_event_loop_lag())
+    started = time.perf_counter()
+    timings = {}
+
+    t0 = time.perf_counter()
+    ran_ddl = await asyncio.to_thread(init_db)
+    timings["init_db" if ran_ddl else "init_db(skip)"] = time.perf_counter() - t0
+
+    outbound.start()
+    t0 = time.perf_counter()
+    await job_queue.recover()
+    job_queue.register(PROFILE_ANALYSIS_JOB, run_profile_analysis, on_dead=save_basic_profile)
+    job_queue.start()
+    asyncio.create_task(enqueue_missing_profiles())
+    timings["job_queue"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    await load_room_registry()
+    timings["room_registry"] = time.perf_counter() - t0
+    if not room_reaper.is_running():
+        room_reaper.start()
+    if not match_expiry_sweeper.is_running():
+        match_expiry_sweeper.start()
     try:
         bot.add_view(StartRoomView())
     except Exception as e:
         print("add_view failed:", repr(e))
+
+    # 初回の診断完了を待たせないよう、SDK の読み込みとモデル生成を裏で済ませておく
+    asyncio.create_task(asyncio.to_thread(lambda: matching_engine.model))
+    # /match の初回で候補プールとキーワード索引の構築を待たせない
+    asyncio.create_task(asyncio.to_thread(match_search.warm_up))
+    if SEEN_FILTER_ENABLED:
+        asyncio.create_task(load_seen_filters_on_startup())
+
+    t0 = time.perf_counter()
+    synced = await sync_commands_if_changed()
+    timings["tree_sync" if synced else "tree_sync(skip)"] = time.perf_counter() - t0
+
+    phases = " ".join(f"{name}={sec * 1000:.0f}ms" for name, sec in timings.items())
+    print(f"Startup finished in {(time.perf_counter() - started) * 1000:.0f}ms ({phases})")
+
+
+def command_tree_hash() -> str:
+    """登録済みスラッシュコマンド定義のハッシュ（同期先の GUILD_ID も含める）"""
+    commands_json = sorted(
+        (json.dumps(cmd.to_dict(), sort_keys=True, ensure_ascii=False) for cmd in bot.tree.get_commands()),
+    )
+    payload = json.dumps({"guild_id": GUILD_ID, "commands": commands_json}, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def sync_commands_if_changed() -> bool:
+    """コマンド定義が前回の同期から変わっていれば tree.sync する（同期したら True）"""
+    digest = command_tree_hash()
+    if not FORCE_COMMAND_SYNC:
+        last = await asyncio.to_thread(get_meta, COMMAND_HASH_META_KEY)
+        if last == digest:
+            print("Command definitions unchanged; skipping tree sync")
+            return False
     try:
         synced = await bot.tree.sync()
         print(f"Synced {len(synced)} command(s) globally")
@@ -499,6 +1440,15 @@ async def on_ready():
             print(f"Synced {len(g_synced)} command(s) to guild {GUILD_ID}")
     except Exception as e:
         print(f"Failed to sync commands: {e}")
+        return False
+    await asyncio.to_thread(set_meta, COMMAND_HASH_META_KEY, digest)
+    return True
+
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    """専用ルームが削除されたら登録簿から外す"""
+    await unregister_room(channel.id)
 
 
 @bot.event
@@ -511,14 +1461,26 @@ async def on_member_join(member: discord.Member):
     channel = member.guild.get_channel(WELCOME_CHANNEL_ID)
     if channel is None or not isinstance(channel, discord.TextChannel):
         return
+    # 参加が集中しても投稿が1人1通にならないよう、短時間ぶんのメンションをまとめる
+    outbound.coalesce(
+        channel.id,
+        member.mention,
+        f"channel:{channel.id}",
+        functools.partial(send_welcome_panel, channel)
+    )
+
+
+async def send_welcome_panel(channel: discord.TextChannel, mentions: List[str]):
+    """まとめたメンション宛てにウェルカムパネルを1通投稿"""
     embed = discord.Embed(
         title="🎯 AIマッチング診断スタート",
-        description=f"👋 {member.mention} さん、ようこそ！下のボタンを押すと、あなた専用の診断ルームが作成されます。",
+        description=f"👋 {' '.join(mentions)} さん、ようこそ！下のボタンを押すと、あなた専用の診断ルームが作成されます。",
     )
     await channel.send(embed=embed, view=StartRoomView())
 
 
 @bot.tree.command(name="room", description="専用診断ルームを作成し自動で開始")
+@observe_command("room")
 async def room(interaction: discord.Interaction):
     if interaction.guild is None or not isinstance(interaction.user, discord.Member):
         await interaction.response.send_message("サーバー内で実行してください。", ephemeral=True)
@@ -527,6 +1489,7 @@ async def room(interaction: discord.Interaction):
 
 
 @bot.tree.command(name="panel", description="診断開始ボタンを設置（運営専用）")
+@observe_command("panel")
 async def panel(interaction: discord.Interaction):
     if interaction.guild is None or not isinstance(interaction.user, discord.Member):
         await interaction.response.send_message("サーバー内で実行してください。", ephemeral=True)
@@ -539,6 +1502,7 @@ async def panel(interaction: discord.Interaction):
 
 
 @bot.tree.command(name="ping", description="動作確認（運営専用）")
+@observe_command("ping")
 async def ping(interaction: discord.Interaction):
     if interaction.guild is None or not isinstance(interaction.user, discord.Member):
         await interaction.response.send_message("サーバー内で実行してください。", ephemeral=True)
@@ -550,6 +1514,7 @@ async def ping(interaction: discord.Interaction):
 
 
 @bot.tree.command(name="sync", description="スラッシュコマンドを同期（運営専用）")
+@observe_command("sync")
 async def sync_cmd(interaction: discord.Interaction):
     """`/match` `/profile` などのコマンドをDiscordに反映"""
     if interaction.guild is None or not isinstance(interaction.user, discord.Member):
@@ -569,6 +1534,7 @@ async def sync_cmd(interaction: discord.Interaction):
 
 
 @bot.tree.command(name="logs", description="管理者用：利用状況を表示（Embed）")
+@observe_command("logs")
 async def logs(interaction: discord.Interaction):
     if interaction.guild is None or not isinstance(interaction.user, discord.Member):
         await interaction.response.send_message("サーバー内で実行してください。", ephemeral=True)
@@ -586,7 +1552,6 @@ async def logs(interaction: discord.Interaction):
     for cat, questions in CATEGORY_QUESTIONS.items():
         n = await asyncio.to_thread(count_completed_users, cat, len(questions))
         completed_total += n
-    rooms = [ch for ch in interaction.guild.text_channels if ch.name.startswith("match-")]
     total_questions = sum(len(q) for q in CATEGORY_QUESTIONS.values())
 
     embed = discord.Embed(
@@ -595,8 +1560,22 @@ async def logs(interaction: discord.Interaction):
     )
     embed.add_field(name="総ユーザー数", value=str(total), inline=True)
     embed.add_field(name="診断完了（全カテゴリー合計）", value=str(completed_total), inline=True)
-    embed.add_field(name="専用ルーム数", value=str(len(rooms)), inline=True)
+    embed.add_field(name="専用ルーム数", value=str(room_registry.count(interaction.guild.id)), inline=True)
     embed.add_field(name="総質問数", value=str(total_questions), inline=True)
+    jobs = await asyncio.to_thread(count_jobs_by_status)
+    embed.add_field(
+        name="バックグラウンドジョブ",
+        value=(f"待機 {jobs.get('pending', 0)} / 実行中 {jobs.get('running', 0)} / "
+               f"完了 {jobs.get('done', 0)} / 失敗 {jobs.get('dead', 0)}"),
+        inline=False
+    )
+    q = outbound.snapshot()
+    embed.add_field(
+        name="送信キュー",
+        value=(f"待ち {q['queued']}件 / 送信 {q['sent']} / 破棄 {q['dropped']} / "
+               f"429 {q['rate_limited']} / 最大待ち {q['queue_wait_max_seconds']:.1f}秒"),
+        inline=False
+    )
     for cat, meta in CATEGORY_META.items():
         s = cat_stats.get(cat, {"users": 0, "answers": 0})
         embed.add_field(
@@ -610,6 +1589,7 @@ async def logs(interaction: discord.Interaction):
 
 
 @bot.tree.command(name="sync_members", description="サーバーメンバーをDBに追加（管理者専用）")
+@observe_command("sync_members")
 async def sync_members(interaction: discord.Interaction):
     """サーバー参加メンバーをすべてDBに登録"""
     if interaction.guild is None or not isinstance(interaction.user, discord.Member):
@@ -638,7 +1618,79 @@ async def sync_members(interaction: discord.Interaction):
     )
 
 
+@bot.tree.command(name="export", description="回答・プロフィール・マッチを書き出す（管理者専用）")
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(
+    table="書き出すテーブル",
+    format="ファイル形式",
+    compress="gzip で圧縮する",
+    category="カテゴリーで絞り込む（省略時は全カテゴリー）",
+)
+@app_commands.choices(
+    table=[
+        app_commands.Choice(name="回答 (answers)", value="answers"),
+        app_commands.Choice(name="プロフィール (user_profiles)", value="user_profiles"),
+        app_commands.Choice(name="マッチ (matches)", value="matches"),
+    ],
+    format=[app_commands.Choice(name=fmt.upper(), value=fmt) for fmt in EXPORT_FORMATS],
+    category=[
+        app_commands.Choice(name="友達探し", value="friendship"),
+        app_commands.Choice(name="恋愛マッチング", value="dating"),
+        app_commands.Choice(name="ゲーム仲間", value="gaming"),
+        app_commands.Choice(name="ビジネス", value="business"),
+    ],
+)
+@observe_command("export")
+async def export(
+    interaction: discord.Interaction,
+    table: str,
+    format: str = "csv",
+    compress: bool = False,
+    category: Optional[str] = None,
+):
+    """テーブルをバッチごとにファイルへ書き出し、小さければ添付・大きければ保存先を返す"""
+    if interaction.guild is None or not isinstance(interaction.user, discord.Member):
+        await interaction.response.send_message("サーバー内で実行してください。", ephemeral=True)
+        return
+    if ADMIN_CHANNEL_ID > 0 and interaction.channel_id != ADMIN_CHANNEL_ID:
+        await interaction.response.send_message("このコマンドは管理者チャンネルでのみ使用できます。", ephemeral=True)
+        return
+    # 全ユーザーのデータを出すので、ロールが未設定なら誰にも許さない
+    if ADMIN_ROLE_ID <= 0:
+        await interaction.response.send_message("ADMIN_ROLE_ID が未設定のため使用できません。", ephemeral=True)
+        return
+    if not has_role_id(interaction.user, ADMIN_ROLE_ID):
+        await interaction.response.send_message("権限がありません。", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        with tracing.span("export.write") as sp:
+            result = await asyncio.to_thread(export_to_file, table, format, None, category, compress)
+            sp.set(table=table, rows=result.rows, bytes=result.bytes)
+    except Exception as e:
+        print(f"export {table} failed: {e!r}")
+        await interaction.followup.send("❌ 書き出しに失敗しました。ログを確認してください。", ephemeral=True)
+        return
+    EXPORT_ROWS_TOTAL.inc(result.rows, table=table, format=format)
+
+    summary = f"📦 {table}: {result.rows}行 / {result.bytes / 1024:.0f}KiB（{result.seconds:.1f}秒）"
+    if result.bytes > EXPORT_ATTACHMENT_MAX_BYTES:
+        await interaction.followup.send(
+            f"{summary}\n添付できる大きさを超えたため、サーバーに保存しました: `{result.path}`",
+            ephemeral=True
+        )
+        return
+    try:
+        await interaction.followup.send(
+            summary, file=discord.File(result.path, filename=os.path.basename(result.path)), ephemeral=True
+        )
+    finally:
+        await asyncio.to_thread(os.remove, result.path)
+
+
 @bot.tree.command(name="start", description="マッチングサービスを開始")
+@observe_command("start")
 async def start(interaction: discord.Interaction):
     """マッチングサービスの開始"""
     if interaction.guild is None:
@@ -674,22 +1726,11 @@ async def start(interaction: discord.Interaction):
     
     if view.category:
         # 診断開始
-        questions = CATEGORY_QUESTIONS[view.category]
-        order = await asyncio.to_thread(
-            get_or_create_order,
-            user_id,
-            view.category,
-            [q["id"] for q in questions]
-        )
-        
-        await update_question_message(
+        await start_category_diagnosis(
             interaction.channel,
             interaction.user.id,
             user_id,
-            view.category,
-            0,
-            order,
-            questions
+            view.category
         )
 
 
@@ -701,6 +1742,7 @@ async def start(interaction: discord.Interaction):
     app_commands.Choice(name="ゲーム仲間", value="gaming"),
     app_commands.Choice(name="ビジネス", value="business"),
 ])
+@observe_command("profile")
 async def profile(interaction: discord.Interaction, category: Optional[str] = None):
     """プロフィール表示"""
     user_id = await asyncio.to_thread(
@@ -776,6 +1818,7 @@ async def profile(interaction: discord.Interaction, category: Optional[str] = No
     app_commands.Choice(name="ゲーム仲間", value="gaming"),
     app_commands.Choice(name="ビジネス", value="business"),
 ])
+@observe_command("match")
 async def match(interaction: discord.Interaction, category: str):
     """マッチング検索"""
     await interaction.response.defer(ephemeral=True)
@@ -798,21 +1841,67 @@ async def match(interaction: discord.Interaction, category: str):
         )
         return
     
-    # 自分のプロフィールと回答を取得
-    my_profile = await asyncio.to_thread(get_profile, user_id, category)
-    my_answers = await asyncio.to_thread(load_answers, user_id, category)
-    
-    # 他のユーザーを検索
-    # TODO: データベースから効率的に検索する実装
-    # 現状はシンプルなデモ実装
-    await interaction.followup.send(
-        f"🔍 {CATEGORY_META[category]['emoji']} {CATEGORY_META[category]['name']}で検索中...\n\n"
-        f"現在、マッチング機能を実装中です。近日公開予定！",
-        ephemeral=True
+    # ページ送り・再実行はキャッシュ済みのランキングを使う（本人や候補が大きく変わったら作り直す）
+    result = match_search.cached(user_id, category)
+    if result is None:
+        # 候補になるのはプロフィール作成済みのユーザーだけなので、自分も分析完了を待つ
+        my_profile = await asyncio.to_thread(get_profile, user_id, category)
+        if not my_profile:
+            await interaction.followup.send(
+                "🔄 AIがプロフィールを分析中です。完了してからもう一度お試しください。",
+                ephemeral=True
+            )
+            return
+        my_answers = await asyncio.to_thread(load_answers, user_id, category)
+        # 既にマッチ（申請）がある相手は候補から外す
+        exclude = await asyncio.to_thread(match_exclusions.get, user_id, category)
+        # 過去にマッチした・表示した相手も外す（フィルターの読み込みが済むまでは使わない）
+        seen = seen_filters.get(user_id, category) if seen_filters.ready else None
+        with tracing.span("match.rank") as rank_span:
+            result = await asyncio.to_thread(match_search.rank, user_id, category, my_answers, exclude, seen)
+            rank_span.set(pool_size=result.pool_size, candidates=len(result.candidates))
+
+    if not result.candidates:
+        await interaction.followup.send(
+            f"{CATEGORY_META[category]['emoji']} まだマッチング候補がいません。しばらくしてからお試しください。",
+            ephemeral=True
+        )
+        return
+
+    view = MatchResultsView(interaction.user.id, user_id, result)
+    await interaction.followup.send(embed=await view.render(), view=view, ephemeral=True)
+
+
+@bot.tree.command(name="matches", description="マッチ履歴を表示")
+@app_commands.describe(category="カテゴリー")
+@app_commands.choices(category=[
+    app_commands.Choice(name="友達探し", value="friendship"),
+    app_commands.Choice(name="恋愛マッチング", value="dating"),
+    app_commands.Choice(name="ゲーム仲間", value="gaming"),
+    app_commands.Choice(name="ビジネス", value="business"),
+])
+@observe_command("matches")
+async def matches(interaction: discord.Interaction, category: str):
+    """マッチ履歴（新しい順にページ送り）"""
+    await interaction.response.defer(ephemeral=True)
+
+    user_id = await asyncio.to_thread(
+        get_user_by_discord_id,
+        str(interaction.user.id)
     )
 
+    if not user_id:
+        await interaction.followup.send("まだ登録されていません。`/start` で開始してください。", ephemeral=True)
+        return
+
+    counts = await asyncio.to_thread(count_user_matches, user_id, category)
+    view = MatchHistoryView(interaction.user.id, user_id, category, counts)
+    embed = await view.render()
+    await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+
 
 @bot.tree.command(name="stats", description="サービスの統計情報")
+@observe_command("stats")
 async def stats(interaction: discord.Interaction):
     """統計情報表示"""
     if not has_role_id(interaction.user, ADMIN_ROLE_ID) and ADMIN_ROLE_ID > 0:
@@ -844,4 +1933,5 @@ async def stats(interaction: discord.Interaction):
 # 起動
 # =========================================================
 if __name__ == "__main__":
+    metrics.start_http_server()
     bot.run(TOKEN)
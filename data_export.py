@@ -0,0 +1,174 @@
+"""
+answers / user_profiles / matches の書き出し（CSV / JSONL、gzip 可）
+
+- db_multi.iter_export_rows で EXPORT_BATCH_SIZE 件ずつ読み、バッチごとにエンコードして書くので、
+  メモリはテーブルの大きさによらず1バッチ分
+- 書き出し中はファイル名に .part を付け、終わってから置き換える
+- Bot の /export は EXPORT_DIR に書いてから添付し、EXPORT_ATTACHMENT_MAX_BYTES を超えたらファイルを残して場所を返す
+
+    python data_export.py answers --format csv
+    python data_export.py matches --format jsonl --gzip -o - > matches.jsonl.gz
+    python data_export.py all --format jsonl --gzip --category gaming --db synth.db
+"""
+import io
+import os
+import csv
+import sys
+import gzip
+import json
+import time
+import uuid
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+import db_multi
+
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_TABLES = tuple(db_multi.EXPORT_COLUMNS)
+EXPORT_DIR = os.environ.get("EXPORT_DIR", "exports")
+
+
+@dataclass
+class ExportResult:
+    table: str
+    format: str
+    path: str
+    rows: int
+    bytes: int
+    seconds: float
+
+
+def _encoded_batches(
+    table: str,
+    fmt: str,
+    category: Optional[str] = None,
+    batch_size: int = db_multi.EXPORT_BATCH_SIZE,
+) -> Iterator[Tuple[int, bytes]]:
+    """(行数, エンコード済みのバイト列) をバッチごとに返す（CSV は先頭にヘッダー行）"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unsupported export format {fmt!r}")
+    columns = db_multi.EXPORT_COLUMNS[table]
+    batches = db_multi.iter_export_rows(table, category, batch_size)
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(columns)
+        yield 0, buf.getvalue().encode("utf-8")
+        for batch in batches:
+            buf.seek(0)
+            buf.truncate()
+            writer.writerows(batch)
+            yield len(batch), buf.getvalue().encode("utf-8")
+    else:
+        for batch in batches:
+            text = "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in batch)
+            yield len(batch), text.encode("utf-8")
+
+
+def iter_chunks(
+    table: str,
+    fmt: str,
+    category: Optional[str] = None,
+    batch_size: int = db_multi.EXPORT_BATCH_SIZE,
+) -> Iterator[bytes]:
+    """書き出す内容をバッチごとのバイト列で返す（HTTP のストリーミング応答などに渡す用）"""
+    for _, chunk in _encoded_batches(table, fmt, category, batch_size):
+        yield chunk
+
+
+def write_export(
+    table: str,
+    fmt: str,
+    out: BinaryIO,
+    category: Optional[str] = None,
+    compress: bool = False,
+    batch_size: int = db_multi.EXPORT_BATCH_SIZE,
+) -> int:
+    """out に書き出して行数を返す（compress なら gzip で包む。out は閉じない）"""
+    rows = 0
+    target = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6, mtime=0) if compress else out
+    try:
+        for n, chunk in _encoded_batches(table, fmt, category, batch_size):
+            target.write(chunk)
+            rows += n
+    finally:
+        if compress:
+            target.close()
+    return rows
+
+
+def default_filename(table: str, fmt: str, compress: bool = False, category: Optional[str] = None) -> str:
+    """例: answers-gaming-20240101-120000-1a2b3c4d.csv.gz（同じ秒に書き出しても .part が重ならないよう末尾はランダム）"""
+    parts = [table] + ([category] if category else []) + [time.strftime("%Y%m%d-%H%M%S"), uuid.uuid4().hex[:8]]
+    return f"{'-'.join(parts)}.{fmt}{'.gz' if compress else ''}"
+
+
+def export_to_file(
+    table: str,
+    fmt: str,
+    path: Optional[str] = None,
+    category: Optional[str] = None,
+    compress: bool = False,
+    batch_size: int = db_multi.EXPORT_BATCH_SIZE,
+) -> ExportResult:
+    """
+    ファイルに書き出す（同期I/Oのため Bot からは to_thread で呼ぶ）
+
+    Args:
+        path: 書き出し先（省略時は EXPORT_DIR/default_filename）
+    """
+    if path is None:
+        path = os.path.join(EXPORT_DIR, default_filename(table, fmt, compress, category))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    started = time.perf_counter()
+    tmp = path + ".part"
+    try:
+        with open(tmp, "wb") as f:
+            rows = write_export(table, fmt, f, category, compress, batch_size)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return ExportResult(table, fmt, path, rows, os.path.getsize(path), time.perf_counter() - started)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="answers / user_profiles / matches を CSV / JSONL で書き出す")
+    parser.add_argument("table", choices=EXPORT_TABLES + ("all",))
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--gzip", action="store_true", help="gzip で圧縮する")
+    parser.add_argument("--category", help="カテゴリーで絞り込む")
+    parser.add_argument("-o", "--output", help="書き出し先（- で標準出力、省略時は --out-dir に自動命名）")
+    parser.add_argument("--out-dir", default=EXPORT_DIR)
+    parser.add_argument("--batch-size", type=int, default=db_multi.EXPORT_BATCH_SIZE)
+    parser.add_argument("--db", help="ローカル SQLite ファイル（省略時は Bot と同じ設定の DB）")
+    args = parser.parse_args(argv)
+
+    tables = EXPORT_TABLES if args.table == "all" else (args.table,)
+    if args.output and len(tables) > 1:
+        parser.error("-o は1テーブルのときだけ指定できます（all は --out-dir に書き出します）")
+    if args.db:
+        db_multi.use_local_db(os.path.abspath(args.db))
+    db_multi.init_db()
+
+    if args.output == "-":
+        started = time.perf_counter()
+        rows = write_export(tables[0], args.format, sys.stdout.buffer, args.category, args.gzip, args.batch_size)
+        sys.stdout.buffer.flush()
+        print(f"{tables[0]}: {rows} rows in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+        return 0
+
+    for table in tables:
+        path = args.output or os.path.join(
+            args.out_dir, default_filename(table, args.format, args.gzip, args.category)
+        )
+        result = export_to_file(table, args.format, path, args.category, args.gzip, args.batch_size)
+        print(f"{table}: {result.rows} rows, {result.bytes / 1024:.0f}KiB in {result.seconds:.2f}s -> {result.path}",
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
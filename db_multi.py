@@ -3,13 +3,21 @@ Turso (LibSQL) 対応のマルチカテゴリーDB層
 """
 import os
 import json
+import time
 import random
+import sqlite3
+import itertools
 import threading
-from typing import List, Tuple, Optional, Dict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Tuple, Optional, Dict
 
 import libsql
 from dotenv import load_dotenv
 
+import metrics
+import tracing
+
 # スクリプトのディレクトリを基準に.envを読み込む
 _script_dir = os.path.dirname(os.path.abspath(__file__))
 _env_path = os.path.join(_script_dir, "env.example")
@@ -24,10 +32,49 @@ _raw_db = os.environ.get("DB_PATH", "app_multi.db")
 DB_PATH = _raw_db if os.path.isabs(_raw_db) else os.path.join(_script_dir, os.path.basename(_raw_db))
 LIBSQL_URL = os.environ.get("LIBSQL_URL", "").strip()
 LIBSQL_AUTH_TOKEN = os.environ.get("LIBSQL_AUTH_TOKEN", "").strip()
+# turso: Turso の埋め込みレプリカ（既定） / local: ローカルの SQLite ファイルのみ（負荷試験・開発用、同期なし）
+DB_BACKEND = os.environ.get("DB_BACKEND", "turso").strip().lower()
+
+# スキーマ（テーブル・インデックス・移行処理）を変更したら上げる
+SCHEMA_VERSION = 6
 
 # グローバル接続（Turso同期用）
 _conn: Optional[libsql.Connection] = None
 _lock = threading.Lock()
+_schema_ready = False
+
+# 関数別の所要時間（ロック待ち / ロック内の実行 / Turso 同期）
+DB_LOCK_WAIT_SECONDS = metrics.histogram(
+    "db_lock_wait_seconds", "Time spent waiting for the db_multi connection lock", ["function"]
+)
+DB_EXECUTE_SECONDS = metrics.histogram(
+    "db_execute_seconds", "Time spent holding the db_multi lock, excluding sync_db", ["function"]
+)
+DB_SYNC_SECONDS = metrics.histogram(
+    "db_sync_seconds", "Time spent in sync_db (Turso replication)", ["function"]
+)
+_sync_state = threading.local()
+
+
+@contextmanager
+def _locked(function: str):
+    """_lock を取り、ロック待ち・実行・同期の時間を function 別に記録する（トレースのスパンも張る）"""
+    with tracing.span(f"db.{function}") as span:
+        t0 = time.perf_counter()
+        _lock.acquire()
+        t1 = time.perf_counter()
+        _sync_state.function = function
+        _sync_state.seconds = 0.0
+        try:
+            yield
+        finally:
+            synced = _sync_state.seconds
+            _sync_state.function = None
+            _lock.release()
+            t2 = time.perf_counter()
+            DB_LOCK_WAIT_SECONDS.observe(t1 - t0, function=function)
+            DB_EXECUTE_SECONDS.observe(t2 - t1 - synced, function=function)
+            span.set(lock_wait_ms=round((t1 - t0) * 1000, 2))
 
 
 def _migrate_user_msg_message_id_to_text(conn: "libsql.Connection") -> None:
@@ -58,11 +105,50 @@ def _migrate_user_msg_message_id_to_text(conn: "libsql.Connection") -> None:
         pass
 
 
+def _migrate_user_rooms_add_last_activity(conn: "libsql.Connection") -> None:
+    """user_rooms に last_activity_at 列を追加（アイドルルームの自動クローズ用）"""
+    try:
+        info = conn.execute("PRAGMA table_info(user_rooms)").fetchall()
+        if not info or any(r[1] == "last_activity_at" for r in info):
+            return
+        conn.execute("ALTER TABLE user_rooms ADD COLUMN last_activity_at TIMESTAMP")
+        conn.execute("UPDATE user_rooms SET last_activity_at=created_at")
+        conn.commit()
+    except Exception:
+        pass
+
+
+def _migrate_backfill_match_counts(conn: "libsql.Connection") -> None:
+    """match_counts 導入前の matches を集計して埋める（以降はトリガーで更新）"""
+    try:
+        if conn.execute("SELECT 1 FROM match_counts LIMIT 1").fetchone():
+            return
+        conn.execute("""
+        INSERT INTO match_counts(user_id, category, status, n)
+        SELECT user_id, category, status, COUNT(*) FROM (
+            SELECT user1_id AS user_id, category, status FROM matches
+            UNION ALL
+            SELECT user2_id, category, status FROM matches WHERE user2_id <> user1_id
+        )
+        WHERE status IS NOT NULL
+        GROUP BY user_id, category, status
+        """)
+        conn.commit()
+    except Exception:
+        pass
+
+
 def _get_conn() -> libsql.Connection:
     """Turso接続を取得（シングルトン）"""
     global _conn
     if _conn is None:
         with _lock:
+            if _conn is None and DB_BACKEND == "local":
+                # ロックで直列化しているのでスレッドをまたいで使ってよい
+                _conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+                _conn.execute("PRAGMA journal_mode=DELETE;")
+                _conn.execute("PRAGMA synchronous=NORMAL;")
+                _conn.commit()
             if _conn is None:
                 if not LIBSQL_URL or not LIBSQL_AUTH_TOKEN:
                     raise RuntimeError(
@@ -88,20 +174,101 @@ def _get_conn() -> libsql.Connection:
     return _conn
 
 
+def use_local_db(path: str) -> None:
+    """
+    接続先をローカルの SQLite ファイルに切り替える（負荷試験・開発用）
+
+    env.example の DB_PATH / Turso 設定より優先される。既存の接続は閉じる。
+    """
+    global _conn, _schema_ready, DB_BACKEND, DB_PATH
+    with _lock:
+        if _conn is not None:
+            try:
+                _conn.close()
+            except Exception:
+                pass
+        _conn = None
+        _schema_ready = False
+        DB_BACKEND = "local"
+        DB_PATH = path
+
+
 def sync_db() -> None:
     """ローカルDBの変更をTursoへ同期（アップロード）"""
     conn = _get_conn()
     if hasattr(conn, "sync"):
-        try:
-            conn.sync()
-        except Exception:
-            pass  # 同期失敗時は無視（オフライン等）
+        t0 = time.perf_counter()
+        with tracing.span("db.sync_db"):
+            try:
+                conn.sync()
+            except Exception:
+                pass  # 同期失敗時は無視（オフライン等）
+        elapsed = time.perf_counter() - t0
+        function = getattr(_sync_state, "function", None)
+        if function:
+            _sync_state.seconds += elapsed
+        DB_SYNC_SECONDS.observe(elapsed, function=function or "direct")
+
+
+# match_counts の増減（当事者2人それぞれの行。自分自身とのマッチは1人分だけ数える）
+_MATCH_COUNT_UPSERT = """
+    INSERT INTO match_counts(user_id, category, status, n)
+    SELECT {user}, {row}.category, {row}.status, {delta} WHERE {row}.status IS NOT NULL{extra}
+    ON CONFLICT(user_id, category, status) DO UPDATE SET n = n + ({delta});
+"""
 
 
-def init_db() -> None:
-    """複数カテゴリー対応のデータベース初期化"""
+def _match_count_delta(row: str, delta: int) -> str:
+    return (
+        _MATCH_COUNT_UPSERT.format(user=f"{row}.user1_id", row=row, delta=delta, extra="")
+        + _MATCH_COUNT_UPSERT.format(
+            user=f"{row}.user2_id", row=row, delta=delta, extra=f" AND {row}.user2_id <> {row}.user1_id"
+        )
+    )
+
+
+_MATCH_COUNT_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_match_counts_insert AFTER INSERT ON matches
+    BEGIN {_match_count_delta("NEW", 1)} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_match_counts_delete AFTER DELETE ON matches
+    BEGIN {_match_count_delta("OLD", -1)} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_match_counts_update AFTER UPDATE OF user1_id, user2_id, category, status ON matches
+    BEGIN {_match_count_delta("OLD", -1)} {_match_count_delta("NEW", 1)} END
+    """,
+)
+
+
+def init_db() -> bool:
+    """
+    複数カテゴリー対応のデータベース初期化
+
+    schema_meta に記録したスキーマバージョンが SCHEMA_VERSION と同じなら DDL・移行・同期を省略する。
+    同じプロセスで2回目以降の呼び出しは何もしない。
+
+    Returns:
+        DDL を実行した場合 True
+    """
+    global _schema_ready
+    if _schema_ready:
+        return False
     conn = _get_conn()
-    with _lock:
+    with _locked("init_db"):
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """)
+        row = conn.execute("SELECT value FROM schema_meta WHERE key='schema_version'").fetchone()
+        if row and int(row[0]) >= SCHEMA_VERSION:
+            _schema_ready = True
+            return False
+
         # ユーザーテーブル
         conn.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -178,6 +345,36 @@ def init_db() -> None:
             FOREIGN KEY (user2_id) REFERENCES users(user_id)
         )
         """)
+        # マッチ履歴のキーセットページング用（user1 側・user2 側をそれぞれ新しい順に読む。id は rowid なので末尾に含まれる）
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_matches_user1_created ON matches(user1_id, category, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_matches_user2_created ON matches(user2_id, category, created_at)")
+        # 期限切れの申請の掃除用（status='pending' の古い順）
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_matches_status_created ON matches(status, created_at)")
+
+        # ユーザー×カテゴリー×ステータス別のマッチ件数（matches のトリガーで更新し、履歴の件数表示を O(1) にする）
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS match_counts (
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            status TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, category, status)
+        )
+        """)
+        for trigger in _MATCH_COUNT_TRIGGERS:
+            conn.execute(trigger)
+
+        # ユーザー×カテゴリーごとの既に見た候補の Bloom フィルター（seen_filter.SeenFilter.to_bytes）
+        # どこまでの matches を反映したかは schema_meta の seen_filter_match_id
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS seen_filters (
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            data BLOB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, category)
+        )
+        """)
 
         # 会話履歴
         conn.execute("""
@@ -204,8 +401,71 @@ def init_db() -> None:
         )
         """)
 
+        # 専用診断ルームの登録簿（ギルド×ユーザー → チャンネル）
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_rooms (
+            guild_id TEXT NOT NULL,
+            discord_id TEXT NOT NULL,
+            channel_id TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (guild_id, discord_id)
+        )
+        """)
+
+        # バックグラウンドジョブ（プロフィール分析など）
+        # status: pending / running / done / dead、同じ dedupe_key のジョブは1件だけ
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            dedupe_key TEXT UNIQUE,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_after REAL NOT NULL DEFAULT 0,
+            lease_until REAL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs(status, run_after)")
+
         conn.commit()
         _migrate_user_msg_message_id_to_text(conn)
+        _migrate_user_rooms_add_last_activity(conn)
+        _migrate_backfill_match_counts(conn)
+        conn.execute(
+            "INSERT INTO schema_meta(key, value) VALUES('schema_version', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            (str(SCHEMA_VERSION),)
+        )
+        conn.commit()
+        sync_db()
+        _schema_ready = True
+    return True
+
+
+def get_meta(key: str) -> Optional[str]:
+    """schema_meta の値を取得"""
+    conn = _get_conn()
+    with _locked("get_meta"):
+        row = conn.execute("SELECT value FROM schema_meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+
+def set_meta(key: str, value: str) -> None:
+    """schema_meta に値を保存"""
+    conn = _get_conn()
+    with _locked("set_meta"):
+        conn.execute(
+            "INSERT INTO schema_meta(key, value) VALUES(?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            (key, value)
+        )
+        conn.commit()
         sync_db()
 
 
@@ -215,7 +475,7 @@ def init_db() -> None:
 def get_or_create_user(discord_id: str, username: str) -> int:
     """ユーザーを取得または作成"""
     conn = _get_conn()
-    with _lock:
+    with _locked("get_or_create_user"):
         row = conn.execute("SELECT user_id FROM users WHERE discord_id=?", (discord_id,)).fetchone()
 
         if row:
@@ -234,11 +494,46 @@ def get_or_create_user(discord_id: str, username: str) -> int:
 def get_user_by_discord_id(discord_id: str) -> Optional[int]:
     """Discord IDからユーザーIDを取得"""
     conn = _get_conn()
-    with _lock:
+    with _locked("get_user_by_discord_id"):
         row = conn.execute("SELECT user_id FROM users WHERE discord_id=?", (discord_id,)).fetchone()
         return int(row[0]) if row else None
 
 
+def get_discord_id_by_user_id(user_id: int) -> Optional[int]:
+    """内部ユーザーIDからDiscord IDを取得"""
+    conn = _get_conn()
+    with _locked("get_discord_id_by_user_id"):
+        row = conn.execute("SELECT discord_id FROM users WHERE user_id=?", (user_id,)).fetchone()
+        if not row:
+            return None
+        try:
+            return int(row[0])
+        except (TypeError, ValueError):
+            return None
+
+
+def get_users_by_ids(user_ids: List[int]) -> Dict[int, Dict]:
+    """内部ユーザーIDのリストから {user_id: {"discord_id", "username"}} を一括取得"""
+    if not user_ids:
+        return {}
+    conn = _get_conn()
+    with _locked("get_users_by_ids"):
+        placeholders = ",".join("?" * len(user_ids))
+        rows = conn.execute(
+            f"SELECT user_id, discord_id, username FROM users WHERE user_id IN ({placeholders})",
+            [int(u) for u in user_ids]
+        ).fetchall()
+        return {int(uid): {"discord_id": discord_id, "username": username or ""} for uid, discord_id, username in rows}
+
+
+def get_max_user_id() -> int:
+    """登録済みの最大ユーザーID（いなければ 0）"""
+    conn = _get_conn()
+    with _locked("get_max_user_id"):
+        row = conn.execute("SELECT MAX(user_id) FROM users").fetchone()
+        return int(row[0]) if row and row[0] is not None else 0
+
+
 # =========================================================
 # プロフィール管理
 # =========================================================
@@ -251,7 +546,7 @@ def create_or_update_profile(
 ) -> None:
     """プロフィールを作成または更新"""
     conn = _get_conn()
-    with _lock:
+    with _locked("create_or_update_profile"):
         interests_json = json.dumps(interests or [])
         traits_json = json.dumps(personality_traits or {})
 
@@ -272,7 +567,7 @@ def create_or_update_profile(
 def get_profile(user_id: int, category: str) -> Optional[Dict]:
     """プロフィールを取得"""
     conn = _get_conn()
-    with _lock:
+    with _locked("get_profile"):
         row = conn.execute("""
         SELECT bio, interests, personality_traits, active_status
         FROM user_profiles
@@ -292,7 +587,7 @@ def get_profile(user_id: int, category: str) -> Optional[Dict]:
 def get_user_categories(user_id: int) -> List[str]:
     """ユーザーが登録しているカテゴリー一覧を取得"""
     conn = _get_conn()
-    with _lock:
+    with _locked("get_user_categories"):
         rows = conn.execute("""
         SELECT category FROM user_profiles
         WHERE user_id=? AND active_status=1
@@ -300,13 +595,32 @@ def get_user_categories(user_id: int) -> List[str]:
         return [row[0] for row in rows]
 
 
+def load_profile_texts(category: str) -> List[Tuple[int, str, List[str]]]:
+    """カテゴリー内の有効なプロフィールの (user_id, bio, interests) を一括取得（テキスト索引用）"""
+    conn = _get_conn()
+    with _locked("load_profile_texts"):
+        rows = conn.execute("""
+        SELECT user_id, bio, interests
+        FROM user_profiles
+        WHERE category=? AND active_status=1
+        """, (category,)).fetchall()
+    result = []
+    for user_id, bio, interests in rows:
+        try:
+            keywords = json.loads(interests) if interests else []
+        except ValueError:
+            keywords = []
+        result.append((int(user_id), bio or "", keywords))
+    return result
+
+
 # =========================================================
 # 質問状態管理（カテゴリー別）
 # =========================================================
 def get_state(user_id: int, category: str) -> int:
     """カテゴリー別の質問進捗を取得"""
     conn = _get_conn()
-    with _lock:
+    with _locked("get_state"):
         row = conn.execute(
             "SELECT idx FROM user_state WHERE user_id=? AND category=?",
             (user_id, category)
@@ -325,7 +639,7 @@ def get_state(user_id: int, category: str) -> int:
 def set_state(user_id: int, category: str, idx: int) -> None:
     """カテゴリー別の質問進捗を更新"""
     conn = _get_conn()
-    with _lock:
+    with _locked("set_state"):
         conn.execute("""
         INSERT INTO user_state(user_id, category, idx) VALUES(?, ?, ?)
         ON CONFLICT(user_id, category) DO UPDATE SET idx=excluded.idx
@@ -340,7 +654,7 @@ def set_state(user_id: int, category: str, idx: int) -> None:
 def save_answer(user_id: int, category: str, question_id: int, answer: str) -> None:
     """回答を保存"""
     conn = _get_conn()
-    with _lock:
+    with _locked("save_answer"):
         conn.execute("""
         INSERT INTO answers(user_id, category, question_id, answer)
         VALUES(?, ?, ?, ?)
@@ -354,7 +668,7 @@ def save_answer(user_id: int, category: str, question_id: int, answer: str) -> N
 def load_answers(user_id: int, category: str) -> List[Tuple[int, str]]:
     """カテゴリー別の回答を読み込み"""
     conn = _get_conn()
-    with _lock:
+    with _locked("load_answers"):
         rows = conn.execute("""
         SELECT question_id, answer
         FROM answers
@@ -364,10 +678,49 @@ def load_answers(user_id: int, category: str) -> List[Tuple[int, str]]:
         return [(int(qid), ans) for (qid, ans) in rows]
 
 
+def load_completed_answers_all_categories() -> List[Tuple[int, str, int, str]]:
+    """
+    プロフィール作成済み（診断完了）の全カテゴリーの回答を1クエリで取得
+
+    Returns:
+        [(user_id, category, question_id, answer), ...]（user_id, category 順）
+    """
+    conn = _get_conn()
+    with _locked("load_completed_answers_all_categories"):
+        rows = conn.execute("""
+        SELECT a.user_id, a.category, a.question_id, a.answer
+        FROM answers a
+        JOIN user_profiles p
+          ON p.user_id = a.user_id AND p.category = a.category AND p.active_status = 1
+        ORDER BY a.user_id, a.category
+        """).fetchall()
+        return [(int(uid), cat, int(qid), ans) for (uid, cat, qid, ans) in rows]
+
+
+def load_category_answers(category: str) -> List[Tuple[int, int, str]]:
+    """
+    カテゴリー内のプロフィール作成済みユーザーの回答を1クエリで取得（/match の候補プール用）
+
+    Returns:
+        [(user_id, question_id, answer), ...]（user_id 順）
+    """
+    conn = _get_conn()
+    with _locked("load_category_answers"):
+        rows = conn.execute("""
+        SELECT a.user_id, a.question_id, a.answer
+        FROM answers a
+        JOIN user_profiles p
+          ON p.user_id = a.user_id AND p.category = a.category AND p.active_status = 1
+        WHERE a.category=?
+        ORDER BY a.user_id
+        """, (category,)).fetchall()
+        return [(int(uid), int(qid), ans) for (uid, qid, ans) in rows]
+
+
 def reset_user_category(user_id: int, category: str) -> None:
     """特定カテゴリーのデータをリセット"""
     conn = _get_conn()
-    with _lock:
+    with _locked("reset_user_category"):
         conn.execute("DELETE FROM answers WHERE user_id=? AND category=?", (user_id, category))
         conn.execute("DELETE FROM user_state WHERE user_id=? AND category=?", (user_id, category))
         conn.execute("DELETE FROM question_order WHERE user_id=? AND category=?", (user_id, category))
@@ -381,7 +734,7 @@ def reset_user_category(user_id: int, category: str) -> None:
 def get_or_create_order(user_id: int, category: str, question_ids: List[int]) -> List[int]:
     """質問順序を取得または作成"""
     conn = _get_conn()
-    with _lock:
+    with _locked("get_or_create_order"):
         row = conn.execute(
             "SELECT order_json FROM question_order WHERE user_id=? AND category=?",
             (user_id, category)
@@ -402,7 +755,7 @@ def get_or_create_order(user_id: int, category: str, question_ids: List[int]) ->
 def reset_order(user_id: int, category: str) -> None:
     """質問順序をリセット"""
     conn = _get_conn()
-    with _lock:
+    with _locked("reset_order"):
         conn.execute(
             "DELETE FROM question_order WHERE user_id=? AND category=?",
             (user_id, category)
@@ -416,7 +769,7 @@ def reset_order(user_id: int, category: str) -> None:
 def get_message_id(user_id: int, category: str) -> Optional[int]:
     """メッセージIDを取得"""
     conn = _get_conn()
-    with _lock:
+    with _locked("get_message_id"):
         row = conn.execute(
             "SELECT message_id FROM user_msg WHERE user_id=? AND category=?",
             (user_id, category)
@@ -432,7 +785,7 @@ def get_message_id(user_id: int, category: str) -> Optional[int]:
 def set_message_id(user_id: int, category: str, message_id: int) -> None:
     """メッセージIDを保存（TEXT で保存して Turso ダッシュボードの JS オーバーフローを防ぐ）"""
     conn = _get_conn()
-    with _lock:
+    with _locked("set_message_id"):
         conn.execute("""
         INSERT INTO user_msg(user_id, category, message_id) VALUES(?, ?, ?)
         ON CONFLICT(user_id, category) DO UPDATE SET message_id=excluded.message_id
@@ -444,7 +797,7 @@ def set_message_id(user_id: int, category: str, message_id: int) -> None:
 def reset_message_id(user_id: int, category: str) -> None:
     """メッセージIDをリセット"""
     conn = _get_conn()
-    with _lock:
+    with _locked("reset_message_id"):
         conn.execute(
             "DELETE FROM user_msg WHERE user_id=? AND category=?",
             (user_id, category)
@@ -452,6 +805,204 @@ def reset_message_id(user_id: int, category: str) -> None:
         conn.commit()
 
 
+# =========================================================
+# 専用ルーム管理
+# =========================================================
+def load_user_rooms() -> List[Tuple[int, int, int, float]]:
+    """登録済みの専用ルームを全件取得 [(guild_id, discord_id, channel_id, last_activity_epoch), ...]"""
+    conn = _get_conn()
+    with _locked("load_user_rooms"):
+        rows = conn.execute("""
+        SELECT guild_id, discord_id, channel_id,
+               CAST(strftime('%s', COALESCE(last_activity_at, created_at)) AS INTEGER)
+        FROM user_rooms
+        """).fetchall()
+        return [(int(g), int(d), int(c), float(t or 0)) for (g, d, c, t) in rows]
+
+
+def set_user_room(guild_id: int, discord_id: int, channel_id: int) -> None:
+    """専用ルームを登録（IDは TEXT で保存）"""
+    conn = _get_conn()
+    with _locked("set_user_room"):
+        conn.execute("DELETE FROM user_rooms WHERE channel_id=?", (str(channel_id),))
+        conn.execute("""
+        INSERT INTO user_rooms(guild_id, discord_id, channel_id) VALUES(?, ?, ?)
+        ON CONFLICT(guild_id, discord_id) DO UPDATE SET
+            channel_id=excluded.channel_id,
+            created_at=CURRENT_TIMESTAMP,
+            last_activity_at=CURRENT_TIMESTAMP
+        """, (str(guild_id), str(discord_id), str(channel_id)))
+        conn.commit()
+        sync_db()
+
+
+def touch_user_rooms(activity: List[Tuple[int, float]]) -> None:
+    """ルームの最終アクティビティをまとめて更新 [(channel_id, epoch_seconds), ...]"""
+    if not activity:
+        return
+    conn = _get_conn()
+    with _locked("touch_user_rooms"):
+        conn.executemany(
+            "UPDATE user_rooms SET last_activity_at=datetime(?, 'unixepoch') WHERE channel_id=?",
+            [(int(ts), str(cid)) for cid, ts in activity]
+        )
+        conn.commit()
+        sync_db()
+
+
+def delete_user_room_by_channel(channel_id: int) -> None:
+    """チャンネル削除時に登録を外す"""
+    conn = _get_conn()
+    with _locked("delete_user_room_by_channel"):
+        conn.execute("DELETE FROM user_rooms WHERE channel_id=?", (str(channel_id),))
+        conn.commit()
+        sync_db()
+
+
+# =========================================================
+# バックグラウンドジョブ
+# =========================================================
+def enqueue_job(kind: str, payload: Dict, dedupe_key: Optional[str] = None, max_attempts: int = 5) -> int:
+    """
+    ジョブを登録してIDを返す
+
+    同じ dedupe_key のジョブが待機中・実行中ならそれを返し、完了済み・失敗済みなら登録し直す。
+    """
+    conn = _get_conn()
+    with _locked("enqueue_job"):
+        payload_json = json.dumps(payload, ensure_ascii=False)
+        if dedupe_key is None:
+            conn.execute(
+                "INSERT INTO jobs(kind, payload, max_attempts) VALUES(?, ?, ?)",
+                (kind, payload_json, max_attempts)
+            )
+            row = conn.execute("SELECT last_insert_rowid()").fetchone()
+        else:
+            conn.execute("""
+            INSERT INTO jobs(kind, dedupe_key, payload, max_attempts)
+            VALUES(?, ?, ?, ?)
+            ON CONFLICT(dedupe_key) DO UPDATE SET
+                kind=excluded.kind,
+                payload=excluded.payload,
+                status='pending',
+                attempts=0,
+                max_attempts=excluded.max_attempts,
+                run_after=0,
+                lease_until=NULL,
+                last_error=NULL,
+                updated_at=CURRENT_TIMESTAMP
+            WHERE jobs.status IN ('done', 'dead')
+            """, (kind, dedupe_key, payload_json, max_attempts))
+            row = conn.execute("SELECT id FROM jobs WHERE dedupe_key=?", (dedupe_key,)).fetchone()
+        conn.commit()
+        sync_db()
+        return int(row[0])
+
+
+def claim_jobs(kinds: List[str], limit: int, lease_seconds: float) -> List[Tuple[int, str, Dict, int]]:
+    """
+    実行可能なジョブを最大 limit 件取り出して実行中にする
+
+    待機中で run_after を過ぎたもの、またはリース切れの実行中ジョブが対象。
+
+    Returns:
+        [(job_id, kind, payload, attempts), ...]  attempts は今回の試行を含む回数
+    """
+    if not kinds or limit <= 0:
+        return []
+    conn = _get_conn()
+    now = time.time()
+    placeholders = ",".join("?" * len(kinds))
+    with _locked("claim_jobs"):
+        rows = conn.execute(f"""
+        SELECT id, kind, payload, attempts FROM jobs
+        WHERE kind IN ({placeholders})
+          AND ((status='pending' AND run_after<=?) OR (status='running' AND lease_until<?))
+        ORDER BY run_after, id
+        LIMIT ?
+        """, (*kinds, now, now, limit)).fetchall()
+        if not rows:
+            return []
+        conn.executemany("""
+        UPDATE jobs SET status='running', attempts=attempts+1, lease_until=?, updated_at=CURRENT_TIMESTAMP
+        WHERE id=?
+        """, [(now + lease_seconds, r[0]) for r in rows])
+        conn.commit()
+        sync_db()
+        return [(int(r[0]), r[1], json.loads(r[2]), int(r[3]) + 1) for r in rows]
+
+
+def complete_job(job_id: int) -> None:
+    """ジョブを完了にする"""
+    conn = _get_conn()
+    with _locked("complete_job"):
+        conn.execute(
+            "UPDATE jobs SET status='done', lease_until=NULL, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+            (job_id,)
+        )
+        conn.commit()
+        sync_db()
+
+
+def fail_job(job_id: int, error: str, retry_delay: float) -> bool:
+    """
+    ジョブの失敗を記録し、試行回数が残っていれば retry_delay 秒後に再実行する
+
+    Returns:
+        上限に達して dead になった場合 True
+    """
+    conn = _get_conn()
+    with _locked("fail_job"):
+        conn.execute("""
+        UPDATE jobs SET
+            status=CASE WHEN attempts>=max_attempts THEN 'dead' ELSE 'pending' END,
+            run_after=?,
+            lease_until=NULL,
+            last_error=?,
+            updated_at=CURRENT_TIMESTAMP
+        WHERE id=?
+        """, (time.time() + retry_delay, error[:1000], job_id))
+        row = conn.execute("SELECT status FROM jobs WHERE id=?", (job_id,)).fetchone()
+        conn.commit()
+        sync_db()
+        return bool(row) and row[0] == "dead"
+
+
+def requeue_running_jobs() -> int:
+    """起動時に、前のプロセスで実行中のまま残ったジョブを待機中に戻す"""
+    conn = _get_conn()
+    with _locked("requeue_running_jobs"):
+        n = conn.execute("SELECT COUNT(*) FROM jobs WHERE status='running'").fetchone()[0]
+        if n:
+            conn.execute("""
+            UPDATE jobs SET status='pending', run_after=0, lease_until=NULL, updated_at=CURRENT_TIMESTAMP
+            WHERE status='running'
+            """)
+            conn.commit()
+            sync_db()
+        return int(n)
+
+
+def count_jobs_by_status() -> Dict[str, int]:
+    """ステータス別のジョブ件数"""
+    conn = _get_conn()
+    with _locked("count_jobs_by_status"):
+        rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {r[0]: int(r[1]) for r in rows}
+
+
+def find_completed_without_profile(category: str, total_questions: int) -> List[int]:
+    """診断は完了しているのにプロフィールがないユーザー（分析中の再起動などで取り残されたもの）"""
+    conn = _get_conn()
+    with _locked("find_completed_without_profile"):
+        rows = conn.execute("""
+        SELECT s.user_id FROM user_state s
+        LEFT JOIN user_profiles p ON p.user_id=s.user_id AND p.category=s.category
+        WHERE s.category=? AND s.idx>=? AND p.user_id IS NULL
+        """, (category, total_questions)).fetchall()
+        return [int(r[0]) for r in rows]
+
+
 # =========================================================
 # マッチング管理
 # =========================================================
@@ -463,7 +1014,7 @@ def create_match(
 ) -> int:
     """マッチを作成"""
     conn = _get_conn()
-    with _lock:
+    with _locked("create_match"):
         conn.execute("""
         INSERT INTO matches(user1_id, user2_id, category, match_score, status)
         VALUES(?, ?, ?, ?, 'pending')
@@ -475,9 +1026,9 @@ def create_match(
 
 
 def get_user_matches(user_id: int, category: str, status: str = None) -> List[Dict]:
-    """ユーザーのマッチ履歴を取得"""
+    """ユーザーのマッチ履歴を全件取得（履歴の表示には件数が上限付きの get_user_matches_page を使う）"""
     conn = _get_conn()
-    with _lock:
+    with _locked("get_user_matches"):
         query = """
         SELECT id, user1_id, user2_id, match_score, status, created_at
         FROM matches
@@ -507,10 +1058,175 @@ def get_user_matches(user_id: int, category: str, status: str = None) -> List[Di
         return matches
 
 
+# マッチ履歴の1ページの既定件数とカーソル（最後に返した行の (created_at, id)）
+MATCH_HISTORY_PAGE_SIZE = int(os.environ.get("MATCH_HISTORY_PAGE_SIZE", "20"))
+MatchCursor = Tuple[str, int]
+
+
+@dataclass(slots=True)
+class MatchRow:
+    """マッチ履歴の1行（row_mode="slots" 用の軽量な行）"""
+    id: int
+    user1_id: int
+    user2_id: int
+    match_score: Optional[float]
+    status: str
+    created_at: str
+
+
+_MATCH_COLUMNS = "id, user1_id, user2_id, match_score, status, created_at"
+
+
+def get_user_matches_page(
+    user_id: int,
+    category: str,
+    status: Optional[str] = None,
+    limit: int = MATCH_HISTORY_PAGE_SIZE,
+    before: Optional[MatchCursor] = None,
+    row_mode: str = "dict",
+) -> Tuple[List, Optional[MatchCursor]]:
+    """
+    マッチ履歴を新しい順に limit 件ずつ取得（(created_at, id) のキーセットページング）
+
+    user1 側・user2 側をそれぞれのインデックスから limit+1 件だけ読んで合わせるので、
+    履歴の長さに関係なく1ページの読み取り量は一定。status で絞る場合は該当しない行を読み飛ばす。
+
+    Args:
+        before: 前のページが返したカーソル（None なら最新から）
+        row_mode: "dict"（get_user_matches と同じキー）/ "tuple"（列の並びのタプル）/ "slots"（MatchRow）
+
+    Returns:
+        (行のリスト, 次のページのカーソル。最後のページなら None)
+    """
+    if row_mode not in ("dict", "tuple", "slots"):
+        raise ValueError(f"row_mode must be dict, tuple or slots: {row_mode!r}")
+    limit = max(1, int(limit))
+    conditions = ""
+    side_params: List = []
+    if status:
+        conditions += " AND status=?"
+        side_params.append(status)
+    if before is not None:
+        conditions += " AND (created_at, id) < (?, ?)"
+        side_params.extend([before[0], int(before[1])])
+    side = (
+        f"SELECT * FROM (SELECT {_MATCH_COLUMNS} FROM matches "
+        f"WHERE {{column}}=? AND category=?{{extra}}{conditions} "
+        f"ORDER BY created_at DESC, id DESC LIMIT ?)"
+    )
+    query = (
+        side.format(column="user1_id", extra="")
+        + " UNION ALL "
+        + side.format(column="user2_id", extra=" AND user1_id<>?")
+        + " ORDER BY created_at DESC, id DESC LIMIT ?"
+    )
+    params = (
+        [user_id, category, *side_params, limit + 1]
+        + [user_id, category, user_id, *side_params, limit + 1]
+        + [limit + 1]
+    )
+    conn = _get_conn()
+    with _locked("get_user_matches_page"):
+        rows = conn.execute(query, params).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1][5], int(rows[-1][0]))
+    if row_mode == "tuple":
+        return [tuple(r) for r in rows], next_cursor
+    if row_mode == "slots":
+        return [MatchRow(*r) for r in rows], next_cursor
+    keys = ("id", "user1_id", "user2_id", "match_score", "status", "created_at")
+    return [dict(zip(keys, r)) for r in rows], next_cursor
+
+
+def count_user_matches(user_id: int, category: str) -> Dict[str, int]:
+    """ユーザーのステータス別マッチ件数（match_counts の主キーで引くので履歴の長さに依存しない）"""
+    conn = _get_conn()
+    with _locked("count_user_matches"):
+        rows = conn.execute(
+            "SELECT status, n FROM match_counts WHERE user_id=? AND category=? AND n > 0",
+            (user_id, category)
+        ).fetchall()
+        return {status: int(n) for status, n in rows}
+
+
+def _status_filter(statuses: Optional[Iterable[str]]) -> Tuple[str, List[str]]:
+    if statuses is None:
+        return "", []
+    statuses = list(statuses)
+    return f" AND status IN ({','.join('?' * len(statuses))})", statuses
+
+
+def has_match_between(
+    user_a: int,
+    user_b: int,
+    category: str,
+    statuses: Optional[Iterable[str]] = None
+) -> bool:
+    """2人の間にマッチ（どちらからの申請でも）があるか（statuses 省略時はステータス問わず）"""
+    cond, status_params = _status_filter(statuses)
+    conn = _get_conn()
+    with _locked("has_match_between"):
+        row = conn.execute(f"""
+        SELECT 1 FROM matches WHERE user1_id=? AND category=? AND user2_id=?{cond}
+        UNION ALL
+        SELECT 1 FROM matches WHERE user1_id=? AND category=? AND user2_id=?{cond}
+        LIMIT 1
+        """, (user_a, category, user_b, *status_params, user_b, category, user_a, *status_params)).fetchone()
+        return row is not None
+
+
+def get_match_partner_ids(user_id: int, category: str, statuses: Optional[Iterable[str]] = None) -> List[int]:
+    """マッチ（申請）がある相手の user_id 一覧（候補からの除外用、statuses 省略時はステータス問わず）"""
+    cond, status_params = _status_filter(statuses)
+    conn = _get_conn()
+    with _locked("get_match_partner_ids"):
+        rows = conn.execute(f"""
+        SELECT user2_id FROM matches WHERE user1_id=? AND category=?{cond}
+        UNION
+        SELECT user1_id FROM matches WHERE user2_id=? AND category=?{cond}
+        """, (user_id, category, *status_params, user_id, category, *status_params)).fetchall()
+        return [int(r[0]) for r in rows if int(r[0]) != user_id]
+
+
+def expire_pending_matches(max_age_seconds: float, limit: int) -> List[Tuple[int, int, int, str]]:
+    """
+    max_age_seconds より前に作られた pending のマッチを古い順に最大 limit 件 'expired' にする
+
+    (status, created_at) のインデックスを古い順に limit 件だけ読むので、1回の処理量は一定。
+
+    Returns:
+        期限切れにした [(match_id, user1_id, user2_id, category), ...]
+    """
+    # created_at は CURRENT_TIMESTAMP（UTC の 'YYYY-MM-DD HH:MM:SS'）なので同じ形式の文字列で比べる
+    cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - max_age_seconds))
+    conn = _get_conn()
+    with _locked("expire_pending_matches"):
+        rows = conn.execute("""
+        SELECT id, user1_id, user2_id, category FROM matches
+        WHERE status='pending' AND created_at < ?
+        ORDER BY created_at
+        LIMIT ?
+        """, (cutoff, int(limit))).fetchall()
+        if not rows:
+            return []
+        ids = [int(r[0]) for r in rows]
+        conn.execute(
+            f"UPDATE matches SET status='expired', updated_at=CURRENT_TIMESTAMP "
+            f"WHERE status='pending' AND id IN ({','.join('?' * len(ids))})",
+            ids
+        )
+        conn.commit()
+        sync_db()
+        return [(int(mid), int(u1), int(u2), cat) for mid, u1, u2, cat in rows]
+
+
 def update_match_status(match_id: int, status: str) -> None:
     """マッチのステータスを更新"""
     conn = _get_conn()
-    with _lock:
+    with _locked("update_match_status"):
         conn.execute("""
         UPDATE matches
         SET status=?, updated_at=CURRENT_TIMESTAMP
@@ -519,13 +1235,81 @@ def update_match_status(match_id: int, status: str) -> None:
         conn.commit()
 
 
+# =========================================================
+# 既に見た候補のフィルター（seen_filter.py）
+# =========================================================
+SEEN_FILTER_BATCH_SIZE = int(os.environ.get("SEEN_FILTER_BATCH_SIZE", "50000"))
+
+
+def iter_match_pairs(
+    after_id: int = 0,
+    batch_size: int = SEEN_FILTER_BATCH_SIZE,
+    statuses: Optional[Iterable[str]] = None
+) -> Iterator[List[Tuple[int, int, int, str]]]:
+    """
+    id が after_id より大きいマッチを id 順に batch_size 件ずつ返す（statuses 省略時はステータス問わず）
+
+    id のキーセットで読むのでバッチごとにロックを離し、件数が多くてもメモリは1バッチ分で済む。
+
+    Yields:
+        [(match_id, user1_id, user2_id, category), ...]
+    """
+    cond, status_params = _status_filter(statuses)
+    conn = _get_conn()
+    while True:
+        with _locked("iter_match_pairs"):
+            rows = conn.execute(f"""
+            SELECT id, user1_id, user2_id, category FROM matches
+            WHERE id > ?{cond}
+            ORDER BY id
+            LIMIT ?
+            """, (after_id, *status_params, int(batch_size))).fetchall()
+        if not rows:
+            return
+        batch = [(int(mid), int(u1), int(u2), cat) for mid, u1, u2, cat in rows]
+        yield batch
+        after_id = batch[-1][0]
+
+
+def load_seen_filters() -> List[Tuple[int, str, bytes]]:
+    """保存済みのフィルター [(user_id, category, data), ...]"""
+    conn = _get_conn()
+    with _locked("load_seen_filters"):
+        rows = conn.execute("SELECT user_id, category, data FROM seen_filters").fetchall()
+        return [(int(user_id), category, bytes(data)) for user_id, category, data in rows]
+
+
+def save_seen_filters(rows: List[Tuple[int, str, bytes]]) -> None:
+    """フィルターをまとめて保存（[(user_id, category, data), ...]）"""
+    if not rows:
+        return
+    conn = _get_conn()
+    with _locked("save_seen_filters"):
+        conn.executemany("""
+        INSERT INTO seen_filters(user_id, category, data) VALUES(?, ?, ?)
+        ON CONFLICT(user_id, category) DO UPDATE SET data=excluded.data, updated_at=CURRENT_TIMESTAMP
+        """, rows)
+        conn.commit()
+        sync_db()
+
+
+def clear_seen_filters() -> None:
+    """保存済みのフィルターと反映済みの matches の id を消す（matches から作り直す前に）"""
+    conn = _get_conn()
+    with _locked("clear_seen_filters"):
+        conn.execute("DELETE FROM seen_filters")
+        conn.execute("DELETE FROM schema_meta WHERE key='seen_filter_match_id'")
+        conn.commit()
+        sync_db()
+
+
 # =========================================================
 # 統計情報
 # =========================================================
 def count_total_users() -> int:
     """総ユーザー数"""
     conn = _get_conn()
-    with _lock:
+    with _locked("count_total_users"):
         row = conn.execute("SELECT COUNT(*) FROM users").fetchone()
         return int(row[0])
 
@@ -533,7 +1317,7 @@ def count_total_users() -> int:
 def count_completed_users(category: str, total_questions: int) -> int:
     """カテゴリー別の診断完了ユーザー数"""
     conn = _get_conn()
-    with _lock:
+    with _locked("count_completed_users"):
         row = conn.execute(
             "SELECT COUNT(*) FROM user_state WHERE category=? AND idx >= ?",
             (category, total_questions)
@@ -544,7 +1328,7 @@ def count_completed_users(category: str, total_questions: int) -> int:
 def count_matches_by_category(category: str) -> int:
     """カテゴリー別のマッチ数"""
     conn = _get_conn()
-    with _lock:
+    with _locked("count_matches_by_category"):
         row = conn.execute("SELECT COUNT(*) FROM matches WHERE category=?", (category,)).fetchone()
         return int(row[0])
 
@@ -552,7 +1336,7 @@ def count_matches_by_category(category: str) -> int:
 def get_category_stats() -> Dict[str, Dict]:
     """全カテゴリーの統計情報"""
     conn = _get_conn()
-    with _lock:
+    with _locked("get_category_stats"):
         stats = {}
         categories = ["friendship", "dating", "gaming", "business"]
 
@@ -570,3 +1354,110 @@ def get_category_stats() -> Dict[str, Dict]:
             }
 
         return stats
+
+
+# =========================================================
+# 一括投入（合成データ・データ移行用）
+# =========================================================
+# 受け付けるテーブルと列の並び
+BULK_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "users": ("user_id", "discord_id", "username"),
+    "answers": ("user_id", "category", "question_id", "answer"),
+    "user_state": ("user_id", "category", "idx"),
+    "question_order": ("user_id", "category", "order_json"),
+    "user_profiles": ("user_id", "category", "bio", "interests", "personality_traits"),
+    "user_msg": ("user_id", "category", "message_id"),
+    "matches": ("user1_id", "user2_id", "category", "match_score", "status"),
+    "user_rooms": ("guild_id", "discord_id", "channel_id"),
+    "jobs": ("kind", "dedupe_key", "payload", "status", "attempts"),
+}
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", "50000"))
+
+
+def bulk_load(
+    rows_by_table: Dict[str, Iterable[tuple]],
+    replace: bool = False,
+    batch_size: int = BULK_BATCH_SIZE
+) -> Dict[str, int]:
+    """
+    複数テーブルに行をまとめて投入（1トランザクション・Turso 同期は最後に1回）
+
+    行はイテラブルから batch_size 件ずつ取り出して executemany するので、生成しながら渡してよい。
+
+    Args:
+        rows_by_table: {テーブル名: 行のイテラブル}（列の並びは BULK_COLUMNS）
+        replace: 主キーが重複する行を置き換える（False なら重複でエラーになり、全体を取り消す）
+
+    Returns:
+        テーブル別の投入行数
+    """
+    unknown = set(rows_by_table) - set(BULK_COLUMNS)
+    if unknown:
+        raise ValueError(f"bulk_load: unsupported table(s) {sorted(unknown)}")
+    conn = _get_conn()
+    verb = "INSERT OR REPLACE" if replace else "INSERT"
+    counts = {}
+    with _locked("bulk_load"):
+        try:
+            for table, rows in rows_by_table.items():
+                columns = BULK_COLUMNS[table]
+                sql = f"{verb} INTO {table}({', '.join(columns)}) VALUES({', '.join('?' * len(columns))})"
+                it = iter(rows)
+                n = 0
+                while True:
+                    batch = list(itertools.islice(it, batch_size))
+                    if not batch:
+                        break
+                    conn.executemany(sql, batch)
+                    n += len(batch)
+                counts[table] = n
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        sync_db()
+    return counts
+
+
+# =========================================================
+# データの書き出し（data_export.py）
+# =========================================================
+# テーブル → 書き出す列（interests / personality_traits は JSON 文字列のまま）
+EXPORT_COLUMNS = {
+    "answers": ("user_id", "category", "question_id", "answer", "answered_at"),
+    "user_profiles": (
+        "user_id", "category", "bio", "interests", "personality_traits",
+        "active_status", "created_at", "updated_at",
+    ),
+    "matches": ("id", "user1_id", "user2_id", "category", "match_score", "status", "created_at", "updated_at"),
+}
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "5000"))
+
+
+def iter_export_rows(
+    table: str,
+    category: Optional[str] = None,
+    batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[List[tuple]]:
+    """
+    テーブルの行を rowid 順に batch_size 件ずつ返す（列の並びは EXPORT_COLUMNS）
+
+    1本のカーソルを開いたままにすると書き出しの間ずっと接続のロックを握るので、
+    rowid のキーセットでバッチごとに読み直してロックを離す。メモリは1バッチ分で済む。
+    """
+    if table not in EXPORT_COLUMNS:
+        raise ValueError(f"iter_export_rows: unsupported table {table!r}")
+    cond, params = (" AND category=?", [category]) if category else ("", [])
+    sql = (
+        f"SELECT rowid, {', '.join(EXPORT_COLUMNS[table])} FROM {table} "
+        f"WHERE rowid > ?{cond} ORDER BY rowid LIMIT ?"
+    )
+    conn = _get_conn()
+    after = 0
+    while True:
+        with _locked("iter_export_rows"):
+            rows = conn.execute(sql, (after, *params, int(batch_size))).fetchall()
+        if not rows:
+            return
+        after = rows[-1][0]
+        yield [tuple(r[1:]) for r in rows]
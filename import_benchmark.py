@@ -0,0 +1,122 @@
+"""
+モジュールごとの import 時間の計測（python -X importtime）
+
+各モジュールを新しいプロセスで import し、importtime の累積時間（us）を集計する。
+コールドスタートで重い依存（SDK など）が読み込まれていないかを確認する用途。
+
+    python import_benchmark.py
+    python import_benchmark.py --repeat 5 --top 5 ai_matching_gemini
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+# 計測対象（このリポジトリのモジュール）
+DEFAULT_MODULES = [
+    "questions_multi_category",
+    "ai_matching_gemini",
+    "llm_resilience",
+    "mock_llm",
+    "bitset_scoring",
+    "text_index",
+    "joint_matching",
+    "room_registry",
+    "outbound_queue",
+    "db_multi",
+    "bot_multi_gemini",
+]
+
+_script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+Row = Tuple[str, int, int, int]
+
+
+def parse_importtime(stderr: str) -> List[Row]:
+    """
+    -X importtime の出力を [(module, self_us, cumulative_us, depth), ...] に変換
+
+    行の形式: "import time:       123 |        456 |   package.module"
+    （モジュール名の字下げが入れ子の深さ。子は親より先に出力される）
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # 見出し行
+        name = parts[2].rstrip()
+        depth = len(name) - len(name.lstrip())
+        rows.append((name.strip(), int(parts[0]), int(parts[1]), depth))
+    return rows
+
+
+def measure(module: str) -> Tuple[Optional[int], List[Row], str]:
+    """
+    新しいプロセスで module を import する
+
+    Returns:
+        (module の累積us（失敗時 None）, 全行, エラーメッセージ)
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=_script_dir,
+        capture_output=True,
+        text=True,
+    )
+    rows = parse_importtime(proc.stderr)
+    if proc.returncode != 0:
+        last = [line for line in proc.stderr.splitlines() if line and not line.startswith("import time:")]
+        return None, rows, last[-1] if last else f"exit {proc.returncode}"
+    total = next((cum for name, _, cum, _ in rows if name == module), None)
+    return total, rows, ""
+
+
+def heaviest_dependencies(module: str, rows: List[Row], top: int) -> List[Tuple[str, int]]:
+    """module が読み込んだ依存のうち累積時間の大きいトップレベルパッケージ（起動時の import は除く）"""
+    end = next((i for i, row in enumerate(rows) if row[0] == module), None)
+    if end is None:
+        return []
+    depth = rows[end][3]
+    start = end
+    while start > 0 and rows[start - 1][3] > depth:
+        start -= 1
+    best: Dict[str, int] = {}
+    for name, _, cum, _ in rows[start:end]:
+        root = name.split(".")[0]
+        if root != module:
+            best[root] = max(best.get(root, 0), cum)
+    return sorted(best.items(), key=lambda x: -x[1])[:top]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="モジュールごとの import 時間を計測")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（中央値を表示）")
+    parser.add_argument("--top", type=int, default=3, help="表示する重い依存の数")
+    args = parser.parse_args(argv)
+
+    print(f"{'module':<26} {'median ms':>10} {'min ms':>8}  heaviest dependencies")
+    for module in args.modules:
+        totals = []
+        rows: List[Row] = []
+        error = ""
+        for _ in range(max(1, args.repeat)):
+            total, rows, error = measure(module)
+            if total is None:
+                break
+            totals.append(total)
+        if not totals:
+            print(f"{module:<26} {'error':>10} {'':>8}  {error}")
+            continue
+        deps = ", ".join(f"{name} {us / 1000:.0f}ms" for name, us in heaviest_dependencies(module, rows, args.top))
+        print(f"{module:<26} {statistics.median(totals) / 1000:>10.1f} {min(totals) / 1000:>8.1f}  {deps}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
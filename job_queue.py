@@ -0,0 +1,139 @@
+"""
+DB（jobs テーブル）に永続化するバックグラウンドジョブのワーカープール
+
+- ジョブは db_multi.enqueue_job で登録し、ワーカーがリース付きで取り出して実行する
+- 失敗したら指数バックオフで再実行し、max_attempts を超えたら dead（デッドレター）にする
+- プロセスが落ちて実行中のまま残ったジョブは、起動時の recover() かリース切れで再実行される
+ハンドラーは payload(dict) を受け取る async 関数で、kind ごとに register() で登録する。
+デッドレターにしたときの後始末（代わりの結果を保存するなど）は on_dead で登録する。
+"""
+import os
+import asyncio
+import traceback
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import db_multi
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "5"))
+# 1回の実行の上限（LLM のタイムアウト×リトライより長くする）
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "180"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.environ.get("JOB_RETRY_BASE_SECONDS", "10"))
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+# (payload, 最後の例外) を受け取る
+DeadLetterHandler = Callable[[Dict[str, Any], BaseException], Awaitable[None]]
+
+
+class JobQueue:
+    """jobs テーブルをポーリングして登録済みハンドラーを実行する"""
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        poll_seconds: float = JOB_POLL_SECONDS,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        retry_base_seconds: float = JOB_RETRY_BASE_SECONDS,
+    ):
+        self.workers = max(1, workers)
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self._handlers: Dict[str, JobHandler] = {}
+        self._dead_handlers: Dict[str, DeadLetterHandler] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: Dict[int, asyncio.Task] = {}
+        # enqueued / started / succeeded / retried / dead
+        self.counters: Counter = Counter()
+
+    def register(self, kind: str, handler: JobHandler, on_dead: Optional[DeadLetterHandler] = None) -> None:
+        self._handlers[kind] = handler
+        if on_dead is not None:
+            self._dead_handlers[kind] = on_dead
+
+    def start(self) -> None:
+        """ポーリングを開始（イベントループ上で呼ぶ・二重起動しない）"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._poll_loop())
+
+    async def recover(self) -> int:
+        """前回のプロセスで実行中のまま残ったジョブを待機中に戻す（起動時に1回）"""
+        n = await asyncio.to_thread(db_multi.requeue_running_jobs)
+        if n:
+            print(f"Requeued {n} interrupted job(s)")
+            self._wakeup.set()
+        return n
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None) -> int:
+        """ジョブを登録してワーカーを起こす"""
+        job_id = await asyncio.to_thread(
+            db_multi.enqueue_job, kind, payload, dedupe_key, self.max_attempts
+        )
+        self.counters["enqueued"] += 1
+        self._wakeup.set()
+        return job_id
+
+    async def _poll_loop(self) -> None:
+        while True:
+            free = self.workers - len(self._running)
+            if free > 0 and self._handlers:
+                try:
+                    jobs = await asyncio.to_thread(
+                        db_multi.claim_jobs, list(self._handlers), free, self.lease_seconds
+                    )
+                except Exception as e:
+                    print(f"claim_jobs failed: {e!r}")
+                    jobs = []
+                for job_id, kind, payload, attempts in jobs:
+                    task = asyncio.get_running_loop().create_task(self._run(job_id, kind, payload, attempts))
+                    self._running[job_id] = task
+                if jobs and len(jobs) == free:
+                    # 枠を使い切った: ワーカーが空くまで待つ
+                    await asyncio.wait(list(self._running.values()), return_when=asyncio.FIRST_COMPLETED)
+                    continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, job_id: int, kind: str, payload: Dict[str, Any], attempts: int) -> None:
+        self.counters["started"] += 1
+        try:
+            await asyncio.wait_for(self._handlers[kind](payload), self.lease_seconds)
+        except Exception as e:
+            delay = self.retry_base_seconds * (2 ** (attempts - 1))
+            error = f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=5)}"
+            try:
+                dead = await asyncio.to_thread(db_multi.fail_job, job_id, error, delay)
+            except Exception as db_error:
+                # 記録できなくてもリース切れで再実行される
+                print(f"fail_job failed for job {job_id}: {db_error!r}")
+                return
+            if dead:
+                self.counters["dead"] += 1
+                print(f"Job {job_id} ({kind}) moved to dead-letter after {attempts} attempt(s): {e!r}")
+                on_dead = self._dead_handlers.get(kind)
+                if on_dead is not None:
+                    try:
+                        await on_dead(payload, e)
+                    except Exception as dead_error:
+                        print(f"Dead-letter handler failed for job {job_id} ({kind}): {dead_error!r}")
+            else:
+                self.counters["retried"] += 1
+                print(f"Job {job_id} ({kind}) failed (attempt {attempts}), retrying in {delay:.0f}s: {e!r}")
+            return
+        else:
+            self.counters["succeeded"] += 1
+            try:
+                await asyncio.to_thread(db_multi.complete_job, job_id)
+            except Exception as e:
+                print(f"complete_job failed for job {job_id}: {e!r}")
+        finally:
+            self._running.pop(job_id, None)
+            self._wakeup.set()
@@ -0,0 +1,180 @@
+"""
+複数カテゴリーをまたいだ総合マッチング
+
+ユーザーごとに診断済みの全カテゴリーの回答を1クエリで読み込み、
+カテゴリー別のビットセット行列（bitset_scoring.BitsetMatrix）として保持する。
+「全カテゴリーで相性の良い人」は、カテゴリーごとの一対多スコアを
+ユーザー通し番号の配列に重み付きで足し込む1パスで求める。
+"""
+import heapq
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from bitset_scoring import BitsetMatrix, encode_answers, question_positions, similarity
+from questions_multi_category import CATEGORY_QUESTIONS
+
+# カテゴリー別の既定の重み（指定がないカテゴリーは 1.0）
+DEFAULT_CATEGORY_WEIGHTS: Dict[str, float] = {cat: 1.0 for cat in CATEGORY_QUESTIONS}
+
+
+class MultiCategoryFeatureStore:
+    """ユーザー×カテゴリーの回答ビットセットをまとめて保持する特徴量ストア"""
+
+    def __init__(self):
+        self._positions = {cat: question_positions(cat) for cat in CATEGORY_QUESTIONS}
+        self.matrices: Dict[str, BitsetMatrix] = {cat: BitsetMatrix() for cat in CATEGORY_QUESTIONS}
+        # 全カテゴリー共通のユーザー通し番号
+        self.user_ids: List[int] = []
+        self._user_index: Dict[int, int] = {}
+        # カテゴリー別に「行番号 → ユーザー通し番号」
+        self._row_to_user: Dict[str, List[int]] = {cat: [] for cat in CATEGORY_QUESTIONS}
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def _global_index(self, user_id: int) -> int:
+        idx = self._user_index.get(user_id)
+        if idx is None:
+            idx = len(self.user_ids)
+            self._user_index[user_id] = idx
+            self.user_ids.append(user_id)
+        return idx
+
+    def upsert(self, user_id: int, category: str, answers: Iterable[Tuple[int, str]]) -> None:
+        """1ユーザー・1カテゴリー分の回答を追加または更新"""
+        matrix = self.matrices.get(category)
+        if matrix is None:
+            return
+        g = self._global_index(user_id)
+        is_new = user_id not in matrix
+        matrix.upsert(user_id, encode_answers(answers, self._positions[category]))
+        if is_new:
+            self._row_to_user[category].append(g)
+
+    def categories_of(self, user_id: int) -> List[str]:
+        return [cat for cat, m in self.matrices.items() if user_id in m]
+
+    @classmethod
+    def load(
+        cls,
+        loader: Optional[Callable[[], List[Tuple[int, str, int, str]]]] = None,
+    ) -> "MultiCategoryFeatureStore":
+        """
+        DBから全カテゴリー分を1クエリで読み込んで構築
+
+        Args:
+            loader: [(user_id, category, question_id, answer), ...] を返す関数
+                    （省略時は db_multi.load_completed_answers_all_categories）
+        """
+        if loader is None:
+            from db_multi import load_completed_answers_all_categories
+            loader = load_completed_answers_all_categories
+        grouped: Dict[Tuple[int, str], List[Tuple[int, str]]] = defaultdict(list)
+        for user_id, category, qid, ans in loader():
+            grouped[(user_id, category)].append((qid, ans))
+        store = cls()
+        for (user_id, category), answers in grouped.items():
+            store.upsert(user_id, category, answers)
+        return store
+
+    def joint_scores(
+        self,
+        user_id: int,
+        weights: Optional[Dict[str, float]] = None,
+        categories: Optional[Iterable[str]] = None,
+    ) -> Tuple[List[float], List[int]]:
+        """
+        全ユーザーとの総合スコアを通し番号順の配列で返す
+
+        総合スコア = Σ(共通カテゴリーの重み × 類似度) / Σ(自分が対象とする全カテゴリーの重み)
+        相手が診断していないカテゴリーは 0 点扱いになるため、多くのカテゴリーで合う人ほど高くなる。
+
+        Returns:
+            (scores, shared_counts)  いずれも self.user_ids と同じ並び
+        """
+        weights = {**DEFAULT_CATEGORY_WEIGHTS, **(weights or {})}
+        mine = self.categories_of(user_id)
+        if categories is not None:
+            wanted = set(categories)
+            mine = [c for c in mine if c in wanted]
+        mine = [c for c in mine if weights.get(c, 0.0) > 0]
+
+        n = len(self.user_ids)
+        totals = [0.0] * n
+        shared = [0] * n
+        weight_sum = sum(weights[c] for c in mine)
+        if not mine or weight_sum <= 0:
+            return totals, shared
+
+        for cat in mine:
+            matrix = self.matrices[cat]
+            w = weights[cat] / weight_sum
+            rows = self._row_to_user[cat]
+            for g, score in zip(rows, matrix.score_one_vs_many(matrix.get(user_id))):
+                totals[g] += w * score
+                shared[g] += 1
+        return totals, shared
+
+    def top_k(
+        self,
+        user_id: int,
+        k: int = 10,
+        weights: Optional[Dict[str, float]] = None,
+        categories: Optional[Iterable[str]] = None,
+        min_shared: int = 1,
+        exclude: Optional[Iterable[int]] = None,
+    ) -> List[Tuple[int, float, Dict[str, float]]]:
+        """
+        総合スコア上位K人を返す
+
+        Returns:
+            [(candidate_user_id, joint_score, {category: similarity, ...}), ...]
+        """
+        totals, shared = self.joint_scores(user_id, weights, categories)
+        skip = set(exclude or ())
+        skip.add(user_id)
+        ids = self.user_ids
+        best = heapq.nlargest(
+            k,
+            (
+                (g, s) for g, s in enumerate(totals)
+                if shared[g] >= min_shared and ids[g] not in skip
+            ),
+            key=lambda x: x[1],
+        )
+        return [(ids[g], score, self.per_category(user_id, ids[g])) for g, score in best]
+
+    def per_category(self, user_id: int, other_id: int) -> Dict[str, float]:
+        """2人の共通カテゴリーごとの類似度（表示用）"""
+        result = {}
+        for cat, matrix in self.matrices.items():
+            a, b = matrix.get(user_id), matrix.get(other_id)
+            if a is not None and b is not None:
+                result[cat] = similarity(a, b)
+        return result
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    rng = random.Random(0)
+    rows = []
+    n_users = 20000
+    for uid in range(n_users):
+        for cat in rng.sample(list(CATEGORY_QUESTIONS), rng.randint(1, 4)):
+            for q in CATEGORY_QUESTIONS[cat]:
+                rows.append((uid, cat, q["id"], rng.choice("ABCDE")))
+
+    t0 = time.perf_counter()
+    store = MultiCategoryFeatureStore.load(lambda: rows)
+    load = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    queries = 20
+    for uid in range(queries):
+        result = store.top_k(uid, 10, weights={"friendship": 2.0, "gaming": 1.0})
+    per_query = (time.perf_counter() - t0) / queries
+    print(f"users={n_users} answer_rows={len(rows)} load={load:.2f}s top_k={per_query * 1000:.1f}ms/query")
+    for cand, score, cats in result[:3]:
+        print(cand, round(score, 3), {c: round(s, 3) for c, s in cats.items()})
@@ -0,0 +1,244 @@
+"""
+LLM呼び出しのサーキットブレーカー＋ヘッジリクエスト
+
+ResilientModel は generate_content() を持つ任意のモデル（Gemini / 擬似モデル）を包み、
+- 連続失敗・タイムアウトが閾値を超えたら回路を開き、以降は即座に CircuitOpenError を返す
+  （AIMatchingEngine はこれを受けて _basic_profile_analysis / _basic_compatibility を即返す）
+- 一定時間後に半開状態にして1件だけ試行し、成功すれば閉じる
+- 直近の p95 レイテンシを超えても応答がなければ同じリクエストを1本だけ重複送信する（任意）
+状態は snapshot() でメトリクスとして取得できる。
+"""
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Optional
+
+
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", "20"))
+LLM_CB_FAILURE_THRESHOLD = int(os.environ.get("LLM_CB_FAILURE_THRESHOLD", "5"))
+LLM_CB_RESET_SECONDS = float(os.environ.get("LLM_CB_RESET_SECONDS", "30"))
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "0") == "1"
+# 0 なら直近の p95 を使う
+LLM_HEDGE_AFTER_SECONDS = float(os.environ.get("LLM_HEDGE_AFTER_SECONDS", "0"))
+LLM_HEDGE_MAX_RATIO = float(os.environ.get("LLM_HEDGE_MAX_RATIO", "0.1"))
+LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", "16"))
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """回路が開いているため呼び出しを行わなかった"""
+    code = 503
+
+
+class LLMTimeoutError(TimeoutError):
+    """LLM呼び出しがタイムアウトした"""
+
+
+# =========================================================
+# サーキットブレーカー
+# =========================================================
+class CircuitBreaker:
+    """連続失敗回数ベースのサーキットブレーカー（スレッドセーフ）"""
+
+    def __init__(
+        self,
+        failure_threshold: int = LLM_CB_FAILURE_THRESHOLD,
+        reset_timeout: float = LLM_CB_RESET_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opened_total = 0
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        """呼び出してよいか（半開状態では1件だけ試行を許可）"""
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN:
+                if self._clock() - self.opened_at < self.reset_timeout:
+                    return False
+                self._transition(STATE_HALF_OPEN)
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+            if self.state != STATE_CLOSED:
+                self._transition(STATE_CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == STATE_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != STATE_OPEN:
+                    self.opened_total += 1
+                self.opened_at = self._clock()
+                self._transition(STATE_OPEN)
+
+    def _transition(self, state: str) -> None:
+        if state != self.state:
+            print(f"LLM circuit breaker: {self.state} -> {state}")
+            self.state = state
+
+
+# =========================================================
+# レイテンシ統計
+# =========================================================
+class LatencyWindow:
+    """直近N件の成功レイテンシからパーセンタイルを求める"""
+
+    def __init__(self, size: int = 200):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._values.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            if not self._values:
+                return None
+            ordered = sorted(self._values)
+        k = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[k]
+
+
+# =========================================================
+# ラッパー本体
+# =========================================================
+class ResilientModel:
+    """
+    generate_content() 互換のラッパー
+
+    実際の呼び出しは専用スレッドプールで行い、呼び出し元は timeout 秒で見切る。
+    見切った呼び出しのスレッドはSDK側が返るまで残るため、プールサイズで上限をかけている。
+    """
+
+    def __init__(
+        self,
+        inner: Any,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge: bool = LLM_HEDGE,
+        hedge_after: float = LLM_HEDGE_AFTER_SECONDS,
+        hedge_max_ratio: float = LLM_HEDGE_MAX_RATIO,
+        hedge_min_samples: int = 20,
+        pool_size: int = LLM_POOL_SIZE,
+    ):
+        self.inner = inner
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.hedge_max_ratio = hedge_max_ratio
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyWindow()
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {
+            "requests": 0,
+            "successes": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "short_circuited": 0,
+            "hedges_sent": 0,
+            "hedges_won": 0,
+        }
+
+    def _inc(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    def _hedge_delay(self) -> Optional[float]:
+        """ヘッジを送るまでの待ち時間（送らない場合は None）"""
+        if not self.hedge:
+            return None
+        with self._lock:
+            budget = self.hedge_max_ratio * self.counters["requests"]
+            if self.counters["hedges_sent"] >= budget:
+                return None
+        if self.hedge_after > 0:
+            return self.hedge_after
+        if len(self.latency) < self.hedge_min_samples:
+            return None
+        return self.latency.percentile(95)
+
+    def generate_content(self, prompt: str, generation_config: Optional[Dict] = None):
+        if not self.breaker.allow_request():
+            self._inc("short_circuited")
+            raise CircuitOpenError("LLM circuit is open")
+
+        self._inc("requests")
+        started = time.monotonic()
+        deadline = started + self.timeout
+        call = lambda: self.inner.generate_content(prompt, generation_config=generation_config)
+        primary = self._executor.submit(call)
+        pending = {primary}
+        errors = []
+
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None and hedge_delay < self.timeout:
+            done, pending = wait(pending, timeout=hedge_delay)
+            if not done:
+                self._inc("hedges_sent")
+                pending.add(self._executor.submit(call))
+            else:
+                pending = done
+
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if f is not primary:
+                        self._inc("hedges_won")
+                    self.latency.add(time.monotonic() - started)
+                    self._inc("successes")
+                    self.breaker.record_success()
+                    return f.result()
+                errors.append(f.exception())
+            if not done:
+                break
+
+        self.breaker.record_failure()
+        if errors and not pending:
+            self._inc("failures")
+            raise errors[0]
+        self._inc("timeouts")
+        raise LLMTimeoutError(f"LLM call exceeded {self.timeout:.1f}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """メトリクス用の状態スナップショット"""
+        with self._lock:
+            data: Dict[str, Any] = dict(self.counters)
+        data.update({
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "opened_total": self.breaker.opened_total,
+            "latency_p50_seconds": self.latency.percentile(50),
+            "latency_p95_seconds": self.latency.percentile(95),
+        })
+        return data
@@ -0,0 +1,454 @@
+"""
+Discord なしで診断フロー全体を負荷試験する（疑似 Interaction / Channel / Message）
+
+- 仮想ユーザーごとに /start 相当の初回表示 → 回答ボタン（on_answer_interaction）× 全問
+  → プロフィール分析ジョブの完了待ち → /profile → /match → 結果のページ送りを実行する
+- DB はローカルの SQLite ファイル（db_multi.use_local_db）、LLM は mock_llm の擬似モデル
+- Discord API の応答時間は LatencyModel（mock_llm）で与える
+- ステップ別のスループット・p50/p95/p99、回答処理の段階別時間、DB ロック待ちを表示
+
+    python loadtest.py --users 2000 --concurrency 500 --llm-latency lognormal:0.8,0.4
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import tempfile
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+import discord
+
+import db_multi
+import metrics
+from mock_llm import LatencyModel, MockGenerativeModel
+
+STEPS = ("start", "answer", "answer_last", "completion", "profile", "match", "match_page")
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+# =========================================================
+# 疑似 Discord オブジェクト
+# =========================================================
+class FakeDiscord:
+    """疑似 Discord API（呼び出しごとに応答時間を付け、回数を数える）"""
+
+    def __init__(self, latency: LatencyModel, seed: int = 0):
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.calls: Counter = Counter()
+        self._ids = itertools.count(10 ** 17)
+        self.channels: Dict[int, "FakeChannel"] = {}
+
+    def new_id(self) -> int:
+        return next(self._ids)
+
+    async def call(self, route: str) -> None:
+        self.calls[route] += 1
+        delay = self.latency.sample(self.rng)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def get_channel(self, channel_id: int) -> Optional["FakeChannel"]:
+        return self.channels.get(channel_id)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{user_id}>"
+
+
+class FakeMessage:
+    def __init__(self, api: FakeDiscord, channel: "FakeChannel", content=None, embed=None, embeds=None, view=None):
+        self.api = api
+        self.id = api.new_id()
+        self.channel = channel
+        self.content = content
+        self.embed = embed if embed is not None else (embeds[0] if embeds else None)
+        self.view = view
+
+    def apply(self, **kwargs) -> None:
+        if "content" in kwargs:
+            self.content = kwargs["content"]
+        if "embed" in kwargs:
+            self.embed = kwargs["embed"]
+        if "view" in kwargs:
+            self.view = kwargs["view"]
+
+    async def edit(self, **kwargs) -> "FakeMessage":
+        await self.api.call("message.edit")
+        self.apply(**kwargs)
+        return self
+
+
+class FakeChannel:
+    def __init__(self, api: FakeDiscord, name: str):
+        self.api = api
+        self.id = api.new_id()
+        self.name = name
+        self.mention = f"<#{self.id}>"
+        self.messages: Dict[int, FakeMessage] = {}
+        self.last_message: Optional[FakeMessage] = None
+        api.channels[self.id] = self
+
+    async def send(self, content=None, **kwargs) -> FakeMessage:
+        await self.api.call("channel.send")
+        msg = FakeMessage(self.api, self, content, kwargs.get("embed"), kwargs.get("embeds"), kwargs.get("view"))
+        self.messages[msg.id] = msg
+        self.last_message = msg
+        return msg
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await self.api.call("channel.fetch_message")
+        return self.messages[message_id]
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, ephemeral: bool = False, thinking: bool = False) -> None:
+        await self._interaction.api.call("interaction.defer")
+        self._done = True
+
+    async def send_message(self, content=None, **kwargs) -> None:
+        await self._interaction.api.call("interaction.send_message")
+        self._done = True
+        self._interaction.sent.append((content, kwargs))
+
+    async def edit_message(self, **kwargs) -> None:
+        await self._interaction.api.call("interaction.edit_message")
+        self._done = True
+        if self._interaction.message is not None:
+            self._interaction.message.apply(**kwargs)
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs) -> None:
+        await self._interaction.api.call("followup.send")
+        self._interaction.sent.append((content, kwargs))
+
+
+class FakeInteraction:
+    """ボタン押下（custom_id あり）またはスラッシュコマンドの Interaction"""
+
+    def __init__(
+        self,
+        api: FakeDiscord,
+        user: FakeUser,
+        channel: FakeChannel,
+        message: Optional[FakeMessage] = None,
+        custom_id: Optional[str] = None,
+    ):
+        self.api = api
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild = None
+        self.message = message
+        if custom_id is not None:
+            self.type = discord.InteractionType.component
+            self.data = {"custom_id": custom_id}
+        else:
+            self.type = discord.InteractionType.application_command
+            self.data = {}
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.sent: List[Any] = []
+
+    async def edit_original_response(self, **kwargs) -> Optional[FakeMessage]:
+        await self.api.call("interaction.edit_original_response")
+        if self.message is not None:
+            self.message.apply(**kwargs)
+        return self.message
+
+
+# =========================================================
+# 負荷試験
+# =========================================================
+class LoadTest:
+    def __init__(self, app, api: FakeDiscord, args: argparse.Namespace):
+        self.app = app
+        self.api = api
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.think = LatencyModel.parse(args.think)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.completed_users = 0
+        self._profiles: Dict[tuple, asyncio.Future] = {}
+
+    async def profile_job(self, payload: Dict) -> None:
+        """プロフィール分析ジョブ（完了を待っている仮想ユーザーに通知する）"""
+        await self.app.run_profile_analysis(payload)
+        self._profile_done(payload)
+
+    async def profile_dead(self, payload: Dict, error: BaseException) -> None:
+        """デッドレターになったら Bot と同じく簡易分析を保存して通知する"""
+        await self.app.save_basic_profile(payload, error)
+        self._profile_done(payload)
+
+    def _profile_done(self, payload: Dict) -> None:
+        future = self._profiles.pop((int(payload["user_id"]), payload["category"]), None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def _step(self, step: str, coro) -> bool:
+        t0 = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            self.errors[f"{step}: {type(e).__name__}"] += 1
+            return False
+        self.latencies[step].append(time.perf_counter() - t0)
+        return True
+
+    async def _think(self) -> None:
+        delay = self.think.sample(self.rng)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def virtual_user(self, i: int) -> None:
+        app = self.app
+        categories = [self.args.category] if self.args.category else list(app.CATEGORY_QUESTIONS)
+        category = categories[i % len(categories)]
+        discord_id = 10 ** 15 + i
+        user = FakeUser(discord_id, f"load{i}")
+        channel = FakeChannel(self.api, f"diagnosis-load{i}")
+
+        user_id = await asyncio.to_thread(db_multi.get_or_create_user, str(discord_id), user.name)
+        if not await self._step("start", app.start_category_diagnosis(channel, discord_id, user_id, category)):
+            return
+
+        total = len(app.CATEGORY_QUESTIONS[category])
+        loop = asyncio.get_running_loop()
+        completion = loop.create_future()
+        self._profiles[(user_id, category)] = completion
+        for idx in range(total):
+            await self._think()
+            key = self.rng.choice(sorted(app.ANSWER_KEYS))
+            interaction = FakeInteraction(
+                self.api, user, channel,
+                message=channel.last_message,
+                custom_id=app.answer_custom_id(discord_id, user_id, category, idx, key),
+            )
+            step = "answer_last" if idx == total - 1 else "answer"
+            if not await self._step(step, app.on_answer_interaction(interaction)):
+                self._profiles.pop((user_id, category), None)
+                return
+
+        # 最後の回答からプロフィールが表示されるまで
+        clicked = time.perf_counter()
+        try:
+            done_at = await asyncio.wait_for(completion, self.args.completion_timeout)
+        except asyncio.TimeoutError:
+            self._profiles.pop((user_id, category), None)
+            self.errors["completion: timeout"] += 1
+            return
+        self.latencies["completion"].append(done_at - clicked)
+
+        await self._think()
+        if not await self._step("profile", app.profile.callback(FakeInteraction(self.api, user, channel), category)):
+            return
+        await self._think()
+        interaction = FakeInteraction(self.api, user, channel)
+        if not await self._step("match", app.match.callback(interaction, category)):
+            return
+        # 結果のページ送り（キャッシュ済みのランキングを切り出すだけ）
+        view = next((kw["view"] for _, kw in interaction.sent if kw.get("view") is not None), None)
+        if view is not None and not view.next_button.disabled:
+            await self._think()
+            if not await self._step("match_page", view.next_button.callback(FakeInteraction(self.api, user, channel))):
+                return
+        self.completed_users += 1
+
+    async def run(self) -> Dict[str, Any]:
+        sem = asyncio.Semaphore(self.args.concurrency)
+
+        async def limited(i: int):
+            async with sem:
+                await self.virtual_user(i)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(i) for i in range(self.args.users)))
+        self.elapsed = time.perf_counter() - started
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        steps = {}
+        for step in STEPS:
+            values = self.latencies.get(step, [])
+            steps[step] = {
+                "count": len(values),
+                "per_second": round(len(values) / self.elapsed, 1) if self.elapsed else 0.0,
+                "p50_ms": round(_percentile(values, 50) * 1000, 1),
+                "p95_ms": round(_percentile(values, 95) * 1000, 1),
+                "p99_ms": round(_percentile(values, 99) * 1000, 1),
+                "max_ms": round(max(values) * 1000, 1) if values else 0.0,
+            }
+
+        # DB: 関数別のロック待ち・実行時間（metrics のヒストグラムから）
+        wait = {key[0]: v for key, v in db_multi.DB_LOCK_WAIT_SECONDS.totals().items()}
+        execute = {key[0]: v for key, v in db_multi.DB_EXECUTE_SECONDS.totals().items()}
+        db = {}
+        for function in sorted(wait, key=lambda f: -wait[f][1]):
+            calls, wait_sum = wait[function]
+            _, exec_sum = execute.get(function, (0, 0.0))
+            db[function] = {
+                "calls": calls,
+                "lock_wait_total_s": round(wait_sum, 3),
+                "lock_wait_avg_ms": round(wait_sum / calls * 1000, 2) if calls else 0.0,
+                "execute_avg_ms": round(exec_sum / calls * 1000, 2) if calls else 0.0,
+            }
+        total_wait = sum(v[1] for v in wait.values())
+        total_exec = sum(v[1] for v in execute.values())
+
+        phases = {
+            key[0]: round(total_s / n * 1000, 2)
+            for key, (n, total_s) in self.app.ANSWER_PHASE_SECONDS.totals().items() if n
+        }
+        answers = len(self.latencies.get("answer", [])) + len(self.latencies.get("answer_last", []))
+        model = self.app.matching_engine.model
+        inner = getattr(model, "inner", model)
+        return {
+            "users": self.args.users,
+            "concurrency": self.args.concurrency,
+            "completed_users": self.completed_users,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "answers_per_second": round(answers / self.elapsed, 1) if self.elapsed else 0.0,
+            "steps": steps,
+            "answer_phase_avg_ms": phases,
+            "db": db,
+            "db_lock_wait_share": round(total_wait / (total_wait + total_exec), 3) if total_wait + total_exec else 0.0,
+            "event_loop_lag_max_ms": round(metrics.EVENT_LOOP_LAG_MAX.value() * 1000, 1),
+            "discord_calls": dict(self.api.calls),
+            "llm_outcomes": inner.stats() if hasattr(inner, "stats") else {},
+            "jobs": dict(self.app.job_queue.counters),
+            "errors": dict(self.errors),
+        }
+
+
+def format_report(result: Dict[str, Any]) -> str:
+    lines = [
+        f"users={result['users']} concurrency={result['concurrency']} "
+        f"completed={result['completed_users']} elapsed={result['elapsed_seconds']}s "
+        f"answers/s={result['answers_per_second']} loop lag max={result['event_loop_lag_max_ms']}ms",
+        "",
+        f"  {'step':<12} {'count':>7} {'/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}",
+    ]
+    for step, s in result["steps"].items():
+        lines.append(
+            f"  {step:<12} {s['count']:>7} {s['per_second']:>8} {s['p50_ms']:>9} "
+            f"{s['p95_ms']:>9} {s['p99_ms']:>9} {s['max_ms']:>9}"
+        )
+    lines.append("")
+    lines.append("  answer phases (avg ms): " + ", ".join(
+        f"{phase}={ms}" for phase, ms in sorted(result["answer_phase_avg_ms"].items(), key=lambda x: -x[1])
+    ))
+    lines.append("")
+    lines.append(f"  DB lock wait share: {result['db_lock_wait_share'] * 100:.1f}% of time spent in db_multi")
+    lines.append(f"  {'function':<32} {'calls':>7} {'wait s':>8} {'wait ms':>8} {'exec ms':>8}")
+    for function, d in list(result["db"].items())[:12]:
+        lines.append(
+            f"  {function:<32} {d['calls']:>7} {d['lock_wait_total_s']:>8} "
+            f"{d['lock_wait_avg_ms']:>8} {d['execute_avg_ms']:>8}"
+        )
+    lines.append("")
+    lines.append(f"  discord calls: {result['discord_calls']}")
+    lines.append(f"  llm outcomes: {result['llm_outcomes']}  jobs: {result['jobs']}")
+    if result["errors"]:
+        lines.append(f"  errors: {result['errors']}")
+    return "\n".join(lines)
+
+
+async def run_loadtest(args: argparse.Namespace) -> Dict[str, Any]:
+    db_multi.use_local_db(args.db)
+    await asyncio.to_thread(db_multi.init_db)
+
+    # Bot モジュールは DB の切り替え後に読み込む（ログインはしない）
+    import bot_multi_gemini as app
+    from ai_matching_gemini import LLM_CIRCUIT_BREAKER
+
+    api = FakeDiscord(LatencyModel.parse(args.discord_latency), args.seed)
+    app.bot.get_channel = api.get_channel
+
+    model = MockGenerativeModel(
+        latency=LatencyModel.parse(args.llm_latency),
+        error_rate=args.llm_error_rate,
+        rate_limit_rate=args.llm_rate_limit_rate,
+        seed=args.seed,
+    )
+    if LLM_CIRCUIT_BREAKER:
+        from llm_resilience import ResilientModel
+        app.matching_engine.model = ResilientModel(model)
+    else:
+        app.matching_engine.model = model
+
+    test = LoadTest(app, api, args)
+    app.job_queue.workers = max(1, args.job_workers)
+    app.job_queue.register(app.PROFILE_ANALYSIS_JOB, test.profile_job, on_dead=test.profile_dead)
+    app.job_queue.start()
+    lag_task = asyncio.get_running_loop().create_task(metrics.monitor_event_loop_lag(0.1))
+    try:
+        return await test.run()
+    finally:
+        lag_task.cancel()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="疑似 Discord で診断フロー全体を負荷試験")
+    parser.add_argument("--users", type=int, default=200, help="仮想ユーザー数")
+    parser.add_argument("--concurrency", type=int, default=100, help="同時に動かす仮想ユーザー数")
+    parser.add_argument("--category", help="カテゴリーを固定（省略時は4カテゴリーに振り分け）")
+    parser.add_argument("--think", default="fixed:0", help="操作の間隔（例: uniform:0.5,2）")
+    parser.add_argument("--discord-latency", default="lognormal:0.05,0.3", help="Discord API の応答時間")
+    parser.add_argument("--llm-latency", default="lognormal:0.8,0.4", help="擬似LLMの応答時間")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--job-workers", type=int, default=int(os.environ.get("JOB_WORKERS", "4")))
+    parser.add_argument("--completion-timeout", type=float, default=600.0, help="分析完了待ちの上限（秒）")
+    parser.add_argument("--db", help="ローカルDBファイル（省略時は一時ファイルを作って最後に消す）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    args = parser.parse_args(argv)
+
+    temp_db = args.db is None
+    if temp_db:
+        fd, args.db = tempfile.mkstemp(prefix="loadtest_", suffix=".db")
+        os.close(fd)
+    try:
+        result = asyncio.run(run_loadtest(args))
+    finally:
+        if temp_db:
+            for suffix in ("", "-journal", "-wal", "-shm"):
+                try:
+                    os.remove(args.db + suffix)
+                except OSError:
+                    pass
+    print(json.dumps(result, ensure_ascii=False, indent=2) if args.json else format_report(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,533 @@
+"""
+/match の候補ランキングとユーザー別の結果キャッシュ
+
+- カテゴリーごとに、プロフィール作成済みユーザーの回答ビットセット（候補プール）をメモリに保持する
+  （初回利用時にDBから構築し、以後はプロフィール保存のたびに upsert で増分更新）
+- ランキングは回答類似度の一対多スコアで上位 MATCH_RESULT_SIZE 人に絞り、
+  その人数分だけキーワード類似度（text_index）をブレンドして並べ替える
+- 結果は (user_id, category) ごとに TTL 付きでキャッシュし、ページ送りはキャッシュした
+  並びを切り出すだけ（スコアは再計算しない）
+- キャッシュは期限切れのほか、本人の回答が変わったとき・候補プールが
+  MATCH_POOL_CHANGE_RATIO 以上入れ替わったときに捨てる
+- 既にマッチ（申請）がある相手は MatchExclusions（ユーザー別のソート済み配列）で除外する
+- 過去にマッチした・表示した相手は seen（seen_filter.SeenFilter）で上位候補だけ判定して除外する
+
+    python match_search.py --users 50000   # 合成データで p50/p95 を計測
+"""
+import os
+import sys
+import time
+import heapq
+import bisect
+import threading
+from array import array
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Callable, Collection, Container, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from bitset_scoring import AnswerBits, BitsetMatrix, encode_answers, question_positions
+from questions_multi_category import CATEGORY_QUESTIONS
+from text_index import ProfileTextIndex, blend_scores
+
+# 1ページの表示人数・キャッシュする上位人数
+MATCH_PAGE_SIZE = int(os.environ.get("MATCH_PAGE_SIZE", "5"))
+MATCH_RESULT_SIZE = int(os.environ.get("MATCH_RESULT_SIZE", "100"))
+MATCH_CACHE_TTL_SECONDS = float(os.environ.get("MATCH_CACHE_TTL_SECONDS", "600"))
+MATCH_CACHE_SIZE = int(os.environ.get("MATCH_CACHE_SIZE", "2048"))
+# 結果の作成後に候補プールの何割が追加・更新されたら作り直すか（小さいプールでは1件でも作り直す）
+MATCH_POOL_CHANGE_RATIO = float(os.environ.get("MATCH_POOL_CHANGE_RATIO", "0.05"))
+# 除外リストを保持するユーザー×カテゴリー数（LRU）
+MATCH_EXCLUSION_CACHE_SIZE = int(os.environ.get("MATCH_EXCLUSION_CACHE_SIZE", "10000"))
+# 候補から外す相手のマッチのステータス（期限切れ 'expired' になった申請の相手は再び候補に出る）
+EXCLUDED_MATCH_STATUSES = ("pending", "accepted", "rejected")
+
+
+@dataclass(frozen=True)
+class Candidate:
+    user_id: int
+    score: float
+    answer_score: float
+    text_score: float
+
+
+@dataclass
+class MatchResult:
+    """1ユーザー・1カテゴリー分のランキング（ページ送りはこれを切り出すだけ）"""
+    user_id: int
+    category: str
+    candidates: List[Candidate]
+    created_at: float
+    pool_generation: int
+    user_generation: int
+    pool_size: int
+    elapsed: float = 0.0
+
+    def page_count(self, page_size: int = MATCH_PAGE_SIZE) -> int:
+        return max(1, -(-len(self.candidates) // page_size))
+
+    def page(self, page: int, page_size: int = MATCH_PAGE_SIZE) -> List[Candidate]:
+        start = page * page_size
+        return self.candidates[start:start + page_size]
+
+    def rank_of(self, user_id: int) -> Optional[int]:
+        """候補の順位（1始まり）"""
+        for i, c in enumerate(self.candidates):
+            if c.user_id == user_id:
+                return i + 1
+        return None
+
+
+class CandidatePool:
+    """1カテゴリー分の候補（スレッドセーフ）"""
+
+    def __init__(self, category: str):
+        self.category = category
+        self.positions = question_positions(category)
+        self.matrix = BitsetMatrix()
+        # 追加・更新のたびに進む世代番号と、ユーザーごとの最終更新世代
+        self.generation = 0
+        self._user_generation: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.matrix)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.matrix
+
+    def upsert(self, user_id: int, answers: Iterable[Tuple[int, str]]) -> None:
+        bits = encode_answers(answers, self.positions)
+        with self._lock:
+            self.generation += 1
+            self.matrix.upsert(user_id, bits)
+            self._user_generation[user_id] = self.generation
+
+    def bulk_load(self, rows: Iterable[Tuple[int, Sequence[Tuple[int, str]]]]) -> None:
+        """[(user_id, answers), ...] をまとめて追加（構築時用、世代は進めない）"""
+        with self._lock:
+            for user_id, answers in rows:
+                self.matrix.upsert(user_id, encode_answers(answers, self.positions))
+
+    def user_generation(self, user_id: int) -> int:
+        return self._user_generation.get(user_id, 0)
+
+    def get(self, user_id: int) -> Optional[AnswerBits]:
+        with self._lock:
+            return self.matrix.get(user_id)
+
+    def top(
+        self,
+        query: AnswerBits,
+        k: int,
+        exclude: Collection[int] = (),
+        self_id: Optional[int] = None,
+        seen: Optional[Container[int]] = None,
+    ) -> Tuple[List[Tuple[int, float]], int]:
+        """
+        回答類似度の上位 k 人（self_id と exclude・seen に含まれるユーザーを除く）
+
+        seen（確率的な既読フィルター）は全件には当てず、上位から多めに取った分だけ判定する。
+        足りなければ取る人数を増やしてやり直す。
+
+        Returns:
+            ([(user_id, score), ...], 計算時点の世代)
+        """
+        n_skip = len(exclude) + 1
+        with self._lock:
+            scores = self.matrix.score_one_vs_many(query)
+            ids = self.matrix.user_ids
+            generation = self.generation
+
+            def ranked(m: int) -> List[Tuple[int, float]]:
+                if n_skip <= k:
+                    # 除外が少なければ、多めに取ってから落とす方が全件の判定より速い
+                    best = heapq.nlargest(m + n_skip, zip(ids, scores), key=lambda x: x[1])
+                    return [x for x in best if x[0] != self_id and x[0] not in exclude]
+                return heapq.nlargest(
+                    m,
+                    (x for x in zip(ids, scores) if x[0] != self_id and x[0] not in exclude),
+                    key=lambda x: x[1],
+                )
+
+            if seen is None:
+                return ranked(k)[:k], generation
+            m = 2 * k
+            while True:
+                best = ranked(m)
+                exhausted = len(best) < m
+                best = [x for x in best if x[0] not in seen]
+                if len(best) >= k or exhausted:
+                    break
+                m *= 4
+        return best[:k], generation
+
+
+class ExclusionSet:
+    """ソート済みの user_id 配列（1件8バイト、判定は二分探索）"""
+    __slots__ = ("_ids",)
+
+    def __init__(self, user_ids: Iterable[int] = ()):
+        self._ids = array("q", sorted(set(user_ids)))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._ids)
+
+    def __contains__(self, user_id: int) -> bool:
+        ids = self._ids
+        i = bisect.bisect_left(ids, user_id)
+        return i < len(ids) and ids[i] == user_id
+
+    def add(self, user_id: int) -> None:
+        i = bisect.bisect_left(self._ids, user_id)
+        if i == len(self._ids) or self._ids[i] != user_id:
+            self._ids.insert(i, user_id)
+
+
+class MatchExclusions:
+    """
+    (user_id, category) → 候補から外す相手（EXCLUDED_MATCH_STATUSES のマッチがある相手）の LRU キャッシュ
+
+    初回はDBから読み、以後はマッチ作成時に add で両者の分を更新する（期限切れは discard で読み直し）。
+    """
+
+    def __init__(
+        self,
+        loader: Optional[Callable[[int, str], Iterable[int]]] = None,
+        size: int = MATCH_EXCLUSION_CACHE_SIZE,
+    ):
+        """
+        Args:
+            loader: (user_id, category) -> 相手の user_id 一覧
+                    （省略時は db_multi.get_match_partner_ids を EXCLUDED_MATCH_STATUSES で呼ぶ）
+        """
+        self._loader = loader
+        self.size = size
+        self._sets: "OrderedDict[Tuple[int, str], ExclusionSet]" = OrderedDict()
+        self._lock = threading.Lock()
+        # hits / loads / evicted / added / discarded（期限切れで読み直しにしたユーザー数）
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def _load(self, user_id: int, category: str) -> Iterable[int]:
+        if self._loader is not None:
+            return self._loader(user_id, category)
+        from db_multi import get_match_partner_ids
+        return get_match_partner_ids(user_id, category, EXCLUDED_MATCH_STATUSES)
+
+    def get(self, user_id: int, category: str) -> ExclusionSet:
+        """除外する相手（未読み込みならDBから読む。同期I/Oのため to_thread から呼ぶ）"""
+        key = (user_id, category)
+        with self._lock:
+            excluded = self._sets.get(key)
+            if excluded is not None:
+                self._sets.move_to_end(key)
+                self.counters["hits"] += 1
+                return excluded
+        excluded = ExclusionSet(self._load(user_id, category))
+        with self._lock:
+            # 別スレッドが先に読み込んでいたらそちらを使う
+            current = self._sets.setdefault(key, excluded)
+            self._sets.move_to_end(key)
+            self.counters["loads"] += 1
+            while len(self._sets) > self.size:
+                self._sets.popitem(last=False)
+                self.counters["evicted"] += 1
+            return current
+
+    def add(self, user_a: int, user_b: int, category: str) -> None:
+        """マッチ作成時（読み込み済みのユーザーだけ更新）"""
+        with self._lock:
+            for me, other in ((user_a, user_b), (user_b, user_a)):
+                excluded = self._sets.get((me, category))
+                if excluded is not None:
+                    excluded.add(other)
+            self.counters["added"] += 1
+
+    def discard(self, user_a: int, user_b: int, category: str) -> None:
+        """
+        マッチの期限切れ時
+
+        同じ相手と別のマッチが残っていることがあるため、相手を外すのではなく
+        読み込み済みの2人分を捨てて次回DBから読み直す。
+        """
+        with self._lock:
+            for key in ((user_a, category), (user_b, category)):
+                if self._sets.pop(key, None) is not None:
+                    self.counters["discarded"] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        snap = dict(self.counters)
+        with self._lock:
+            snap["cached_users"] = len(self._sets)
+            snap["entries"] = sum(len(x) for x in self._sets.values())
+        return snap
+
+
+class MatchSearch:
+    """カテゴリー別の候補プールと結果キャッシュ"""
+
+    def __init__(
+        self,
+        answer_loader: Optional[Callable[[str], List[Tuple[int, int, str]]]] = None,
+        text_index: Optional[ProfileTextIndex] = None,
+        result_size: int = MATCH_RESULT_SIZE,
+        ttl: float = MATCH_CACHE_TTL_SECONDS,
+        cache_size: int = MATCH_CACHE_SIZE,
+        change_ratio: float = MATCH_POOL_CHANGE_RATIO,
+    ):
+        """
+        Args:
+            answer_loader: category -> [(user_id, question_id, answer), ...]（省略時は db_multi.load_category_answers）
+            text_index: キーワード類似度のインデックス（省略時は回答類似度だけで並べる）
+        """
+        self._loader = answer_loader
+        self.text_index = text_index
+        self.result_size = result_size
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.change_ratio = change_ratio
+        self._pools: Dict[str, CandidatePool] = {}
+        self._pools_lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[int, str], MatchResult]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # hits / misses / expired / stale_user / stale_pool / evicted
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    # ---------------------------------------------------------
+    # 候補プール
+    # ---------------------------------------------------------
+    def is_built(self, category: str) -> bool:
+        return category in self._pools
+
+    def pool(self, category: str) -> CandidatePool:
+        """カテゴリーの候補プール（未構築ならDBから構築。同期I/Oのため to_thread から呼ぶ）"""
+        pool = self._pools.get(category)
+        if pool is not None:
+            return pool
+        with self._pools_lock:
+            pool = self._pools.get(category)
+            if pool is None:
+                pool = self._build(category)
+                self._pools[category] = pool
+        return pool
+
+    def _build(self, category: str) -> CandidatePool:
+        loader = self._loader
+        if loader is None:
+            from db_multi import load_category_answers
+            loader = load_category_answers
+        grouped: Dict[int, List[Tuple[int, str]]] = defaultdict(list)
+        for user_id, qid, ans in loader(category):
+            grouped[user_id].append((qid, ans))
+        pool = CandidatePool(category)
+        pool.bulk_load(grouped.items())
+        return pool
+
+    def warm_up(self, categories: Optional[Iterable[str]] = None) -> None:
+        """候補プールとキーワード索引を先に構築しておく（起動時に to_thread で呼ぶ）"""
+        for category in categories or CATEGORY_QUESTIONS:
+            self.pool(category)
+            if self.text_index is not None:
+                self.text_index.get(category)
+
+    def upsert(self, category: str, user_id: int, answers: Iterable[Tuple[int, str]]) -> None:
+        """
+        プロフィール保存時の増分更新（未構築のカテゴリーは次回 pool() 時にDBから読まれる）
+
+        本人のキャッシュ済み結果は捨てる。他のユーザーの結果は MATCH_POOL_CHANGE_RATIO に従って捨てられる。
+        """
+        pool = self._pools.get(category)
+        if pool is not None:
+            pool.upsert(user_id, answers)
+        self.invalidate(user_id, category)
+
+    # ---------------------------------------------------------
+    # 結果キャッシュ
+    # ---------------------------------------------------------
+    def invalidate(self, user_id: int, category: Optional[str] = None) -> None:
+        with self._cache_lock:
+            if category is not None:
+                self._cache.pop((user_id, category), None)
+            else:
+                for key in [k for k in self._cache if k[0] == user_id]:
+                    del self._cache[key]
+
+    def _is_fresh(self, result: MatchResult, now: float) -> Optional[str]:
+        """キャッシュが使えなければその理由（counters のキー）"""
+        if now - result.created_at >= self.ttl:
+            return "expired"
+        pool = self._pools.get(result.category)
+        if pool is None:
+            return None
+        if pool.user_generation(result.user_id) != result.user_generation:
+            return "stale_user"
+        changed = pool.generation - result.pool_generation
+        if changed and changed >= max(1.0, self.change_ratio * result.pool_size):
+            return "stale_pool"
+        return None
+
+    def cached(self, user_id: int, category: str) -> Optional[MatchResult]:
+        """使えるキャッシュ済みの結果（なければ None）"""
+        key = (user_id, category)
+        with self._cache_lock:
+            result = self._cache.get(key)
+            if result is None:
+                self.counters["misses"] += 1
+                return None
+            reason = self._is_fresh(result, time.monotonic())
+            if reason:
+                del self._cache[key]
+                self.counters[reason] += 1
+                self.counters["misses"] += 1
+                return None
+            self._cache.move_to_end(key)
+            self.counters["hits"] += 1
+            return result
+
+    def _store(self, result: MatchResult) -> None:
+        key = (result.user_id, result.category)
+        with self._cache_lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.counters["evicted"] += 1
+
+    # ---------------------------------------------------------
+    # ランキング
+    # ---------------------------------------------------------
+    def rank(
+        self,
+        user_id: int,
+        category: str,
+        answers: Optional[Sequence[Tuple[int, str]]] = None,
+        exclude: Collection[int] = (),
+        seen: Optional[Container[int]] = None,
+    ) -> MatchResult:
+        """
+        候補をランキングしてキャッシュに入れる（同期・CPU処理のため to_thread から呼ぶ）
+
+        Args:
+            answers: 本人の回答（候補プールにまだいない場合に使う）
+            exclude: 候補から外すユーザー（既にマッチ済みの相手など）
+            seen: 候補から外す既に見たユーザー（偽陽性があってよい集合、上位候補にだけ当てる）
+        """
+        started = time.perf_counter()
+        pool = self.pool(category)
+        query = pool.get(user_id)
+        if query is None:
+            query = encode_answers(answers or (), pool.positions)
+        best, generation = pool.top(query, self.result_size, exclude, self_id=user_id, seen=seen)
+
+        text_scores: Dict[int, float] = {}
+        if self.text_index is not None and best:
+            text_scores = self.text_index.get(category).similarities(user_id, [uid for uid, _ in best])
+        if text_scores:
+            candidates = [
+                Candidate(uid, blend_scores(score, text_scores.get(uid, 0.0)), score, text_scores.get(uid, 0.0))
+                for uid, score in best
+            ]
+            candidates.sort(key=lambda c: -c.score)
+        else:
+            candidates = [Candidate(uid, score, score, 0.0) for uid, score in best]
+
+        result = MatchResult(
+            user_id=user_id,
+            category=category,
+            candidates=candidates,
+            created_at=time.monotonic(),
+            pool_generation=generation,
+            user_generation=pool.user_generation(user_id),
+            pool_size=len(pool),
+            elapsed=time.perf_counter() - started,
+        )
+        self._store(result)
+        return result
+
+    def search(
+        self,
+        user_id: int,
+        category: str,
+        answers: Optional[Sequence[Tuple[int, str]]] = None,
+        exclude: Collection[int] = (),
+        seen: Optional[Container[int]] = None,
+    ) -> MatchResult:
+        """キャッシュがあればそれを、なければランキングして返す"""
+        return self.cached(user_id, category) or self.rank(user_id, category, answers, exclude, seen)
+
+    def snapshot(self) -> Dict[str, int]:
+        """メトリクス用のカウンターとサイズ"""
+        snap = dict(self.counters)
+        snap["cached_results"] = len(self._cache)
+        snap["pool_users"] = sum(len(p) for p in list(self._pools.values()))
+        return snap
+
+
+# =========================================================
+# 計測（python match_search.py）
+# =========================================================
+def main(argv: Optional[List[str]] = None) -> int:
+    import json
+    import random
+    import argparse
+    from synth_population import PopulationConfig, generate
+    from text_index import TextIndex
+
+    parser = argparse.ArgumentParser(description="/match ランキングのレイテンシ計測（合成データ、DB不要）")
+    parser.add_argument("--users", type=int, default=50000, help="カテゴリー内のユーザー数")
+    parser.add_argument("--category", default="gaming")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    rows = generate(PopulationConfig(
+        users=args.users, seed=args.seed, categories=(args.category,), categories_per_user=(1.0,),
+        completion_rate=1.0, profile_rate=1.0, matches_per_user=0.0,
+    ))
+    by_user: Dict[int, List[Tuple[int, str]]] = defaultdict(list)
+    for user_id, _, qid, ans in rows["answers"]:
+        by_user[user_id].append((qid, ans))
+    answer_rows = [(uid, qid, ans) for uid, answers in by_user.items() for qid, ans in answers]
+    profile_texts = {uid: (bio, json.loads(kws)) for uid, _, bio, kws, _ in rows["user_profiles"]}
+    generated = time.perf_counter() - t0
+
+    text_index = ProfileTextIndex(
+        lambda category: [(uid, bio, kws) for uid, (bio, kws) in profile_texts.items()]
+    )
+    search = MatchSearch(lambda category: answer_rows, text_index)
+    t0 = time.perf_counter()
+    search.warm_up([args.category])
+    warm = time.perf_counter() - t0
+    assert isinstance(text_index.get(args.category), TextIndex)
+
+    rng = random.Random(args.seed)
+    user_ids = list(by_user)
+    cold, hot = [], []
+    for _ in range(args.queries):
+        uid = rng.choice(user_ids)
+        t0 = time.perf_counter()
+        result = search.search(uid, args.category)
+        cold.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        for page in range(result.page_count()):
+            search.search(uid, args.category).page(page)
+        hot.append((time.perf_counter() - t0) / result.page_count())
+
+    def pct(values: List[float], p: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    print(f"users={len(user_ids)} generate={generated:.2f}s warm_up={warm:.2f}s")
+    print(f"rank (cache miss): p50={pct(cold, 50):.1f}ms p95={pct(cold, 95):.1f}ms p99={pct(cold, 99):.1f}ms")
+    print(f"page (cache hit):  p50={pct(hot, 50):.3f}ms p95={pct(hot, 95):.3f}ms")
+    print(dict(search.snapshot()))
+    top = result.candidates[:3]
+    print("top:", [(c.user_id, round(c.score, 3), round(c.answer_score, 3), round(c.text_score, 3)) for c in top])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+"""
+標準ライブラリだけで書いた Prometheus 形式のメトリクス
+
+- Counter / Gauge / Histogram（ラベル付き、スレッドセーフ）
+- render() で text exposition format（0.0.4）を出力
+- start_http_server(port) で /metrics を別スレッドの HTTP サーバーから公開
+- timed() は計測用のコンテキストマネージャー兼デコレーター（同期・非同期どちらも可）
+- monitor_event_loop_lag() はイベントループの遅延を測るタスク
+"""
+import os
+import time
+import math
+import asyncio
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 0 で HTTP エンドポイントを起動しない
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# 既定のバケット（秒）: DB の数ms〜LLM の数十秒まで
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """単調増加するカウンター"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """任意の値を取るゲージ"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """累積バケット付きヒストグラム"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベル値 → [バケット別件数..., +Inf件数, 合計]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            else:
+                data[len(self.buckets)] += 1
+            data[-1] += value
+
+    def count(self, **labels) -> int:
+        data = self._values.get(self._key(labels))
+        return int(sum(data[:-1])) if data else 0
+
+    def totals(self) -> Dict[LabelValues, Tuple[int, float]]:
+        """ラベル値ごとの (件数, 合計)"""
+        with self._lock:
+            return {key: (int(sum(data[:-1])), data[-1]) for key, data in self._values.items()}
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, data in items:
+            cumulative = 0.0
+            for bound, n in zip(self.buckets + (math.inf,), data[:-1]):
+                cumulative += n
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(data[-1])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(cumulative)}"
+
+
+# =========================================================
+# レジストリ
+# =========================================================
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs):
+        # 同名の二重登録（モジュールの再読み込みなど）は既存のものを返す
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"metric {name} already registered with a different type or labels")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def add_collector(self, collect: Callable[[], None]) -> None:
+        """render() の直前に呼ばれる関数を登録（スナップショットからゲージを更新する用途）"""
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in list(self._collectors):
+            try:
+                collect()
+            except Exception as e:
+                print(f"metrics collector failed: {e!r}")
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+add_collector = REGISTRY.add_collector
+render = REGISTRY.render
+
+
+# =========================================================
+# 計測ヘルパー
+# =========================================================
+class timed:
+    """
+    経過時間を Histogram に記録する
+
+        with timed(DB_SECONDS, function="get_state"): ...
+
+        @timed(COMMAND_SECONDS, command="match")
+        async def match(...): ...
+
+    ヒストグラムに outcome ラベルがあれば ok / error を自動で付ける。
+    """
+
+    def __init__(self, hist: Histogram, **labels):
+        self.hist = hist
+        self.labels = labels
+        self._with_outcome = "outcome" in hist.labelnames and "outcome" not in labels
+        self._started: List[float] = []
+
+    def _observe(self, started: float, ok: bool) -> None:
+        labels = dict(self.labels)
+        if self._with_outcome:
+            labels["outcome"] = "ok" if ok else "error"
+        self.hist.observe(time.perf_counter() - started, **labels)
+
+    def __enter__(self):
+        self._started.append(time.perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._observe(self._started.pop(), exc_type is None)
+        return False
+
+    def __call__(self, func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                ok = False
+                try:
+                    result = await func(*args, **kwargs)
+                    ok = True
+                    return result
+                finally:
+                    self._observe(started, ok)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            ok = False
+            try:
+                result = func(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                self._observe(started, ok)
+        return wrapper
+
+
+EVENT_LOOP_LAG = histogram(
+    "event_loop_lag_seconds",
+    "Delay between the scheduled and actual wake-up of the lag probe",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+EVENT_LOOP_LAG_MAX = gauge("event_loop_lag_max_seconds", "Largest event loop lag since the last scrape")
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    """interval 秒ごとに起きて、予定より遅れた時間をイベントループの遅延として記録"""
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - scheduled)
+        EVENT_LOOP_LAG.observe(lag)
+        if lag > EVENT_LOOP_LAG_MAX.value():
+            EVENT_LOOP_LAG_MAX.set(lag)
+
+
+# =========================================================
+# HTTP エンドポイント
+# =========================================================
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        # 最大値は取得のたびにリセット
+        EVENT_LOOP_LAG_MAX.set(0)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """/metrics をデーモンスレッドで公開（port が 0 以下なら何もしない）"""
+    if port <= 0:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Metrics endpoint: http://{host}:{port}/metrics")
+    return server
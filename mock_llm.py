@@ -0,0 +1,359 @@
+"""
+ネットワーク不要のローカル擬似LLMバックエンド（負荷・レイテンシ試験用）
+
+AIMatchingEngine に `model=MockGenerativeModel(...)` として渡すか、
+環境変数 AI_BACKEND=mock を設定すると Gemini の代わりに使われる。
+プロフィール分析・相性分析・アイスブレイクの各プロンプトに対して
+スキーマどおりの JSON / テキストを返し、レイテンシ・エラー・429・壊れた出力を
+設定した確率で発生させる。
+"""
+import os
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+
+# プロンプト種別の判定用マーカー（ai_matching_gemini のプロンプト文言に対応）
+KIND_PROFILE = "profile"
+KIND_COMPATIBILITY = "compatibility"
+KIND_ICEBREAKER = "icebreaker"
+
+_KIND_MARKERS = [
+    (KIND_ICEBREAKER, "アイスブレイクメッセージ"),
+    (KIND_COMPATIBILITY, "相性を分析してください"),
+    (KIND_PROFILE, "詳細なプロフィールを作成"),
+]
+
+_BASIC_SCORE_RE = re.compile(r"【基本相性スコア】(\d+)%")
+_CATEGORY_RE = re.compile(r"あなたは(\w+)マッチング")
+
+_TRAIT_POOL = [
+    "社交的", "聞き上手", "計画的", "好奇心旺盛", "マイペース", "慎重派",
+    "行動派", "協調性が高い", "論理的", "感受性が豊か", "負けず嫌い", "穏やか",
+]
+_KEYWORD_POOL = [
+    "ゲーム", "アニメ", "音楽", "読書", "旅行", "カフェ", "映画", "スポーツ",
+    "プログラミング", "料理", "写真", "FPS", "RPG", "起業", "デザイン", "語学",
+]
+_PRIORITY_POOL = ["価値観の一致", "コミュニケーション", "共通の趣味", "信頼関係", "成長", "安心感"]
+
+
+class MockRateLimitError(Exception):
+    """429 Too Many Requests を模した例外"""
+    code = 429
+
+
+class MockBackendError(Exception):
+    """500系のサーバーエラーを模した例外"""
+    code = 500
+
+
+# =========================================================
+# レイテンシ分布
+# =========================================================
+@dataclass(frozen=True)
+class LatencyModel:
+    """
+    擬似レイテンシの分布（秒）
+
+    kind:
+        fixed     : a 秒固定
+        uniform   : a〜b 秒の一様分布
+        normal    : 平均 a, 標準偏差 b
+        lognormal : 中央値 a, 対数標準偏差 b（LLMの裾の重いレイテンシに近い）
+    """
+    kind: str = "fixed"
+    a: float = 0.0
+    b: float = 0.0
+    maximum: float = 60.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        """`lognormal:0.8,0.5` 形式の文字列から生成"""
+        spec = (spec or "").strip()
+        if not spec:
+            return cls()
+        kind, _, params = spec.partition(":")
+        values = [float(v) for v in params.split(",") if v.strip()]
+        a = values[0] if len(values) > 0 else 0.0
+        b = values[1] if len(values) > 1 else 0.0
+        kind = kind.strip().lower()
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"unknown latency distribution: {kind}")
+        return cls(kind=kind, a=a, b=b)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            value = rng.uniform(self.a, self.b)
+        elif self.kind == "normal":
+            value = rng.gauss(self.a, self.b)
+        elif self.kind == "lognormal":
+            value = rng.lognormvariate(math.log(max(self.a, 1e-6)), self.b)
+        else:
+            value = self.a
+        return max(0.0, min(self.maximum, value))
+
+
+# =========================================================
+# 応答オブジェクト（google.generativeai の応答に合わせた最小限の形）
+# =========================================================
+@dataclass
+class MockUsageMetadata:
+    prompt_token_count: int
+    candidates_token_count: int
+    total_token_count: int
+
+
+@dataclass
+class MockResponse:
+    text: str
+    usage_metadata: MockUsageMetadata
+
+
+def _estimate_tokens(text: str) -> int:
+    """日本語混じりテキストのおおよそのトークン数"""
+    return max(1, len(text) // 2)
+
+
+# =========================================================
+# 擬似モデル
+# =========================================================
+class MockGenerativeModel:
+    """
+    genai.GenerativeModel 互換の擬似モデル
+
+    generate_content() は同期関数（実物と同じく asyncio.to_thread から呼ばれる前提）。
+    乱数はシード・プロンプト・同一プロンプトの呼び出し回数から決まるため、
+    並行実行時のスレッドの順序に関係なく結果が再現する。
+    """
+
+    def __init__(
+        self,
+        latency: Optional[LatencyModel] = None,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        fence_rate: float = 0.3,
+        seed: int = 0,
+        sleep=time.sleep,
+    ):
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.fence_rate = fence_rate
+        self.seed = seed
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._prompt_calls: Counter = Counter()
+        self.outcomes: Counter = Counter()
+
+    @classmethod
+    def from_env(cls) -> "MockGenerativeModel":
+        """MOCK_LLM_* 環境変数から生成"""
+        return cls(
+            latency=LatencyModel.parse(os.environ.get("MOCK_LLM_LATENCY", "lognormal:0.8,0.4")),
+            error_rate=float(os.environ.get("MOCK_LLM_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.environ.get("MOCK_LLM_RATE_LIMIT_RATE", "0")),
+            malformed_rate=float(os.environ.get("MOCK_LLM_MALFORMED_RATE", "0")),
+            seed=int(os.environ.get("MOCK_LLM_SEED", "0")),
+        )
+
+    def _rng_for(self, prompt: str) -> random.Random:
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            n = self._prompt_calls[digest]
+            self._prompt_calls[digest] += 1
+        return random.Random(f"{self.seed}:{digest}:{n}")
+
+    def _record(self, outcome: str) -> None:
+        with self._lock:
+            self.outcomes[outcome] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """結果種別ごとの呼び出し回数"""
+        with self._lock:
+            return dict(self.outcomes)
+
+    def generate_content(self, prompt: str, generation_config: Optional[Dict] = None) -> MockResponse:
+        rng = self._rng_for(prompt)
+        self._sleep(self.latency.sample(rng))
+
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            self._record("rate_limited")
+            raise MockRateLimitError("429 Resource has been exhausted (mock)")
+        if roll < self.rate_limit_rate + self.error_rate:
+            self._record("error")
+            raise MockBackendError("500 Internal error (mock)")
+
+        kind = detect_prompt_kind(prompt)
+        if kind == KIND_PROFILE:
+            text = json.dumps(_mock_profile(rng), ensure_ascii=False)
+        elif kind == KIND_COMPATIBILITY:
+            text = json.dumps(_mock_compatibility(rng, prompt), ensure_ascii=False)
+        else:
+            text = _mock_icebreaker(rng, prompt)
+
+        if kind != KIND_ICEBREAKER:
+            if rng.random() < self.malformed_rate:
+                # max_output_tokens 到達で途中切れになったJSONを模す
+                text = text[: max(1, len(text) // 2)]
+                self._record("malformed")
+            else:
+                self._record("ok")
+            if rng.random() < self.fence_rate:
+                text = f"```json\n{text}\n```"
+        else:
+            self._record("ok")
+
+        prompt_tokens = _estimate_tokens(prompt)
+        output_tokens = _estimate_tokens(text)
+        return MockResponse(
+            text=text,
+            usage_metadata=MockUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens,
+            ),
+        )
+
+
+def detect_prompt_kind(prompt: str) -> str:
+    """プロンプト文言から要求種別を判定"""
+    for kind, marker in _KIND_MARKERS:
+        if marker in prompt:
+            return kind
+    return KIND_ICEBREAKER
+
+
+def _mock_profile(rng: random.Random) -> Dict:
+    traits = rng.sample(_TRAIT_POOL, 5)
+    return {
+        "personality_summary": f"{traits[0]}で{traits[1]}なタイプです。（擬似分析）",
+        "key_traits": [{"trait": t, "comment": f"{t}な一面が回答から読み取れます。"} for t in traits],
+        "communication_style": rng.choice(["テキスト中心", "通話好き", "バランス型"]),
+        "preferences": {
+            "ideal_match": f"{rng.choice(_TRAIT_POOL)}な相手",
+            "priorities": rng.sample(_PRIORITY_POOL, 3),
+        },
+        "compatibility_factors": rng.sample(_PRIORITY_POOL, 3),
+        "match_keywords": rng.sample(_KEYWORD_POOL, 5),
+    }
+
+
+def _mock_compatibility(rng: random.Random, prompt: str) -> Dict:
+    m = _BASIC_SCORE_RE.search(prompt)
+    basic = int(m.group(1)) / 100 if m else 0.5
+    score = max(0.0, min(1.0, basic + rng.uniform(-0.1, 0.1)))
+    return {
+        "overall_score": round(score, 2),
+        "analysis_summary": f"回答の傾向から相性は{score:.0%}程度と見込まれます。（擬似分析）",
+        "strengths": rng.sample(_PRIORITY_POOL, 3),
+        "potential_challenges": rng.sample(_PRIORITY_POOL, 2),
+        "conversation_starters": [f"{k}について話してみましょう" for k in rng.sample(_KEYWORD_POOL, 3)],
+        "recommendation": "high" if score > 0.7 else ("medium" if score > 0.5 else "low"),
+    }
+
+
+def _mock_icebreaker(rng: random.Random, prompt: str) -> str:
+    m = _CATEGORY_RE.search(prompt)
+    category = m.group(1) if m else "matching"
+    topic = rng.choice(_KEYWORD_POOL)
+    return f"🎉 マッチおめでとうございます！（{category}）まずは{topic}の話から始めてみませんか？😊"
+
+
+# =========================================================
+# ベンチマーク（python mock_llm.py）
+# =========================================================
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+async def benchmark_engine(
+    n_users: int = 200,
+    concurrency: int = 50,
+    model: Optional[MockGenerativeModel] = None,
+) -> Dict:
+    """擬似モデルでプロフィール分析→相性分析→アイスブレイクの流れを計測"""
+    from ai_matching_gemini import AIMatchingEngine
+
+    model = model or MockGenerativeModel.from_env()
+    engine = AIMatchingEngine(model=model)
+    rng = random.Random(model.seed)
+    letters = "ABCDE"
+    qids = list(range(101, 131))
+    question_data = {qid: f"質問{qid}" for qid in qids}
+    sem = asyncio.Semaphore(concurrency)
+    latencies: Dict[str, List[float]] = {"profile": [], "compatibility": [], "icebreaker": []}
+
+    async def one_user(i: int):
+        a1 = [(qid, rng.choice(letters)) for qid in qids]
+        a2 = [(qid, rng.choice(letters)) for qid in qids]
+        async with sem:
+            t0 = time.perf_counter()
+            p1 = await engine.analyze_profile("friendship", a1, question_data)
+            latencies["profile"].append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            comp = await engine.calculate_compatibility("friendship", p1, p1, a1, a2)
+            latencies["compatibility"].append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            await engine.generate_icebreaker("friendship", f"user{i}", "partner", comp)
+            latencies["icebreaker"].append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_user(i) for i in range(n_users)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "users": n_users,
+        "elapsed_seconds": round(elapsed, 3),
+        "latency": {
+            step: {
+                "p50": round(_percentile(v, 50), 3),
+                "p95": round(_percentile(v, 95), 3),
+                "p99": round(_percentile(v, 99), 3),
+            }
+            for step, v in latencies.items()
+        },
+        "model_outcomes": model.stats(),
+        "fallbacks": dict(engine.fallback_counts),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="擬似LLMでマッチングエンジンをベンチマーク")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", default="lognormal:0.2,0.4")
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.05)
+    parser.add_argument("--malformed-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mock = MockGenerativeModel(
+        latency=LatencyModel.parse(args.latency),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+    )
+    result = asyncio.run(benchmark_engine(args.users, args.concurrency, mock))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
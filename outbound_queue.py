@@ -0,0 +1,329 @@
+"""
+Discord への送信系操作（チャンネル作成・メッセージ投稿）の送信キュー
+
+- ルートごとのトークンバケットで送信ペースを抑え、Discord 側のレート制限に当たる前に待つ
+- 優先度付き: インタラクション起点の操作 > ルーム内の案内 > ウェルカム投稿
+- ウェルカム投稿は一定時間ぶんをまとめて1通のメンション付きメッセージにする
+- キューが一杯のときは低優先度の操作から捨て、件数を snapshot() で取得できる
+discord.py には依存しない（操作は「コルーチンを返す関数」で受け取る）。
+"""
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+OUTBOUND_MAX_QUEUE = int(os.environ.get("OUTBOUND_MAX_QUEUE", "500"))
+OUTBOUND_CONCURRENCY = int(os.environ.get("OUTBOUND_CONCURRENCY", "4"))
+OUTBOUND_MAX_RETRIES = int(os.environ.get("OUTBOUND_MAX_RETRIES", "2"))
+# チャンネルへの投稿: 1秒あたりの送信数 / バースト
+OUTBOUND_CHANNEL_RATE = float(os.environ.get("OUTBOUND_CHANNEL_RATE", "1.0"))
+OUTBOUND_CHANNEL_BURST = int(os.environ.get("OUTBOUND_CHANNEL_BURST", "5"))
+# ギルド単位の操作（チャンネル作成など）
+OUTBOUND_GUILD_RATE = float(os.environ.get("OUTBOUND_GUILD_RATE", "0.5"))
+OUTBOUND_GUILD_BURST = int(os.environ.get("OUTBOUND_GUILD_BURST", "3"))
+# ウェルカム投稿をまとめる時間（秒）と1通あたりの最大メンション数
+WELCOME_COALESCE_SECONDS = float(os.environ.get("WELCOME_COALESCE_SECONDS", "3"))
+WELCOME_MAX_MENTIONS = int(os.environ.get("WELCOME_MAX_MENTIONS", "20"))
+
+PRIORITY_INTERACTION = 0
+PRIORITY_ROOM = 1
+PRIORITY_WELCOME = 2
+
+
+class TokenBucket:
+    """rate 件/秒、最大 burst 件のトークンバケット"""
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = max(rate, 1e-6)
+        self.burst = max(1, burst)
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self) -> float:
+        """次の1件を送れるまでの秒数（0なら今すぐ送れる）"""
+        now = self._clock()
+        self._refill(now)
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        self._tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        """429 を受けたルートを一定時間止める"""
+        self._tokens = 0.0
+        self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+
+def route_limits(route: str) -> Tuple[float, int]:
+    """ルート名（"channel:<id>" / "guild:<id>:..."）から (rate, burst) を決める"""
+    if route.startswith("guild:"):
+        return OUTBOUND_GUILD_RATE, OUTBOUND_GUILD_BURST
+    return OUTBOUND_CHANNEL_RATE, OUTBOUND_CHANNEL_BURST
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    route: str = field(compare=False)
+    action: Callable[[], Awaitable[Any]] = field(compare=False)
+    future: Optional[asyncio.Future] = field(compare=False, default=None)
+    enqueued_at: float = field(compare=False, default=0.0)
+    attempts: int = field(compare=False, default=0)
+
+
+class OutboundQueue:
+    """優先度付き・ルート別レート制御の送信キュー"""
+
+    def __init__(
+        self,
+        max_queue: int = OUTBOUND_MAX_QUEUE,
+        concurrency: int = OUTBOUND_CONCURRENCY,
+        max_retries: int = OUTBOUND_MAX_RETRIES,
+        limits: Callable[[str], Tuple[float, int]] = route_limits,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self._limits = limits
+        self._clock = clock
+        self._heap: List[_Job] = []
+        self._seq = itertools.count()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._task: Optional[asyncio.Task] = None
+        self._pending_batches: Dict[Any, List[Any]] = {}
+        # submitted / sent / failed / dropped / retried / rate_limited / coalesced
+        self.counters: Counter = Counter()
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def start(self) -> None:
+        """ディスパッチャーを起動（イベントループ上で呼ぶ・二重起動しない）"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._dispatch_loop())
+
+    def _bucket(self, route: str) -> TokenBucket:
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            rate, burst = self._limits(route)
+            bucket = self._buckets[route] = TokenBucket(rate, burst, self._clock)
+        return bucket
+
+    def _push(self, job: _Job) -> None:
+        heapq.heappush(self._heap, job)
+        self._wakeup.set()
+
+    def _make_room(self, priority: int) -> bool:
+        """満杯なら priority より低い最後尾の1件を捨てて空ける"""
+        if len(self._heap) < self.max_queue:
+            return True
+        victim = max(self._heap)
+        if victim.priority <= priority:
+            return False
+        self._heap.remove(victim)
+        heapq.heapify(self._heap)
+        self.counters["dropped"] += 1
+        if victim.future is not None and not victim.future.done():
+            victim.future.cancel()
+        return True
+
+    def submit(
+        self,
+        route: str,
+        action: Callable[[], Awaitable[Any]],
+        priority: int = PRIORITY_ROOM,
+    ) -> Optional[asyncio.Future]:
+        """
+        操作をキューに積む
+
+        Returns:
+            結果を受け取る Future（キューが一杯で捨てた場合は None）
+        """
+        if not self._make_room(priority):
+            self.counters["dropped"] += 1
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self.counters["submitted"] += 1
+        self._push(_Job(priority, next(self._seq), route, action, future, self._clock()))
+        return future
+
+    async def run(
+        self,
+        route: str,
+        action: Callable[[], Awaitable[Any]],
+        priority: int = PRIORITY_INTERACTION,
+    ) -> Any:
+        """操作をキューに積み、実行結果（または例外）を待つ"""
+        future = self.submit(route, action, priority)
+        if future is None:
+            raise asyncio.QueueFull(f"outbound queue is full ({route})")
+        return await future
+
+    def coalesce(
+        self,
+        key: Any,
+        item: Any,
+        route: str,
+        build: Callable[[List[Any]], Awaitable[Any]],
+        priority: int = PRIORITY_WELCOME,
+        window: float = WELCOME_COALESCE_SECONDS,
+        max_items: int = WELCOME_MAX_MENTIONS,
+    ) -> None:
+        """
+        key ごとに window 秒ぶんの item をまとめ、build(items) を1回の操作として積む
+
+        max_items に達したらその場で積む。
+        """
+        batch = self._pending_batches.get(key)
+        if batch is None:
+            batch = self._pending_batches[key] = []
+            asyncio.get_running_loop().call_later(
+                window, self._flush_batch, key, batch, route, build, priority
+            )
+        else:
+            self.counters["coalesced"] += 1
+        batch.append(item)
+        if len(batch) >= max_items:
+            self._flush_batch(key, batch, route, build, priority)
+
+    def _flush_batch(self, key, batch, route, build, priority) -> None:
+        # タイマーより先に max_items で積まれた場合は別バッチになっている
+        if self._pending_batches.get(key) is batch:
+            del self._pending_batches[key]
+        elif not batch:
+            return
+        items = list(batch)
+        batch.clear()
+        if items:
+            self.submit(route, lambda: build(items), priority)
+
+    def _next_ready(self) -> Tuple[Optional[_Job], float]:
+        """送れる状態の最優先ジョブを取り出す（なければ最短の待ち時間）"""
+        deferred = []
+        job = None
+        min_wait = float("inf")
+        while self._heap:
+            candidate = heapq.heappop(self._heap)
+            wait = self._bucket(candidate.route).wait_time()
+            if wait <= 0:
+                job = candidate
+                break
+            min_wait = min(min_wait, wait)
+            deferred.append(candidate)
+        for d in deferred:
+            heapq.heappush(self._heap, d)
+        return job, min_wait
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            job, wait = self._next_ready()
+            if job is None:
+                self._wakeup.clear()
+                timeout = None if wait == float("inf") else wait
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if job.future is not None and job.future.done():
+                continue
+            self._bucket(job.route).take()
+            await self._slots.acquire()
+            asyncio.get_running_loop().create_task(self._execute(job))
+
+    async def _execute(self, job: _Job) -> None:
+        try:
+            waited = self._clock() - job.enqueued_at
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            job.attempts += 1
+            try:
+                result = await job.action()
+            except Exception as e:
+                if getattr(e, "status", None) == 429 and job.attempts <= self.max_retries:
+                    self.counters["rate_limited"] += 1
+                    self.counters["retried"] += 1
+                    self._bucket(job.route).block(float(getattr(e, "retry_after", 1.0) or 1.0))
+                    self._push(job)
+                    return
+                self.counters["failed"] += 1
+                if job.future is not None and not job.future.done():
+                    job.future.set_exception(e)
+                else:
+                    print(f"outbound action failed ({job.route}): {e!r}")
+                return
+            self.counters["sent"] += 1
+            if job.future is not None and not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """メトリクス用のスナップショット（待ち件数・待ち時間など）"""
+        depth = Counter(job.priority for job in self._heap)
+        done = self.counters["sent"] + self.counters["failed"]
+        counters = {
+            name: self.counters[name]
+            for name in ("submitted", "sent", "failed", "dropped", "retried", "rate_limited", "coalesced")
+        }
+        return {
+            **counters,
+            "queued": len(self._heap),
+            "queued_interaction": depth[PRIORITY_INTERACTION],
+            "queued_room": depth[PRIORITY_ROOM],
+            "queued_welcome": depth[PRIORITY_WELCOME],
+            "pending_batches": len(self._pending_batches),
+            "queue_wait_avg_seconds": self._wait_total / done if done else 0.0,
+            "queue_wait_max_seconds": self._wait_max,
+        }
+
+
+if __name__ == "__main__":
+    # 動作確認: 同一チャンネルへの大量投稿と、割り込むインタラクション応答
+    async def _demo():
+        queue = OutboundQueue()
+        queue.start()
+        started = time.monotonic()
+        log = []
+
+        def post(label):
+            async def action():
+                log.append((round(time.monotonic() - started, 2), label))
+            return action
+
+        async def send_welcome(mentions):
+            log.append((round(time.monotonic() - started, 2), f"welcome x{len(mentions)}"))
+
+        for i in range(50):
+            queue.coalesce("welcome", f"<@{i}>", "channel:1", send_welcome, window=0.2)
+        for i in range(8):
+            queue.submit("channel:1", post(f"room #{i}"), PRIORITY_ROOM)
+        await asyncio.sleep(0.3)
+        await queue.run("channel:1", post("interaction"))
+        while len(queue):
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(0.1)
+        for entry in log:
+            print(entry)
+        print(queue.snapshot())
+
+    asyncio.run(_demo())
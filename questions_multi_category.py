@@ -1,5 +1,6 @@
 # questions_multi_category.py
 # 複数カテゴリー（友達/恋愛/ゲーム/ビジネス）に対応した質問セット
+from types import MappingProxyType
 
 # 5段階選択肢
 CHOICES_5 = [
@@ -244,3 +245,109 @@ for questions in CATEGORY_QUESTIONS.values():
         if qid in ALL_QUESTION_IDS:
             raise ValueError(f"Duplicate question ID: {qid}")
         ALL_QUESTION_IDS.add(qid)
+
+# =========================================================
+# 質問カタログ（インポート時に構築・以降は変更しない）
+# =========================================================
+# カテゴリーの並び順
+CATEGORY_ORDER = tuple(CATEGORY_QUESTIONS)
+
+# カテゴリー → 質問IDのタプル（定義順）
+CATEGORY_QUESTION_IDS = MappingProxyType({
+    cat: tuple(q["id"] for q in questions)
+    for cat, questions in CATEGORY_QUESTIONS.items()
+})
+
+# カテゴリー → 質問数
+CATEGORY_QUESTION_COUNT = MappingProxyType({
+    cat: len(ids) for cat, ids in CATEGORY_QUESTION_IDS.items()
+})
+
+# 質問ID → 質問
+QUESTION_BY_ID = MappingProxyType({
+    q["id"]: q for questions in CATEGORY_QUESTIONS.values() for q in questions
+})
+
+# 質問ID → カテゴリー
+QUESTION_CATEGORY = MappingProxyType({
+    qid: cat for cat, ids in CATEGORY_QUESTION_IDS.items() for qid in ids
+})
+
+# 質問ID → カテゴリー内での位置（定義順、0始まり）
+QUESTION_POSITION = MappingProxyType({
+    qid: i for ids in CATEGORY_QUESTION_IDS.values() for i, qid in enumerate(ids)
+})
+
+# カテゴリー → {質問ID: 位置}
+CATEGORY_QUESTION_POSITIONS = MappingProxyType({
+    cat: MappingProxyType({qid: i for i, qid in enumerate(ids)})
+    for cat, ids in CATEGORY_QUESTION_IDS.items()
+})
+
+
+# =========================================================
+# 質問メッセージの事前レンダリング
+# =========================================================
+QUESTION_EMBED_FOOTER = "★が多いほど強い傾向です"
+
+
+def progress_bar(current: int, total: int, width: int = 12) -> str:
+    if total <= 0:
+        return ""
+    filled = int(round((current / total) * width))
+    filled = max(0, min(width, filled))
+    return "■" * filled + "□" * (width - filled)
+
+
+# 回答ボタンのラベル [(key, "A: ★☆☆☆☆"), ...]
+ANSWER_BUTTON_LABELS = tuple(
+    (key, f"{key}: {'★' * n}{'☆' * (5 - n)}")
+    for n, (key, _) in enumerate(CHOICES_5, start=1)
+)
+
+
+def _build_question_payload(category: str, idx: int, total: int, text: str) -> dict:
+    """質問Embedの辞書表現（discord.Embed.to_dict と同じ形）"""
+    meta = CATEGORY_META[category]
+    return {
+        "type": "rich",
+        "title": f"{meta['emoji']} {meta['name']} 診断",
+        "color": meta["color"],
+        "fields": [
+            {
+                "name": "📊 進捗",
+                "value": f"{progress_bar(idx + 1, total, 12)}  {idx + 1} / {total}",
+                "inline": False,
+            },
+            {
+                "name": "❓ 質問",
+                "value": f"Q{idx + 1}. {text}",
+                "inline": False,
+            },
+        ],
+        "footer": {"text": QUESTION_EMBED_FOOTER},
+    }
+
+
+# (category, 出題順の位置, 質問ID) → Embed辞書
+# 出題順はユーザーごとにシャッフルされるため、位置と質問IDの全組み合わせを持つ
+_QUESTION_PAYLOADS = MappingProxyType({
+    (cat, idx, qid): _build_question_payload(cat, idx, len(ids), QUESTION_BY_ID[qid]["text"])
+    for cat, ids in CATEGORY_QUESTION_IDS.items()
+    for idx in range(len(ids))
+    for qid in ids
+})
+
+
+def question_embed_payload(category: str, idx: int, qid: int, total: int) -> dict:
+    """
+    質問Embedの辞書を返す（事前レンダリング済みの浅いコピー）
+
+    fields のリストもコピーするので、呼び出し側で add_field してもキャッシュは汚れない。
+    """
+    payload = _QUESTION_PAYLOADS.get((category, idx, qid))
+    if payload is None or total != CATEGORY_QUESTION_COUNT[category]:
+        return _build_question_payload(category, idx, total, QUESTION_BY_ID[qid]["text"])
+    payload = dict(payload)
+    payload["fields"] = list(payload["fields"])
+    return payload
@@ -0,0 +1,104 @@
+"""
+専用診断ルームの登録簿（メモリ上のミラー）
+
+永続化は db_multi の user_rooms テーブルで行い、起動時に load() で読み込む。
+ルームの検索・件数取得はギルドのチャンネル数に関係なく O(1)。
+最終アクティビティはメモリ上で更新し、変更分だけを定期的にDBへ書き出す。
+"""
+import heapq
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+class RoomRegistry:
+    """(guild_id, discord_id) ⇔ channel_id の対応表"""
+
+    def __init__(self):
+        self._by_user: Dict[Tuple[int, int], int] = {}
+        self._by_channel: Dict[int, Tuple[int, int]] = {}
+        self._count_by_guild: Dict[int, int] = {}
+        self._last_activity: Dict[int, float] = {}
+        self._dirty: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._by_channel)
+
+    def load(self, rows: Iterable[Tuple[int, int, int, float]]) -> None:
+        """[(guild_id, discord_id, channel_id, last_activity_epoch), ...] で置き換え"""
+        self._by_user.clear()
+        self._by_channel.clear()
+        self._count_by_guild.clear()
+        self._last_activity.clear()
+        self._dirty.clear()
+        for guild_id, discord_id, channel_id, last_activity in rows:
+            self.add(guild_id, discord_id, channel_id, last_activity)
+        self._dirty.clear()
+
+    def get(self, guild_id: int, discord_id: int) -> Optional[int]:
+        """ユーザーのルームのチャンネルID"""
+        return self._by_user.get((guild_id, discord_id))
+
+    def owner_of(self, channel_id: int) -> Optional[Tuple[int, int]]:
+        """チャンネルの (guild_id, discord_id)。登録されたルームでなければ None"""
+        return self._by_channel.get(channel_id)
+
+    def add(
+        self,
+        guild_id: int,
+        discord_id: int,
+        channel_id: int,
+        last_activity: Optional[float] = None
+    ) -> None:
+        old_channel = self._by_user.get((guild_id, discord_id))
+        if old_channel is not None:
+            self.remove_channel(old_channel)
+        self.remove_channel(channel_id)
+        self._by_user[(guild_id, discord_id)] = channel_id
+        self._by_channel[channel_id] = (guild_id, discord_id)
+        self._count_by_guild[guild_id] = self._count_by_guild.get(guild_id, 0) + 1
+        self._last_activity[channel_id] = time.time() if last_activity is None else last_activity
+
+    def remove_channel(self, channel_id: int) -> bool:
+        """チャンネルの登録を外す（登録されていれば True）"""
+        key = self._by_channel.pop(channel_id, None)
+        if key is None:
+            return False
+        self._by_user.pop(key, None)
+        self._count_by_guild[key[0]] -= 1
+        self._last_activity.pop(channel_id, None)
+        self._dirty.discard(channel_id)
+        return True
+
+    def touch(self, channel_id: int, now: Optional[float] = None) -> None:
+        """ルームでの操作を記録（登録されたルームでなければ何もしない）"""
+        if channel_id in self._by_channel:
+            self._last_activity[channel_id] = time.time() if now is None else now
+            self._dirty.add(channel_id)
+
+    def last_activity(self, channel_id: int) -> Optional[float]:
+        return self._last_activity.get(channel_id)
+
+    def pop_dirty_activity(self) -> List[Tuple[int, float]]:
+        """前回以降に更新された [(channel_id, last_activity), ...] を取り出す"""
+        dirty = [(cid, self._last_activity[cid]) for cid in self._dirty if cid in self._last_activity]
+        self._dirty.clear()
+        return dirty
+
+    def mark_dirty(self, channel_ids: Iterable[int]) -> None:
+        """書き出しに失敗した分を次回に回す（登録が外れたものは無視）"""
+        self._dirty.update(cid for cid in channel_ids if cid in self._last_activity)
+
+    def idle_channels(self, idle_seconds: float, limit: int, now: Optional[float] = None) -> List[int]:
+        """idle_seconds 以上操作のないルームを古い順に最大 limit 件"""
+        deadline = (time.time() if now is None else now) - idle_seconds
+        idle = ((ts, cid) for cid, ts in self._last_activity.items() if ts <= deadline)
+        return [cid for _, cid in heapq.nsmallest(limit, idle)]
+
+    def count(self, guild_id: int) -> int:
+        return self._count_by_guild.get(guild_id, 0)
+
+    def channel_ids(self, guild_id: Optional[int] = None) -> List[int]:
+        return [
+            cid for cid, (g, _) in self._by_channel.items()
+            if guild_id is None or g == guild_id
+        ]
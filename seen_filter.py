@@ -0,0 +1,411 @@
+"""
+既に見た候補ペアの確率的な集合（ユーザー×カテゴリーごとのスケーラブル Bloom フィルター）
+
+- マッチ申請中・成立・不成立の相手（match_search.EXCLUDED_MATCH_STATUSES）と、/match で表示した相手を入れる
+- 申請が期限切れになったら2人のフィルターを matches から作り直し、相手を候補に戻す（削除できないため）
+- ランキングでは上位候補の判定に使い、1件あたり k 回のビット参照（O(1)）で済む
+- 偽陽性率は SEEN_FILTER_FP_RATE で指定。件数が容量を超えたら倍の容量のスライスを足し、
+  スライスごとの偽陽性率を半分ずつにして全体を SEEN_FILTER_FP_RATE 以下に保つ（偽陰性はない）
+- seen_filters テーブルに保存し、起動時に読み込んでから前回以降の matches を取り込む
+  （保存がなければ matches 全体から作り直す）
+
+    python seen_filter.py --rebuild           # 保存分を捨てて matches から作り直す（Bot と同じ設定の DB）
+    python seen_filter.py --rebuild --db synth.db
+    python seen_filter.py --bench             # 偽陽性率と判定速度の計測（DB不要）
+"""
+import os
+import sys
+import math
+import time
+import struct
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+SEEN_FILTER_ENABLED = os.environ.get("SEEN_FILTER", "1") == "1"
+SEEN_FILTER_FP_RATE = float(os.environ.get("SEEN_FILTER_FP_RATE", "0.01"))
+# 最初のスライスの容量（超えるたびに倍の容量のスライスを足す）
+SEEN_FILTER_CAPACITY = int(os.environ.get("SEEN_FILTER_CAPACITY", "64"))
+# /match で表示した候補も入れる（0 ならマッチがある相手だけ）
+SEEN_FILTER_RECORD_SHOWN = os.environ.get("SEEN_FILTER_RECORD_SHOWN", "1") == "1"
+SEEN_FILTER_META_KEY = "seen_filter_match_id"
+
+_MASK64 = (1 << 64) - 1
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BB")
+_SLICE_HEADER = struct.Struct("<IIBI")
+
+
+def _mix(x: int) -> int:
+    """splitmix64 の最終段（user_id を一様な64bitに散らす）"""
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+class _Slice:
+    """固定容量の Bloom フィルター1枚"""
+    __slots__ = ("capacity", "count", "k", "m", "bits")
+
+    def __init__(self, capacity: int, fp_rate: float, k: int = 0, m: int = 0, bits: Optional[bytearray] = None):
+        self.capacity = capacity
+        self.count = 0
+        if not m:
+            m = max(8, int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))))
+            k = max(1, int(round(m / capacity * math.log(2))))
+        self.k = k
+        self.m = m
+        self.bits = bits if bits is not None else bytearray((m + 7) // 8)
+
+    def positions(self, h: int) -> Iterator[int]:
+        # 拡張ダブルハッシュ（Dillinger & Manolios）。m が小さくても位置が偏らない
+        m = self.m
+        x = (h & 0xFFFFFFFF) % m
+        y = (h >> 32) % m
+        for i in range(self.k):
+            yield x
+            x = (x + y) % m
+            y = (y + i) % m
+
+    def contains(self, h: int) -> bool:
+        # 未登録ならたいてい最初の数ビットで外れるので、位置は1つずつ出す
+        bits = self.bits
+        for p in self.positions(h):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def add(self, h: int) -> None:
+        bits = self.bits
+        for p in self.positions(h):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class SeenFilter:
+    """スケーラブル Bloom フィルター（user_id の集合、削除はできない）"""
+    __slots__ = ("fp_rate", "capacity", "slices")
+
+    def __init__(self, fp_rate: float = SEEN_FILTER_FP_RATE, capacity: int = SEEN_FILTER_CAPACITY):
+        self.fp_rate = fp_rate
+        self.capacity = capacity
+        self.slices: List[_Slice] = []
+
+    def __len__(self) -> int:
+        """入れた件数（重複は数えない。偽陽性で入れ損ねた分は含まない）"""
+        return sum(s.count for s in self.slices)
+
+    def __contains__(self, user_id: int) -> bool:
+        h = _mix(user_id)
+        for s in self.slices:
+            if s.contains(h):
+                return True
+        return False
+
+    def add(self, user_id: int) -> bool:
+        """追加（既に入っていると判定されたら何もしないで False）"""
+        h = _mix(user_id)
+        for s in self.slices:
+            if s.contains(h):
+                return False
+        if not self.slices or self.slices[-1].count >= self.slices[-1].capacity:
+            i = len(self.slices)
+            self.slices.append(_Slice(self.capacity << i, self.fp_rate / (2 ** (i + 1))))
+        self.slices[-1].add(h)
+        return True
+
+    def nbytes(self) -> int:
+        return sum(len(s.bits) for s in self.slices)
+
+    def to_bytes(self) -> bytes:
+        parts = [_HEADER.pack(_FORMAT_VERSION, len(self.slices))]
+        for s in self.slices:
+            parts.append(_SLICE_HEADER.pack(s.capacity, s.count, s.k, s.m))
+            parts.append(bytes(s.bits))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(
+        cls,
+        data: bytes,
+        fp_rate: float = SEEN_FILTER_FP_RATE,
+        capacity: int = SEEN_FILTER_CAPACITY,
+    ) -> "SeenFilter":
+        """保存した形式から復元（保存時の容量・k・m をそのまま使い、以降のスライスは現在の設定で足す）"""
+        version, n_slices = _HEADER.unpack_from(data, 0)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"unsupported seen filter format {version}")
+        f = cls(fp_rate, capacity)
+        offset = _HEADER.size
+        for _ in range(n_slices):
+            cap, count, k, m = _SLICE_HEADER.unpack_from(data, offset)
+            offset += _SLICE_HEADER.size
+            size = (m + 7) // 8
+            s = _Slice(cap, fp_rate, k, m, bytearray(data[offset:offset + size]))
+            s.count = count
+            offset += size
+            f.slices.append(s)
+        return f
+
+
+class SeenFilters:
+    """(user_id, category) → SeenFilter（スレッドセーフ）"""
+
+    def __init__(
+        self,
+        fp_rate: float = SEEN_FILTER_FP_RATE,
+        capacity: int = SEEN_FILTER_CAPACITY,
+        record_shown: bool = SEEN_FILTER_RECORD_SHOWN,
+    ):
+        self.fp_rate = fp_rate
+        self.capacity = capacity
+        self.record_shown = record_shown
+        self._filters: Dict[Tuple[int, str], SeenFilter] = {}
+        self._dirty: Set[Tuple[int, str]] = set()
+        self._lock = threading.Lock()
+        # matches の id がここまでのペアは取り込み済み（保存時に schema_meta へ書く）
+        self.match_watermark = 0
+        self.ready = False
+        # 読み込み中に作り直しを頼まれたキー（読み込みの最後に作り直す）
+        self._stale: Set[Tuple[int, str]] = set()
+        # pairs_added / shown_added / checks / loaded / rebuilt / flushed
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def __len__(self) -> int:
+        return len(self._filters)
+
+    def get(self, user_id: int, category: str) -> Optional[SeenFilter]:
+        """ランキング用（まだ何も見ていなければ None）"""
+        return self._filters.get((user_id, category))
+
+    def _add_locked(self, user_id: int, category: str, other_id: int) -> bool:
+        key = (user_id, category)
+        f = self._filters.get(key)
+        if f is None:
+            f = self._filters[key] = SeenFilter(self.fp_rate, self.capacity)
+        if f.add(other_id):
+            self._dirty.add(key)
+            return True
+        return False
+
+    def add_pair(self, user_a: int, user_b: int, category: str) -> None:
+        """マッチ作成時（2人それぞれのフィルターに相手を入れる）"""
+        with self._lock:
+            self._add_locked(user_a, category, user_b)
+            self._add_locked(user_b, category, user_a)
+            self.counters["pairs_added"] += 1
+
+    def add_shown(self, user_id: int, category: str, shown: Iterable[int]) -> None:
+        """/match で表示した候補を本人のフィルターに入れる（SEEN_FILTER_RECORD_SHOWN=0 なら何もしない）"""
+        if not self.record_shown:
+            return
+        with self._lock:
+            for other_id in shown:
+                if self._add_locked(user_id, category, other_id):
+                    self.counters["shown_added"] += 1
+
+    def add_matches(self, rows: Iterable[Tuple[int, int, int, str]]) -> int:
+        """[(match_id, user1_id, user2_id, category), ...] を取り込み、取り込んだ最大の id を進める（ステータスは呼び出し側で絞る）"""
+        n = 0
+        with self._lock:
+            for match_id, user1_id, user2_id, category in rows:
+                self._add_locked(user1_id, category, user2_id)
+                self._add_locked(user2_id, category, user1_id)
+                if match_id > self.match_watermark:
+                    self.match_watermark = match_id
+                n += 1
+        return n
+
+    def rebuild(
+        self,
+        keys: Iterable[Tuple[int, str]],
+        partners: Optional[Callable[[int, str], Iterable[int]]] = None,
+    ) -> int:
+        """
+        keys のフィルターを今のマッチ相手だけで作り直す（期限切れの相手を戻す用。同期I/Oのため to_thread から呼ぶ）
+
+        表示した候補の記録はそのユーザー分だけ失われる。作り直しの間に入ったペアも落ちうるが、
+        申請中の相手は除外リスト（match_search.MatchExclusions）でも外れるので候補には出ない。
+
+        Args:
+            partners: (user_id, category) -> 相手の user_id（省略時は db_multi.get_match_partner_ids を
+                      EXCLUDED_MATCH_STATUSES で呼ぶ）
+        """
+        keys = set(keys)
+        with self._lock:
+            if not self.ready:
+                self._stale |= keys
+                return 0
+        if partners is None:
+            import db_multi
+            from match_search import EXCLUDED_MATCH_STATUSES
+
+            def partners(user_id: int, category: str) -> List[int]:
+                return db_multi.get_match_partner_ids(user_id, category, EXCLUDED_MATCH_STATUSES)
+
+        for user_id, category in keys:
+            f = SeenFilter(self.fp_rate, self.capacity)
+            for other_id in partners(user_id, category):
+                f.add(other_id)
+            with self._lock:
+                self._filters[(user_id, category)] = f
+                self._dirty.add((user_id, category))
+            self.counters["rebuilt"] += 1
+        return len(keys)
+
+    # ---------------------------------------------------------
+    # 永続化（db_multi の seen_filters テーブル）
+    # ---------------------------------------------------------
+    def load(
+        self,
+        rows: Optional[Iterable[Tuple[int, str, bytes]]] = None,
+        match_batches: Optional[Callable[[int], Iterable[List[Tuple[int, int, int, str]]]]] = None,
+        watermark: Optional[int] = None,
+    ) -> Dict[str, float]:
+        """
+        保存済みのフィルターを読み込み、前回以降の matches を取り込む（同期I/Oのため to_thread から呼ぶ）
+
+        Args:
+            rows: [(user_id, category, data), ...]（省略時は db_multi.load_seen_filters）
+            match_batches: after_id -> matches のバッチのイテレーター（省略時は db_multi.iter_match_pairs を
+                           EXCLUDED_MATCH_STATUSES で呼ぶ）
+            watermark: rows に反映済みの matches の最大 id（省略時は schema_meta から）
+        """
+        import db_multi
+        started = time.perf_counter()
+        if rows is None:
+            rows = db_multi.load_seen_filters()
+        if watermark is None:
+            watermark = int(db_multi.get_meta(SEEN_FILTER_META_KEY) or 0)
+        if match_batches is None:
+            from match_search import EXCLUDED_MATCH_STATUSES
+
+            def match_batches(after_id: int) -> Iterator[List[Tuple[int, int, int, str]]]:
+                return db_multi.iter_match_pairs(after_id, statuses=EXCLUDED_MATCH_STATUSES)
+
+        loaded = 0
+        with self._lock:
+            self._filters.clear()
+            self._dirty.clear()
+            for user_id, category, data in rows:
+                try:
+                    self._filters[(int(user_id), category)] = SeenFilter.from_bytes(data, self.fp_rate, self.capacity)
+                except (ValueError, struct.error) as e:
+                    print(f"seen filter for user {user_id} ({category}) is unreadable, rebuilding: {e!r}")
+                    watermark = 0
+                loaded += 1
+            if watermark == 0:
+                # 壊れたものがあれば全体を matches から作り直す（表示した候補の記録は失われる）
+                self._filters.clear()
+            self.match_watermark = watermark
+        self.counters["loaded"] += loaded
+
+        caught_up = 0
+        for batch in match_batches(watermark):
+            caught_up += self.add_matches(batch)
+        with self._lock:
+            self.ready = True
+            stale, self._stale = self._stale, set()
+        if stale:
+            self.rebuild(stale)
+        return {
+            "filters_loaded": loaded,
+            "matches_added": caught_up,
+            "seconds": time.perf_counter() - started,
+        }
+
+    def pop_dirty(self) -> List[Tuple[int, str, bytes]]:
+        """前回以降に変わったフィルターを保存用の形式で取り出す"""
+        with self._lock:
+            keys, self._dirty = self._dirty, set()
+            return [(user_id, category, self._filters[(user_id, category)].to_bytes()) for user_id, category in keys]
+
+    def flush(self) -> int:
+        """変わったフィルターと取り込み済みの matches の id を保存（同期I/Oのため to_thread から呼ぶ）"""
+        import db_multi
+        if not self.ready:
+            return 0
+        watermark = self.match_watermark
+        rows = self.pop_dirty()
+        if rows:
+            db_multi.save_seen_filters(rows)
+            self.counters["flushed"] += len(rows)
+        if watermark != int(db_multi.get_meta(SEEN_FILTER_META_KEY) or 0):
+            db_multi.set_meta(SEEN_FILTER_META_KEY, str(watermark))
+        return len(rows)
+
+    def snapshot(self) -> Dict[str, int]:
+        snap = dict(self.counters)
+        with self._lock:
+            filters = list(self._filters.values())
+            snap["dirty"] = len(self._dirty)
+        snap["filters"] = len(filters)
+        snap["items"] = sum(len(f) for f in filters)
+        snap["bytes"] = sum(f.nbytes() for f in filters)
+        return snap
+
+
+# =========================================================
+# CLI
+# =========================================================
+def _bench(users: int, per_user: int, fp_rate: float) -> None:
+    import random
+    rng = random.Random(0)
+    filters = SeenFilters(fp_rate=fp_rate)
+    seen: Dict[int, Set[int]] = {}
+    t0 = time.perf_counter()
+    for u in range(users):
+        others = set(rng.sample(range(10 ** 6), per_user))
+        seen[u] = others
+        filters.add_shown(u, "friendship", others)
+    build = time.perf_counter() - t0
+
+    false_pos = trials = 0
+    t0 = time.perf_counter()
+    for u in range(users):
+        f = filters.get(u, "friendship")
+        for _ in range(200):
+            x = rng.randrange(10 ** 6, 2 * 10 ** 6)
+            trials += 1
+            false_pos += x in f
+    check = (time.perf_counter() - t0) / trials
+    assert all(x in filters.get(u, "friendship") for u, xs in seen.items() for x in xs)
+    snap = filters.snapshot()
+    print(f"users={users} per_user={per_user} fp_rate={fp_rate}")
+    print(f"build {build:.2f}s  check {check * 1e6:.2f}us  observed fp {false_pos / trials:.4f}")
+    print(f"memory {snap['bytes'] / 1024:.0f}KiB ({snap['bytes'] * 8 / max(1, snap['items']):.1f} bits/item)")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="候補の既読フィルターの作り直し・計測")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--rebuild", action="store_true", help="保存分を捨てて matches から作り直して保存")
+    mode.add_argument("--bench", action="store_true", help="偽陽性率・判定速度・メモリの計測（DB不要）")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--per-user", type=int, default=500)
+    parser.add_argument("--fp-rate", type=float, default=SEEN_FILTER_FP_RATE)
+    parser.add_argument("--db", help="作り直すローカル SQLite ファイル（省略時は Bot と同じ設定の DB）")
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        _bench(args.users, args.per_user, args.fp_rate)
+        return 0
+
+    import db_multi
+    if args.db:
+        db_multi.use_local_db(os.path.abspath(args.db))
+    db_multi.init_db()
+    filters = SeenFilters(fp_rate=args.fp_rate)
+    stats = filters.load(rows=[], watermark=0)
+    db_multi.clear_seen_filters()
+    flushed = filters.flush()
+    snap = filters.snapshot()
+    print(f"rebuilt {flushed} filter(s) from {stats['matches_added']} match(es) in {stats['seconds']:.2f}s "
+          f"({snap['bytes'] / 1024:.0f}KiB, watermark={filters.match_watermark})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+規模試験用の合成ユーザー生成（シードで再現可能）
+
+- カテゴリーごとに CATEGORY_QUESTIONS の全問に回答したユーザー（一部は途中まで）を作る
+- 回答はサブカテゴリー（questions の "category"）ごとの A〜E の分布から引く。
+  ユーザーはサブカテゴリーごとに「傾向」を1つ持ち、consistency の確率でそれを選ぶので、
+  似たユーザー同士の相性が実データのように偏る
+- プロフィール・進捗・質問順・マッチも作り、db_multi.bulk_load で一括投入する（同期は最後に1回）
+
+    python synth_population.py --db synth.db --answers 1000000 --seed 1
+    python synth_population.py --db synth.db --users 50000 --categories gaming --distributions dist.json
+
+分布ファイル（JSON）は A〜E の重みを "default" / サブカテゴリー名 / "カテゴリー.サブカテゴリー" で指定する:
+
+    {"default": [1, 2, 3, 2, 1], "play_time": [3, 2, 2, 2, 1], "gaming.money": [4, 3, 2, 1, 1]}
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import db_multi
+from questions_multi_category import CATEGORY_QUESTIONS
+
+LETTERS = ("A", "B", "C", "D", "E")
+DEFAULT_WEIGHTS = (1.0, 2.0, 3.0, 2.5, 1.5)
+
+_KEYWORDS = [
+    "ゲーム", "アニメ", "音楽", "読書", "旅行", "カフェ", "映画", "スポーツ", "プログラミング", "料理",
+    "写真", "FPS", "RPG", "起業", "デザイン", "語学", "キャンプ", "ボードゲーム", "筋トレ", "投資",
+]
+_TRAITS = ["社交的", "聞き上手", "計画的", "好奇心旺盛", "マイペース", "慎重派", "行動派", "論理的", "穏やか"]
+_MATCH_STATUSES = ("pending", "accepted", "rejected")
+# 回答の文字を引くテーブルの大きさ（2**TABLE_BITS）と、使い回す質問順の数（2**ORDER_POOL_BITS）
+TABLE_BITS = 10
+ORDER_POOL_BITS = 12
+
+
+@dataclass
+class PopulationConfig:
+    users: int = 10000
+    seed: int = 0
+    categories: Sequence[str] = tuple(CATEGORY_QUESTIONS)
+    # 1人が診断するカテゴリー数の重み（1, 2, 3, 4 カテゴリー）
+    categories_per_user: Sequence[float] = (0.55, 0.25, 0.12, 0.08)
+    # 全問回答した割合（残りは途中まで）
+    completion_rate: float = 0.9
+    # 全問回答したうち、プロフィール（AI分析）まで済んでいる割合
+    profile_rate: float = 0.95
+    # サブカテゴリー内で自分の傾向どおりに答える確率
+    consistency: float = 0.6
+    # 全問回答したユーザー1人あたりのマッチ件数
+    matches_per_user: float = 1.0
+    match_status_weights: Sequence[float] = (0.5, 0.3, 0.2)
+    # {"default" | サブカテゴリー | "カテゴリー.サブカテゴリー": [A, B, C, D, E の重み]}
+    distributions: Dict[str, Sequence[float]] = field(default_factory=dict)
+    start_user_id: int = 1
+    discord_id_base: int = 10 ** 17
+
+    def weights_for(self, category: str, subcategory: str) -> Sequence[float]:
+        for key in (f"{category}.{subcategory}", subcategory, "default"):
+            if key in self.distributions:
+                weights = self.distributions[key]
+                if len(weights) != len(LETTERS) or sum(weights) <= 0:
+                    raise ValueError(f"distribution {key!r} needs 5 non-negative weights")
+                return weights
+        return DEFAULT_WEIGHTS
+
+
+def users_for_answers(answers: int, config: PopulationConfig) -> int:
+    """回答件数がおよそ answers 件になるユーザー数"""
+    avg_categories = sum((i + 1) * w for i, w in enumerate(config.categories_per_user)) / sum(config.categories_per_user)
+    avg_questions = sum(len(CATEGORY_QUESTIONS[c]) for c in config.categories) / len(config.categories)
+    # 途中でやめたユーザーは平均して半分まで回答している
+    avg_answered = avg_questions * (config.completion_rate + (1 - config.completion_rate) / 2)
+    return max(1, int(round(answers / (avg_categories * avg_answered))))
+
+
+def _profile_row(rng: random.Random, user_id: int, category: str) -> tuple:
+    keywords = rng.sample(_KEYWORDS, 5)
+    traits = rng.sample(_TRAITS, 3)
+    summary = f"{traits[0]}で{traits[1]}なタイプです。{keywords[0]}と{keywords[1]}が好きです。"
+    analysis = {
+        "personality_summary": summary,
+        "key_traits": [{"trait": t, "comment": f"{t}な一面が回答から読み取れます。"} for t in traits],
+        "match_keywords": keywords,
+    }
+    return (
+        user_id, category, summary,
+        json.dumps(keywords, ensure_ascii=False),
+        json.dumps(analysis, ensure_ascii=False),
+    )
+
+
+def _letter_table(weights: Sequence[float]) -> List[str]:
+    """重みに比例した長さ 2**TABLE_BITS の文字テーブル（getrandbits で1文字引く）"""
+    size = 1 << TABLE_BITS
+    total = float(sum(weights))
+    exact = [w / total * size for w in weights]
+    counts = [int(x) for x in exact]
+    # 端数の大きい順に残りを配る
+    for i in sorted(range(len(exact)), key=lambda i: counts[i] - exact[i])[: size - sum(counts)]:
+        counts[i] += 1
+    return [letter for letter, n in zip(LETTERS, counts) for _ in range(n)]
+
+
+def generate(config: PopulationConfig) -> Dict[str, List[tuple]]:
+    """
+    合成データを生成（db_multi.BULK_COLUMNS の列の並びの行リスト）
+
+    同じ config（seed を含む）からは常に同じ行が生成される。
+    """
+    rng = random.Random(config.seed)
+    categories = [c for c in config.categories if c in CATEGORY_QUESTIONS]
+    if not categories:
+        raise ValueError("no valid categories")
+    max_categories = min(len(categories), len(config.categories_per_user))
+    category_counts = list(range(1, max_categories + 1))
+    category_count_weights = list(config.categories_per_user)[:max_categories]
+
+    # カテゴリー → [(サブカテゴリーの質問ID, 文字テーブル), ...]
+    groups = {}
+    # カテゴリー → 質問順の候補（並び, JSON）。ユーザーごとに shuffle / dumps しない
+    orders_pool = {}
+    for category in categories:
+        by_sub: Dict[str, List[int]] = {}
+        for q in CATEGORY_QUESTIONS[category]:
+            by_sub.setdefault(q.get("category") or "default", []).append(q["id"])
+        groups[category] = [(qids, _letter_table(config.weights_for(category, sub))) for sub, qids in by_sub.items()]
+        qids = [q["id"] for q in CATEGORY_QUESTIONS[category]]
+        pool = []
+        for _ in range(1 << ORDER_POOL_BITS):
+            order = qids[:]
+            rng.shuffle(order)
+            pool.append((order, json.dumps(order)))
+        orders_pool[category] = pool
+
+    users, answers, states, orders, profiles = [], [], [], [], []
+    completed: Dict[str, List[int]] = {c: [] for c in categories}
+    append_answer = answers.append
+    rand = rng.random
+    bits = rng.getrandbits
+    consistency = config.consistency
+
+    for user_id in range(config.start_user_id, config.start_user_id + config.users):
+        users.append((user_id, str(config.discord_id_base + user_id), f"synth{user_id}"))
+        n_categories = rng.choices(category_counts, category_count_weights)[0]
+        for category in rng.sample(categories, n_categories):
+            order, order_json = orders_pool[category][bits(ORDER_POOL_BITS)]
+            is_completed = rand() < config.completion_rate
+            n_answered = len(order) if is_completed else rng.randrange(len(order))
+            answered = None if is_completed else set(order[:n_answered])
+            for qids, table in groups[category]:
+                lean = table[bits(TABLE_BITS)]
+                for qid in qids:
+                    letter = lean if rand() < consistency else table[bits(TABLE_BITS)]
+                    if answered is None or qid in answered:
+                        append_answer((user_id, category, qid, letter))
+            states.append((user_id, category, n_answered))
+            orders.append((user_id, category, order_json))
+            if is_completed:
+                completed[category].append(user_id)
+                if rand() < config.profile_rate:
+                    profiles.append(_profile_row(rng, user_id, category))
+
+    matches = []
+    for category, user_ids in completed.items():
+        if len(user_ids) < 2:
+            continue
+        for _ in range(int(len(user_ids) * config.matches_per_user / 2)):
+            a, b = rng.sample(user_ids, 2)
+            status = rng.choices(_MATCH_STATUSES, config.match_status_weights)[0]
+            matches.append((a, b, category, round(rng.uniform(0.3, 0.95), 3), status))
+
+    return {
+        "users": users,
+        "answers": answers,
+        "user_state": states,
+        "question_order": orders,
+        "user_profiles": profiles,
+        "matches": matches,
+    }
+
+
+def load(config: PopulationConfig, replace: bool = False) -> Dict[str, int]:
+    """生成して現在の接続先 DB に一括投入（テーブル別の行数を返す）"""
+    db_multi.init_db()
+    return db_multi.bulk_load(generate(config), replace=replace)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="規模試験用の合成ユーザーを生成してDBに投入")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--users", type=int, help="ユーザー数")
+    size.add_argument("--answers", type=int, help="回答件数の目安（ユーザー数を逆算）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--categories", help="カンマ区切り（省略時は全カテゴリー）")
+    parser.add_argument("--distributions", help="A〜E の重みを書いた JSON ファイル")
+    parser.add_argument("--completion-rate", type=float, default=0.9)
+    parser.add_argument("--profile-rate", type=float, default=0.95)
+    parser.add_argument("--consistency", type=float, default=0.6)
+    parser.add_argument("--matches-per-user", type=float, default=1.0)
+    parser.add_argument("--start-user-id", type=int, help="最初のユーザーID（省略時は既存の最大ID+1）")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--db", help="投入先のローカル SQLite ファイル")
+    target.add_argument("--configured-db", action="store_true",
+                        help="Bot と同じ設定の DB（DB_BACKEND / Turso）に投入する")
+    parser.add_argument("--replace", action="store_true", help="主キーが重複する行を置き換える")
+    args = parser.parse_args(argv)
+
+    config = PopulationConfig(
+        seed=args.seed,
+        completion_rate=args.completion_rate,
+        profile_rate=args.profile_rate,
+        consistency=args.consistency,
+        matches_per_user=args.matches_per_user,
+    )
+    if args.categories:
+        config.categories = tuple(c.strip() for c in args.categories.split(",") if c.strip())
+    if args.distributions:
+        with open(args.distributions, encoding="utf-8") as f:
+            config.distributions = json.load(f)
+    if args.users is not None:
+        config.users = args.users
+    elif args.answers is not None:
+        config.users = users_for_answers(args.answers, config)
+
+    if args.db:
+        db_multi.use_local_db(os.path.abspath(args.db))
+    db_multi.init_db()
+    config.start_user_id = args.start_user_id if args.start_user_id is not None else db_multi.get_max_user_id() + 1
+
+    t0 = time.perf_counter()
+    rows = generate(config)
+    generated = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    counts = db_multi.bulk_load(rows, replace=args.replace)
+    loaded = time.perf_counter() - t0
+    print(f"users {config.start_user_id}..{config.start_user_id + config.users - 1} (seed={config.seed})")
+    for table, n in counts.items():
+        print(f"  {table:<16} {n:>10}")
+    print(f"generate {generated:.2f}s / load {loaded:.2f}s "
+          f"({counts.get('answers', 0) / max(loaded, 1e-9):,.0f} answers/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
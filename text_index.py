@@ -0,0 +1,352 @@
+"""
+プロフィールのキーワード・自己紹介文のローカル類似度インデックス
+
+文字 n-gram（日本語は単語区切りがないため文字単位）をハッシュ化した
+TF-IDF ベクトルをカテゴリー別に保持し、転置インデックスでコサイン類似度の上位K件を返す。
+外部ライブラリ・LLM呼び出しは不要。
+"""
+import os
+import math
+import heapq
+import zlib
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+# キーワード（match_keywords）は自己紹介文より強く効かせる
+KEYWORD_FIELD_WEIGHT = 2.0
+BIO_FIELD_WEIGHT = 1.0
+NGRAM_SIZES = (2, 3)
+N_FEATURES = 1 << 20
+
+# 回答類似度とのブレンド比率（0でキーワード類似度を使わない）
+TEXT_SIMILARITY_WEIGHT = float(os.environ.get("TEXT_SIMILARITY_WEIGHT", "0.2"))
+
+# 文書数がこの比率以上変化したら IDF とノルムを再計算する
+_IDF_REFRESH_RATIO = 0.1
+# 文書の2割以上に出る n-gram（「です」など）は top_k で候補を集めるのに使わない
+# （候補の上位は全特徴で採点し直すので、返すスコアはコサイン類似度のまま。文書が少ないうちは全部使う）
+_MAX_QUERY_DF_RATIO = 0.2
+_MIN_DOCS_FOR_DF_CAP = 1000
+_RESCORE_FACTOR = 20
+_MIN_RESCORE = 200
+
+
+def normalize_text(text: str) -> str:
+    """NFKC正規化・小文字化し、空白と記号を除去"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return "".join(ch for ch in text if ch.isalnum())
+
+
+def char_ngrams(text: str, sizes: Tuple[int, ...] = NGRAM_SIZES) -> List[str]:
+    """文字 n-gram を列挙（n より短い語はそのまま1トークン）"""
+    text = normalize_text(text)
+    if not text:
+        return []
+    grams = []
+    for n in sizes:
+        if len(text) < n:
+            continue
+        grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams or [text]
+
+
+@lru_cache(maxsize=1 << 16)
+def _feature(gram: str) -> int:
+    # hash() はプロセスごとに値が変わるため crc32 を使う
+    return zlib.crc32(gram.encode("utf-8")) % N_FEATURES
+
+
+def vectorize_profile(bio: str, interests: Iterable[str]) -> Dict[int, float]:
+    """プロフィールを特徴ID→重み付き出現数（TF）に変換"""
+    tf: Dict[int, float] = defaultdict(float)
+    keyword_grams = Counter(g for kw in interests or [] for g in char_ngrams(str(kw)))
+    for gram, count in keyword_grams.items():
+        tf[_feature(gram)] += count * KEYWORD_FIELD_WEIGHT
+    for gram, count in Counter(char_ngrams(bio or "")).items():
+        tf[_feature(gram)] += count * BIO_FIELD_WEIGHT
+    # 長文が有利になりすぎないよう対数TF
+    return {f: 1.0 + math.log(w) if w >= 1 else w for f, w in tf.items()}
+
+
+def blend_scores(answer_score: float, text_score: float, weight: float = TEXT_SIMILARITY_WEIGHT) -> float:
+    """回答類似度とキーワード類似度を線形にブレンド（0.0〜1.0）"""
+    return answer_score * (1.0 - weight) + text_score * weight
+
+
+# =========================================================
+# カテゴリー単位のインデックス
+# =========================================================
+class TextIndex:
+    """1カテゴリー分のハッシュ TF-IDF 転置インデックス（スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs: Dict[int, Dict[int, float]] = {}
+        self._postings: Dict[int, Dict[int, float]] = defaultdict(dict)
+        self._df: Counter = Counter()
+        self._norms: Dict[int, float] = {}
+        self._idf_cache: Dict[int, float] = {}
+        self._idf_doc_count = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __contains__(self, doc_id: int) -> bool:
+        return doc_id in self._docs
+
+    def _idf(self, feature: int) -> float:
+        # IDF は再計算時点の値を使う（文書数が大きく変わるまで固定）
+        idf = self._idf_cache.get(feature)
+        if idf is None:
+            n = max(len(self._docs), self._idf_doc_count)
+            idf = math.log((1 + n) / (1 + self._df.get(feature, 0))) + 1.0
+        return idf
+
+    def _norm(self, tf: Dict[int, float]) -> float:
+        return math.sqrt(sum((w * self._idf(f)) ** 2 for f, w in tf.items())) or 1.0
+
+    def _maybe_refresh_norms(self, force: bool = False) -> None:
+        n = len(self._docs)
+        if not force and abs(n - self._idf_doc_count) <= max(1, self._idf_doc_count) * _IDF_REFRESH_RATIO:
+            return
+        self._idf_cache = {f: math.log((1 + n) / (1 + df)) + 1.0 for f, df in self._df.items()}
+        self._idf_doc_count = n
+        self._norms = {doc_id: self._norm(tf) for doc_id, tf in self._docs.items()}
+
+    def _insert_locked(self, doc_id: int, tf: Dict[int, float]) -> None:
+        self._docs[doc_id] = tf
+        for f, w in tf.items():
+            self._postings[f][doc_id] = w
+            self._df[f] += 1
+
+    def _remove_locked(self, doc_id: int) -> None:
+        tf = self._docs.pop(doc_id, None)
+        if tf is None:
+            return
+        for f in tf:
+            posting = self._postings.get(f)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[f]
+            self._df[f] -= 1
+            if self._df[f] <= 0:
+                del self._df[f]
+        self._norms.pop(doc_id, None)
+
+    def upsert(self, doc_id: int, bio: str, interests: Iterable[str]) -> None:
+        """文書を追加または置き換え（増分更新）"""
+        tf = vectorize_profile(bio, interests)
+        with self._lock:
+            self._remove_locked(doc_id)
+            if not tf:
+                return
+            self._insert_locked(doc_id, tf)
+            self._norms[doc_id] = self._norm(tf)
+            self._maybe_refresh_norms()
+
+    def bulk_load(self, docs: Iterable[Tuple[int, str, Iterable[str]]]) -> None:
+        """まとめて投入し、IDF とノルムを最後に1回だけ計算する"""
+        with self._lock:
+            for doc_id, bio, interests in docs:
+                self._remove_locked(doc_id)
+                tf = vectorize_profile(bio, interests)
+                if tf:
+                    self._insert_locked(doc_id, tf)
+            self._maybe_refresh_norms(force=True)
+
+    def remove(self, doc_id: int) -> None:
+        with self._lock:
+            self._remove_locked(doc_id)
+            self._maybe_refresh_norms()
+
+    def _dot(self, q: Dict[int, float], tf: Dict[int, float]) -> float:
+        # q は IDF を掛けたクエリ、tf は文書の TF（短い方を回す）
+        if len(tf) < len(q):
+            return sum(w * self._idf(f) * q[f] for f, w in tf.items() if f in q)
+        return sum(qw * tf[f] * self._idf(f) for f, qw in q.items() if f in tf)
+
+    def _scores_for(self, query_tf: Dict[int, float], k: int, q_norm: float) -> Dict[int, float]:
+        q = {f: w * self._idf(f) for f, w in query_tf.items() if f in self._postings}
+        n_docs = len(self._docs)
+        max_df = n_docs * _MAX_QUERY_DF_RATIO if n_docs >= _MIN_DOCS_FOR_DF_CAP else n_docs
+
+        partial: Dict[int, float] = defaultdict(float)
+        common = []
+        for f, qw in q.items():
+            if self._df[f] > max_df:
+                common.append(f)
+                continue
+            idf = self._idf(f)
+            for doc_id, dw in self._postings[f].items():
+                partial[doc_id] += qw * dw * idf
+        if not common:
+            return {d: min(1.0, s / (q_norm * self._norms.get(d, 1.0))) for d, s in partial.items()}
+
+        # よくある n-gram は候補集めに使わず、珍しい n-gram の部分スコアの上位だけ全特徴で採点し直す
+        if len(partial) < k:
+            for f in common:
+                for doc_id in self._postings[f]:
+                    partial.setdefault(doc_id, 0.0)
+        shortlist = heapq.nlargest(
+            max(k * _RESCORE_FACTOR, _MIN_RESCORE),
+            partial.items(),
+            key=lambda x: x[1] / self._norms.get(x[0], 1.0),
+        )
+        return {
+            d: min(1.0, self._dot(q, self._docs[d]) / (q_norm * self._norms.get(d, 1.0)))
+            for d, _ in shortlist
+        }
+
+    def top_k(
+        self,
+        k: int = 10,
+        doc_id: Optional[int] = None,
+        bio: str = "",
+        interests: Iterable[str] = (),
+        exclude: Optional[Set[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        コサイン類似度の上位K件を返す
+
+        doc_id を指定するとその文書をクエリにする（自分自身は除外）。
+        """
+        with self._lock:
+            if doc_id is not None:
+                query_tf = self._docs.get(doc_id, {})
+                q_norm = self._norms.get(doc_id, 1.0)
+            else:
+                query_tf = vectorize_profile(bio, interests)
+                q_norm = self._norm(query_tf)
+            if not query_tf:
+                return []
+            scores = self._scores_for(query_tf, k + len(exclude or ()) + 1, q_norm)
+        skip = set(exclude or ())
+        if doc_id is not None:
+            skip.add(doc_id)
+        candidates = ((d, s) for d, s in scores.items() if d not in skip)
+        return heapq.nlargest(k, candidates, key=lambda x: x[1])
+
+    def similarities(self, doc_id: int, candidates: Iterable[int]) -> Dict[int, float]:
+        """
+        doc_id と候補それぞれのコサイン類似度（候補が少ない前提で直接内積を取る）
+
+        ランキングで回答類似度の上位候補にだけブレンドする用途向け。
+        """
+        with self._lock:
+            query_tf = self._docs.get(doc_id)
+            if not query_tf:
+                return {}
+            q = {f: w * self._idf(f) for f, w in query_tf.items()}
+            q_norm = self._norms.get(doc_id, 1.0)
+            result = {}
+            for c in candidates:
+                tf = self._docs.get(c)
+                if not tf:
+                    result[c] = 0.0
+                    continue
+                result[c] = min(1.0, self._dot(q, tf) / (q_norm * self._norms.get(c, 1.0)))
+        return result
+
+
+class ProfileTextIndex:
+    """カテゴリー別 TextIndex のコンテナ（初回アクセス時にDBから構築）"""
+
+    def __init__(self, loader: Optional[Callable[[str], List[Tuple[int, str, List[str]]]]] = None):
+        """
+        Args:
+            loader: category -> [(user_id, bio, interests), ...]（省略時は db_multi.load_profile_texts）
+        """
+        self._loader = loader
+        self._indexes: Dict[str, TextIndex] = {}
+        self._lock = threading.Lock()
+
+    def is_built(self, category: str) -> bool:
+        return category in self._indexes
+
+    def get(self, category: str) -> TextIndex:
+        """カテゴリーのインデックスを返す（未構築なら構築。同期I/Oのため to_thread から呼ぶ）"""
+        index = self._indexes.get(category)
+        if index is not None:
+            return index
+        with self._lock:
+            index = self._indexes.get(category)
+            if index is None:
+                index = self._build(category)
+                self._indexes[category] = index
+        return index
+
+    def _build(self, category: str) -> TextIndex:
+        loader = self._loader
+        if loader is None:
+            from db_multi import load_profile_texts
+            loader = load_profile_texts
+        index = TextIndex()
+        index.bulk_load(loader(category))
+        return index
+
+    def upsert(self, category: str, user_id: int, bio: str, interests: Iterable[str]) -> None:
+        """構築済みのカテゴリーだけ増分更新（未構築なら次回 get() 時にDBから読まれる）"""
+        index = self._indexes.get(category)
+        if index is not None:
+            index.upsert(user_id, bio, interests)
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    rng = random.Random(0)
+    words = ["ゲーム", "アニメ", "音楽", "読書", "旅行", "カフェ", "映画", "スポーツ", "FPS", "RPG",
+             "プログラミング", "料理", "写真", "起業", "デザイン", "語学", "キャンプ", "ボードゲーム"]
+    # 実データに近い語彙の広がりを出すため、基本語を2つ組み合わせた複合語を作る
+    words = [a + b for a in words for b in words if a != b]
+    index = TextIndex()
+    n_docs = 50000
+    docs = []
+    for i in range(n_docs):
+        kws = rng.sample(words, 5)
+        docs.append((i, f"{kws[0]}と{kws[1]}が好きな{rng.choice(['社交的', '穏やか', '計画的'])}なタイプです。", kws))
+    t0 = time.perf_counter()
+    index.bulk_load(docs)
+    build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for doc_id, bio, kws in docs[:500]:
+        index.upsert(doc_id, bio + "よろしく", kws)
+    upsert = (time.perf_counter() - t0) / 500
+
+    t0 = time.perf_counter()
+    n_queries = 50
+    for i in range(n_queries):
+        index.top_k(10, doc_id=i)
+    query = (time.perf_counter() - t0) / n_queries
+
+    t0 = time.perf_counter()
+    for i in range(n_queries):
+        index.similarities(i, range(1000, 1200))
+    sims = (time.perf_counter() - t0) / n_queries
+    # top_k のスコアは similarities と同じコサイン類似度
+    for i in range(20):
+        found = index.top_k(10, doc_id=i)
+        exact = index.similarities(i, [d for d, _ in found])
+        assert found and all(abs(score - exact[d]) < 1e-9 for d, score in found), i
+
+    # 文書が少なくても、似た文書同士（共通の n-gram が多い）が見つかる
+    small = TextIndex()
+    small.bulk_load([
+        (1, "ゲームとアニメが好きです", ["ゲーム", "アニメ"]),
+        (2, "ゲームとアニメが好きです", ["ゲーム", "アニメ", "音楽"]),
+        (3, "読書が好きです", ["読書"]),
+        (4, "旅行が好きです", ["旅行"]),
+    ])
+    brute = small.similarities(1, [2, 3, 4])
+    expected = sorted(((d, s) for d, s in brute.items() if s > 0), key=lambda x: -x[1])
+    assert [d for d, _ in small.top_k(3, doc_id=1)] == [d for d, _ in expected], (small.top_k(3, doc_id=1), brute)
+
+    print(f"docs={n_docs} bulk_load={build:.2f}s upsert={upsert * 1000:.2f}ms top_k(10)={query * 1000:.1f}ms/query "
+          f"similarities(200)={sims * 1000:.2f}ms/query")
+    print(index.top_k(5, bio="", interests=["ボードゲームカフェ"]))
@@ -0,0 +1,329 @@
+"""
+インタラクション処理の軽量トレーシング（スパン）
+
+- span() / traced() でスパンを張る。親子関係は contextvars で追跡するため、
+  asyncio のタスク内でも asyncio.to_thread 先（db_multi など）でも親スパンにぶら下がる
+- ルートスパンが終わった時点でサンプリングし、残すトレースは JSONL（1行1トレース）に書き出す
+  （TRACE_SAMPLE_RATE の確率、または TRACE_SLOW_SECONDS 以上かかったものは必ず残す）
+- python tracing.py [traces.jsonl] で遅いトレースとクリティカルパスの内訳を表示
+
+    with tracing.span("fetch_message", message_id=mid):
+        ...
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import asyncio
+import argparse
+import functools
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# 0 で通常のトレースは残さない（遅いものだけ）
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+# この秒数以上かかったトレースはサンプリングに関係なく残す（0 で無効）
+TRACE_SLOW_SECONDS = float(os.environ.get("TRACE_SLOW_SECONDS", "2.0"))
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+TRACING_ENABLED = os.environ.get("TRACING", "1") == "1" and (TRACE_SAMPLE_RATE > 0 or TRACE_SLOW_SECONDS > 0)
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class _Trace:
+    """1つのルートスパン配下で終わったスパンの集まり"""
+    __slots__ = ("trace_id", "spans", "lock", "next_id", "root_start")
+
+    def __init__(self):
+        self.trace_id = f"{random.getrandbits(64):016x}"
+        self.spans: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.next_id = 0
+        # スパンの開始時刻はルートスパンの開始からの相対秒で記録する
+        self.root_start = time.perf_counter()
+
+    def new_span_id(self) -> int:
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "start", "wall_start")
+
+    def __init__(self, trace: _Trace, name: str, parent_id: Optional[int], attrs: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = trace.new_span_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+
+    def set(self, **attrs) -> None:
+        """スパンに属性を追加"""
+        self.attrs.update(attrs)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Any]:
+    """スパンを張る（現在のスパンがなければ新しいトレースのルートになる）"""
+    if not TRACING_ENABLED:
+        yield _NOOP
+        return
+    parent = _current.get()
+    trace = parent.trace if parent is not None else _Trace()
+    s = Span(trace, name, parent.span_id if parent is not None else None, attrs)
+    token = _current.set(s)
+    error = None
+    try:
+        yield s
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        duration = time.perf_counter() - s.start
+        record = {
+            "id": s.span_id,
+            "parent": s.parent_id,
+            "name": name,
+            "start": round(s.start - trace.root_start, 6),
+            "duration": round(duration, 6),
+            "thread": threading.current_thread().name,
+        }
+        if s.attrs:
+            record["attrs"] = s.attrs
+        if error:
+            record["error"] = error
+        with trace.lock:
+            trace.spans.append(record)
+        if parent is None:
+            _finish_trace(trace, s, duration)
+
+
+def traced(name: Optional[str] = None):
+    """関数全体をスパンにするデコレーター（同期・非同期どちらも可）"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# =========================================================
+# 書き出し
+# =========================================================
+_write_queue: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+_writer_started = False
+_writer_lock = threading.Lock()
+
+
+def _writer_loop(path: str) -> None:
+    while True:
+        line = _write_queue.get()
+        if line is None:
+            return
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+                # まとまって届いた分は同じファイルハンドルで書く
+                while True:
+                    try:
+                        more = _write_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if more is None:
+                        return
+                    f.write(more)
+        except OSError as e:
+            print(f"trace write failed: {e!r}")
+
+
+def _ensure_writer() -> None:
+    global _writer_started
+    if _writer_started:
+        return
+    with _writer_lock:
+        if not _writer_started:
+            threading.Thread(target=_writer_loop, args=(TRACE_FILE,), name="trace-writer", daemon=True).start()
+            _writer_started = True
+
+
+def _finish_trace(trace: _Trace, root: Span, duration: float) -> None:
+    slow = TRACE_SLOW_SECONDS > 0 and duration >= TRACE_SLOW_SECONDS
+    if not slow and random.random() >= TRACE_SAMPLE_RATE:
+        return
+    with trace.lock:
+        spans = list(trace.spans)
+    line = json.dumps({
+        "trace_id": trace.trace_id,
+        "name": root.name,
+        "timestamp": root.wall_start,
+        "duration": round(duration, 6),
+        "slow": slow,
+        "spans": spans,
+    }, ensure_ascii=False, default=str)
+    _ensure_writer()
+    _write_queue.put(line + "\n")
+
+
+# =========================================================
+# 集計（python tracing.py [traces.jsonl]）
+# =========================================================
+def load_traces(path: str) -> List[Dict[str, Any]]:
+    traces = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    traces.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # 書きかけの行
+    return traces
+
+
+def critical_path(trace: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    トレース全体の長さを決めたスパンの列（開始順、depth 付き）
+
+    各スパンの中で、終わりから逆向きに「直前に終わっていた子」をたどって直列の子の鎖を求め、
+    それを再帰的に展開する。並行して走っていて全体の長さに効かなかった子は含めない。
+    各要素の self は子スパンで説明できない自分自身の時間。
+    """
+    children: Dict[Optional[int], List[Dict[str, Any]]] = defaultdict(list)
+    for s in trace["spans"]:
+        children[s.get("parent")].append(s)
+    roots = children.get(None) or []
+    if not roots:
+        return []
+
+    path: List[Dict[str, Any]] = []
+
+    def expand(node: Dict[str, Any], depth: int) -> None:
+        kids = children.get(node["id"], [])
+        covered = _union_length([(k["start"], k["start"] + k["duration"]) for k in kids])
+        path.append({**node, "depth": depth, "self": max(0.0, node["duration"] - covered)})
+        chain = []
+        t = node["start"] + node["duration"] + 1e-6
+        remaining = list(kids)
+        while remaining:
+            before = [k for k in remaining if k["start"] + k["duration"] <= t]
+            if not before:
+                break
+            last = max(before, key=lambda k: k["start"] + k["duration"])
+            chain.append(last)
+            t = last["start"] + 1e-6
+            remaining = [k for k in before if k is not last and k["start"] + k["duration"] <= t]
+        for child in reversed(chain):
+            expand(child, depth + 1)
+
+    expand(roots[0], 0)
+    return path
+
+
+def _union_length(intervals: List[tuple]) -> float:
+    """重なりを除いた区間の合計長（並行する子スパンを二重に数えない）"""
+    total = 0.0
+    end = float("-inf")
+    for a, b in sorted(intervals):
+        if b <= end:
+            continue
+        total += b - max(a, end)
+        end = b
+    return total
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def summarize(traces: List[Dict[str, Any]], top: int = 10, name: Optional[str] = None) -> str:
+    """遅いトレース上位とスパン名別の所要時間をテキストで返す"""
+    if name:
+        traces = [t for t in traces if t["name"] == name]
+    if not traces:
+        return "no traces"
+    lines = [f"{len(traces)} trace(s)"]
+
+    lines.append("")
+    lines.append(f"slowest {min(top, len(traces))}:")
+    for t in sorted(traces, key=lambda t: -t["duration"])[:top]:
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t.get("timestamp", 0)))
+        lines.append(f"  {t['duration'] * 1000:8.1f}ms  {t['name']}  {stamp}  trace={t['trace_id']}")
+        for step in critical_path(t):
+            attrs = " ".join(f"{k}={v}" for k, v in (step.get("attrs") or {}).items())
+            err = f" error={step['error']}" if step.get("error") else ""
+            indent = "  " * step["depth"]
+            lines.append(
+                f"      {step['duration'] * 1000:8.1f}ms (self {step['self'] * 1000:7.1f}ms)  "
+                f"{indent}{step['name']} {attrs}{err}".rstrip()
+            )
+
+    # スパン名別: 件数・p50/p95・クリティカルパス上の自己時間の合計比率
+    durations: Dict[str, List[float]] = defaultdict(list)
+    critical_self: Dict[str, float] = defaultdict(float)
+    for t in traces:
+        for s in t["spans"]:
+            durations[s["name"]].append(s["duration"])
+        for step in critical_path(t):
+            critical_self[step["name"]] += step["self"]
+    total_critical = sum(critical_self.values()) or 1.0
+
+    lines.append("")
+    lines.append(f"  {'span':<36} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'critical %':>10}")
+    for span_name, values in sorted(durations.items(), key=lambda x: -critical_self.get(x[0], 0.0)):
+        lines.append(
+            f"  {span_name:<36} {len(values):>7} {_percentile(values, 50) * 1000:>9.1f} "
+            f"{_percentile(values, 95) * 1000:>9.1f} {critical_self.get(span_name, 0.0) / total_critical * 100:>9.1f}%"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="トレース（JSONL）の集計")
+    parser.add_argument("path", nargs="?", default=TRACE_FILE)
+    parser.add_argument("--top", type=int, default=10, help="表示する遅いトレースの数")
+    parser.add_argument("--name", help="ルートスパン名で絞り込む（例: handle_answer）")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.path):
+        print(f"{args.path} not found (set TRACE_SAMPLE_RATE / TRACE_SLOW_SECONDS to record traces)")
+        return 1
+    print(summarize(load_traces(args.path), args.top, args.name))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())